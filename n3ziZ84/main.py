@@ -1,23 +1,48 @@
+import asyncio
 import io
+import logging
+import time
+from contextlib import asynccontextmanager
+
 import numpy as np
 import librosa
 import soundfile as sf
 import pyloudnorm as pyln
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Response
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
 
+import keys
+
+logger = logging.getLogger(__name__)
+
+# Set by the warm-up; `/ready` reports not-ready until it has finished, and for good if it failed.
+warm_up_state: Dict[str, Any] = {"ready": False, "seconds": None, "error": None}
+READY_RETRY_AFTER_SECONDS = 5
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Runs the warm-up in the background, so the service answers `/ready` while it runs."""
+    warm_up_task = asyncio.ensure_future(asyncio.to_thread(warm_up))
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="QA Service",
     description="A microservice to perform automated quality assurance on audio files.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # --- Pydantic Models for Response ---
 class AnalysisDetails(BaseModel):
     tempo: float
     key: str
+    key_confidence: float
     lufs: float
     clipping: bool
 
@@ -25,35 +50,18 @@ class AnalysisResponse(BaseModel):
     status: str
     details: AnalysisDetails
 
-# --- Helper Functions for Audio Analysis ---
-
-def estimate_key(y: np.ndarray, sr: int) -> str:
-    """Estimates the musical key of an audio signal using Krumhansl-Schmuckler profiles."""
-    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    
-    major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-    minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
-
-    chromagram = librosa.feature.chroma_stft(y=y, sr=sr)
-    chroma_vector = np.sum(chromagram, axis=1)
-    
-    if np.sum(chroma_vector) > 0:
-        chroma_vector /= np.sum(chroma_vector)
+class ReadinessResponse(BaseModel):
+    ready: bool
+    warm_up_seconds: Optional[float] = None
+    error: Optional[str] = None
 
-    correlations = []
-    for i in range(12):
-        major_corr = np.corrcoef(chroma_vector, np.roll(major_profile, i))[0, 1]
-        correlations.append((major_corr, f"{notes[i]} major"))
-        
-        minor_corr = np.corrcoef(chroma_vector, np.roll(minor_profile, i))[0, 1]
-        correlations.append((minor_corr, f"{notes[i]} minor"))
-        
-    if not correlations:
-        return "N/A"
+# --- Helper Functions for Audio Analysis ---
 
-    best_corr, best_key = max(correlations, key=lambda item: item[0] if not np.isnan(item[0]) else -1)
-    
-    return best_key if not np.isnan(best_corr) else "N/A"
+def estimate_key(y: np.ndarray, sr: int) -> keys.KeyEstimate:
+    """Estimates the musical key of an audio signal using Krumhansl-Schmuckler profiles (see keys.py)."""
+    # Same chroma as the style-analysis service, so both services agree on the key of a track.
+    chromagram = librosa.feature.chroma_cqt(y=y, sr=sr)
+    return keys.estimate_key(chromagram)
 
 def analyze_audio_data(data: np.ndarray, sr: int) -> Dict[str, Any]:
     """Performs all audio analyses and returns a dictionary of results."""
@@ -81,11 +89,35 @@ def analyze_audio_data(data: np.ndarray, sr: int) -> Dict[str, Any]:
 
     return {
         "tempo": float(tempo),
-        "key": key,
+        "key": key.key,
+        "key_confidence": key.confidence,
         "lufs": float(lufs) if lufs > -np.inf else -99.0,
         "clipping": bool(is_clipping),
     }
 
+def warm_up() -> None:
+    """
+    Runs every analysis once on a short synthetic stereo signal, so librosa's
+    lazy imports and numba compilation (beat tracking, CQT) happen at startup
+    rather than on the first real request.
+    """
+    started = time.perf_counter()
+    sr = 44100
+    t = np.arange(4 * sr) / sr
+    # An A minor triad with a click on every beat at 120 BPM.
+    y = sum(0.2 * np.sin(2 * np.pi * f * t) for f in (220.0, 261.63, 329.63))
+    y[(t % 0.5) < 0.01] += 0.5
+    try:
+        analyze_audio_data(np.stack([y, y], axis=1).astype(np.float32), sr)
+    except Exception as e:
+        # The analysis path is broken, so the service must not report ready.
+        warm_up_state["error"] = f"{type(e).__name__}: {e}"
+        logger.error(f"QA warm-up failed: {warm_up_state['error']}")
+    warm_up_state["seconds"] = time.perf_counter() - started
+    warm_up_state["ready"] = warm_up_state["error"] is None
+    if warm_up_state["ready"]:
+        logger.info(f"QA warm-up finished in {warm_up_state['seconds']:.1f}s")
+
 # --- API Endpoint ---
 @app.post("/analyze", response_model=AnalysisResponse, tags=["Analysis"])
 async def create_analysis(file: UploadFile = File(...)):
@@ -94,18 +126,25 @@ async def create_analysis(file: UploadFile = File(...)):
 
     - **file**: The audio file to analyze (e.g., .wav, .mp3, .flac).
     """
-    if not file.content_type or not (file.content_type.startswith("audio/") or file.content_type == "application/octet-stream"):
-        raise HTTPException(status_code=400, detail=f"Invalid file Content-Type: {file.content_type}. Please upload an audio file.")
+    content_type = file.content_type
+    if not content_type or not (content_type.startswith("audio/") or content_type == "application/octet-stream"):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file Content-Type: {content_type}. Please upload an audio file."
+        )
 
     try:
         file_content = await file.read()
         file_buffer = io.BytesIO(file_content)
 
+        # (samples, channels), the layout pyloudnorm expects.
         data, samplerate = sf.read(file_buffer, dtype='float32', always_2d=True)
-        data = data.T # Transpose to get (channels, samples) for librosa/pyloudnorm
 
     except Exception as e:
-        raise HTTPException(status_code=422, detail=f"Could not read audio file. It may be corrupted or in an unsupported format. Error: {str(e)}")
+        raise HTTPException(
+            status_code=422,
+            detail=f"Could not read audio file. It may be corrupted or in an unsupported format. Error: {str(e)}"
+        )
         
     try:
         analysis_results = analyze_audio_data(data, samplerate)
@@ -117,6 +156,19 @@ async def create_analysis(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred during audio analysis: {str(e)}")
 
+@app.get("/ready", response_model=ReadinessResponse, tags=["Health"])
+async def ready(response: Response):
+    """
+    Answers 200 once the warm-up has finished, and 503 (with `Retry-After`)
+    until then. A failed warm-up answers 503 with its `error` and no
+    `Retry-After`.
+    """
+    if not warm_up_state["ready"]:
+        response.status_code = 503
+        if warm_up_state["error"] is None:
+            response.headers["Retry-After"] = str(READY_RETRY_AFTER_SECONDS)
+    return {"ready": warm_up_state["ready"], "warm_up_seconds": warm_up_state["seconds"], "error": warm_up_state["error"]}
+
 @app.get("/", include_in_schema=False)
 async def root():
     return {"message": "QA Service is running. POST to /analyze to check an audio file."}
@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Tuple
+
+from .schemas import StructuredPrompt, CacheStats
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case-folds a prompt and collapses runs of whitespace, so equivalent prompts share a cache key."""
+    return " ".join(prompt.split()).casefold()
+
+
+def _normalized_offsets(prompt: str) -> Tuple[List[int], List[int]]:
+    """
+    Maps each character of `normalize_prompt(prompt)` back to the prompt: the
+    index of the character it came from, and the index just past it. A
+    collapsed whitespace run maps to the whole run.
+    """
+    starts: List[int] = []
+    ends: List[int] = []
+    gap_start = None
+    for i, char in enumerate(prompt):
+        if char.isspace():
+            if gap_start is None:
+                gap_start = i
+            continue
+        if gap_start is not None and starts:
+            starts.append(gap_start)
+            ends.append(i)
+        gap_start = None
+        # Case folding can expand a character ("ß" -> "ss").
+        for _ in char.casefold():
+            starts.append(i)
+            ends.append(i + 1)
+    return starts, ends
+
+
+class PromptCache:
+    """
+    A bounded, thread-safe LRU cache in front of a prompt parsing function.
+
+    Prompts are normalized before lookup and before parsing, so a cached result
+    is exactly what the parser returns for every prompt sharing that key. The
+    entity spans of the result are then mapped back onto the prompt as sent,
+    so they index into the caller's text, not the normalized key.
+    Callers always receive a deep copy; the cached `StructuredPrompt` itself is
+    never handed out and cannot be mutated from outside.
+    """
+
+    def __init__(self, parse_fn: Callable[[str], StructuredPrompt], maxsize: int = 4096):
+        if maxsize < 0:
+            raise ValueError("maxsize must be zero or positive.")
+        self.parse_fn = parse_fn
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, StructuredPrompt]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # Bumped by clear(); a parse that started before a clear must not repopulate the cache.
+        self._generation = 0
+
+    def parse(self, prompt: str) -> StructuredPrompt:
+        """Returns the parsed prompt, from the cache when possible."""
+        key = normalize_prompt(prompt)
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._for_prompt(cached, prompt, key)
+            self._misses += 1
+            generation = self._generation
+
+        # Parse outside the lock; concurrent misses on the same key simply parse twice.
+        result = self.parse_fn(key)
+
+        if self.maxsize:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = result
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                        self._evictions += 1
+
+        return self._for_prompt(result, prompt, key)
+
+    @staticmethod
+    def _for_prompt(result: StructuredPrompt, prompt: str, key: str) -> StructuredPrompt:
+        """Copies a cached result, with its entity spans moved from the normalized key onto `prompt`."""
+        result = result.model_copy(deep=True)
+        if prompt != key and result.entities:
+            starts, ends = _normalized_offsets(prompt)
+            for entity in result.entities:
+                entity.start, entity.end = starts[entity.start], ends[entity.end - 1]
+        return result
+
+    def clear(self) -> None:
+        """Drops every cached entry, e.g. after the vocabulary changed. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self) -> CacheStats:
+        """Returns a snapshot of the cache counters."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                size=len(self._entries),
+                maxsize=self.maxsize,
+                hit_rate=self._hits / lookups if lookups else 0.0,
+            )
@@ -0,0 +1,172 @@
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from wordfreq import zipf_frequency
+
+from .matcher import KeywordMatch, iter_surface_forms
+
+# Upper bound on the distinct padded trigrams a single edit can destroy (4 for a transposition).
+TRIGRAMS_PER_EDIT = 4
+# Characters that may separate the words of one multi-word window ("lo-fy", "drum n bas").
+_WORD_SEPARATORS = " \t\n\r\f\v-"
+
+
+def _trigrams(text: str) -> Set[str]:
+    """Returns the set of character trigrams of a string padded with one boundary marker per side."""
+    padded = f"${text}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_edit_distance(a: str, b: str, max_distance: int) -> Optional[int]:
+    """
+    Returns the optimal string alignment distance between two strings
+    (insertions, deletions, substitutions and adjacent transpositions),
+    or None as soon as it is certain to exceed `max_distance`.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+
+    previous_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return None
+        previous_previous, previous = previous, current
+
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+class FuzzyIndex:
+    """
+    Trigram inverted index for approximate vocabulary lookups.
+
+    Each surface form (term or alias) is indexed by its character trigrams.
+    A query only computes edit distances against forms that can possibly be
+    within the distance threshold: one edit (including an adjacent
+    transposition) changes at most four distinct trigrams, so a form within
+    distance `k` shares at least `|T(query)| - 4k` of the query's trigrams and
+    must appear in the postings of any `4k + 1` of them. Only the rarest ones
+    are read, so the cost of a lookup depends on a few short postings lists
+    rather than on the size of the vocabulary.
+
+    A query that is itself a common English word ("stings", "rocky",
+    "baseline") is taken as written, since being one edit away from a form
+    ("strings", "rock", "bassline") does not make it a typo. Word frequencies
+    come from `wordfreq`; `common_words` adds rarer words close to a form
+    ("vocab" and "vocal") that are never matched approximately either.
+    """
+
+    def __init__(
+        self,
+        vocabularies: Dict[str, List[str]],
+        aliases: Optional[Dict[str, Dict[str, str]]] = None,
+        common_words: Iterable[str] = (),
+    ):
+        # surface form -> [(category, priority, canonical term)]
+        self._forms: Dict[str, List[Tuple[str, int, str]]] = {}
+        self._postings: Dict[str, List[str]] = defaultdict(list)
+        self._form_trigrams: Dict[str, FrozenSet[str]] = {}
+
+        for category, priority, surface, term in iter_surface_forms(vocabularies, aliases):
+            form = " ".join(surface.lower().split())
+            if not form:
+                continue
+            if form not in self._forms:
+                self._forms[form] = []
+                self._form_trigrams[form] = frozenset(_trigrams(form))
+                for trigram in self._form_trigrams[form]:
+                    self._postings[trigram].append(form)
+            if (category, priority, term) not in self._forms[form]:
+                self._forms[form].append((category, priority, term))
+
+        self.common_words = frozenset(" ".join(word.lower().split()) for word in common_words)
+        self.max_words = max((form.count(" ") + 1 for form in self._forms), default=0)
+
+    def lookup(self, query: str, max_distance: int) -> List[Tuple[str, int]]:
+        """Returns (surface form, distance) pairs within `max_distance` of the query, closest first."""
+        query_trigrams = _trigrams(query)
+        # Prefix filter: a form sharing at least |T(query)| - 4k trigrams must contain one of
+        # any 4k + 1 query trigrams, so only the postings of the rarest ones are read.
+        needed = len(query_trigrams) - TRIGRAMS_PER_EDIT * max_distance
+        probes = sorted(query_trigrams, key=lambda trigram: len(self._postings.get(trigram, ())))
+        if needed > 0:
+            probes = probes[:len(query_trigrams) - needed + 1]
+
+        candidates: Set[str] = set()
+        for trigram in probes:
+            candidates.update(self._postings.get(trigram, ()))
+
+        results = []
+        for form in candidates:
+            # Length and count filters, then the exact (bounded) distance on the few survivors.
+            if abs(len(form) - len(query)) > max_distance:
+                continue
+            form_trigrams = self._form_trigrams[form]
+            shared = len(query_trigrams & form_trigrams)
+            if shared < max(len(query_trigrams), len(form_trigrams)) - TRIGRAMS_PER_EDIT * max_distance:
+                continue
+            distance = bounded_edit_distance(query, form, max_distance)
+            if distance is not None:
+                results.append((form, distance))
+
+        results.sort(key=lambda item: (item[1], item[0]))
+        return results
+
+    def finditer(
+        self,
+        text: str,
+        words: Sequence[Tuple[int, int]],
+        max_distance: int = 1,
+        min_length: int = 5,
+        max_word_frequency: float = 3.0,
+    ) -> Iterator[KeywordMatch]:
+        """
+        Yields approximate vocabulary hits for the given word spans of `text`.
+
+        The spans are typically the words an exact scan left open. Windows of
+        adjacent words shorter than `min_length` characters are skipped, since
+        they are too short to tell a typo from a different word, and so are
+        the listed common words. A single word with candidates is still taken
+        as written when its Zipf frequency in English is at least
+        `max_word_frequency` (3.0 is about once per million words). At each
+        word the longest window (up to the longest multi-word form) that
+        matches is taken.
+        """
+        if max_distance <= 0 or not self._forms:
+            return
+
+        i = 0
+        while i < len(words):
+            consumed = 1
+            for size in range(min(self.max_words, len(words) - i), 0, -1):
+                window = words[i:i + size]
+                # Only join words that are adjacent in the text (separated by whitespace and hyphens alone).
+                gaps = (text[a_end:b_start] for (_, a_end), (b_start, _) in zip(window, window[1:]))
+                if any(gap.strip(_WORD_SEPARATORS) for gap in gaps):
+                    continue
+                start, end = window[0][0], window[-1][1]
+                query = " ".join(text[start:end].lower().split())
+                if len(query) < min_length or query in self.common_words:
+                    continue
+                candidates = [(form, distance) for form, distance in self.lookup(query, max_distance) if distance > 0]
+                if not candidates:
+                    continue
+                # Only single words with candidates are looked up, so most words never reach the frequency table.
+                if size == 1 and zipf_frequency(query, "en") >= max_word_frequency:
+                    continue
+                best_distance = candidates[0][1]
+                for form, distance in candidates:
+                    if distance != best_distance:
+                        break
+                    confidence = 1 - distance / max(len(query), len(form))
+                    for category, priority, term in self._forms[form]:
+                        yield KeywordMatch(category, term, start, end, priority, distance, confidence)
+                consumed = size
+                break
+            i += consumed
@@ -1,15 +1,58 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import ValidationError
+from typing import Iterable, Iterator, List
+import asyncio
+import io
+import json
+import logging
 import os
 
-from .schemas import PromptRequest, StructuredPrompt
-from .parser import parse_prompt
+from .schemas import PromptRequest, StructuredPrompt, BatchPromptRequest, CacheStats
+from .parser import parse_prompt, vocabulary_store
+from .cache import PromptCache
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Number of NDJSON result lines sent per response chunk when streaming a batch.
+STREAM_CHUNK_LINES = 256
+# Largest batch accepted, in prompts and in request body bytes; beyond either the request gets a 413.
+BATCH_MAX_PROMPTS = int(os.getenv("PROMPT_BATCH_MAX_PROMPTS", "10000"))
+BATCH_MAX_BYTES = int(os.getenv("PROMPT_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+# Maximum number of distinct (normalized) prompts kept in the parse result cache. 0 disables caching.
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "4096"))
+# How often the vocabulary data file is checked for changes. 0 disables hot reload.
+VOCABULARY_RELOAD_SECONDS = float(os.getenv("PROMPT_VOCABULARY_RELOAD_SECONDS", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+async def _watch_vocabulary():
+    """Polls the vocabulary file and swaps in a rebuilt index when it changes."""
+    while True:
+        await asyncio.sleep(VOCABULARY_RELOAD_SECONDS)
+        try:
+            # The index is rebuilt in a worker thread so the event loop keeps serving requests.
+            if await asyncio.to_thread(vocabulary_store.reload_if_changed):
+                prompt_cache.clear()
+        except Exception as e:
+            logger.error(f"Vocabulary reload failed: {e}", exc_info=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    watcher = asyncio.create_task(_watch_vocabulary()) if VOCABULARY_RELOAD_SECONDS > 0 else None
+    yield
+    if watcher:
+        watcher.cancel()
+
 
 app = FastAPI(
     title="AI Music Production Assistant - Prompt Parser",
     description="A service to parse natural language music prompts into a structured format.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -20,6 +63,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+prompt_cache = PromptCache(parse_prompt, maxsize=PROMPT_CACHE_SIZE)
+
 # Get the directory of the current file to locate index.html
 static_files_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -41,7 +86,125 @@ async def create_parsed_prompt(request: PromptRequest):
         raise HTTPException(status_code=400, detail="Prompt cannot be empty.")
 
     try:
-        structured_prompt = parse_prompt(request.prompt)
+        structured_prompt = prompt_cache.parse(request.prompt)
         return structured_prompt
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+
+
+@app.get("/api/v1/parse/cache/stats", response_model=CacheStats, tags=["Parsing"])
+async def read_cache_stats():
+    """
+    Returns hit, miss and eviction counters for the parse result cache.
+    """
+    return prompt_cache.stats()
+
+
+def _parse_to_json_lines(prompts: Iterable[str]) -> Iterator[bytes]:
+    """Parses prompts in order and serializes each result straight to a JSON document."""
+    for prompt in prompts:
+        yield prompt_cache.parse(prompt).model_dump_json().encode()
+
+
+def _chunk_lines(lines: Iterable[bytes], size: int = STREAM_CHUNK_LINES) -> Iterator[bytes]:
+    """Groups result lines into larger chunks so streaming costs one send per chunk, not per prompt."""
+    chunk: List[bytes] = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield b"".join(chunk)
+            chunk = []
+    if chunk:
+        yield b"".join(chunk)
+
+
+def _parse_ndjson_lines(body: bytes) -> Iterator[bytes]:
+    """
+    Yields one NDJSON result line per non-blank input line of an NDJSON request body.
+
+    Each input line is either a JSON object with a `prompt` key or a bare JSON string.
+    A malformed line yields an `{"error": ..., "line": n}` object in its place, so the
+    output stays aligned with the input.
+    """
+    for line_number, raw_line in enumerate(io.BytesIO(body), start=1):
+        if not raw_line.strip():
+            continue
+        try:
+            item = json.loads(raw_line)
+            prompt = item if isinstance(item, str) else PromptRequest.model_validate(item).prompt
+            yield prompt_cache.parse(prompt).model_dump_json().encode() + b"\n"
+        except (ValueError, ValidationError) as e:
+            yield json.dumps({"error": f"Invalid NDJSON line: {e}", "line": line_number}).encode() + b"\n"
+
+
+async def _read_batch_body(request: Request) -> bytes:
+    """Reads the request body, refusing it with a 413 as soon as it exceeds `BATCH_MAX_BYTES`."""
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"A batch body may be at most {BATCH_MAX_BYTES} bytes.")
+    chunks: List[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"A batch body may be at most {BATCH_MAX_BYTES} bytes.")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _check_batch_size(count: int) -> None:
+    if count > BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=413, detail=f"A batch may hold at most {BATCH_MAX_PROMPTS} prompts, got {count}.")
+
+
+@app.post(
+    "/api/v1/parse/batch",
+    response_model=List[StructuredPrompt],
+    tags=["Parsing"],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": BatchPromptRequest.model_json_schema()},
+                NDJSON_MEDIA_TYPE: {"schema": {"type": "string", "description": "One JSON prompt object per line."}},
+            },
+        }
+    },
+)
+async def create_parsed_prompts_batch(request: Request):
+    """
+    Parses many prompts in a single request and returns the results in input order.
+
+    - `application/json` body `{"prompts": [...]}` returns a JSON list, or an NDJSON
+      stream when the request sends `Accept: application/x-ndjson`.
+    - `application/x-ndjson` body (one `{"prompt": ...}` per line) streams the results
+      back as NDJSON, one line per non-blank input line.
+
+    Blank prompts produce an empty `StructuredPrompt` instead of failing the batch.
+    A batch of more than `PROMPT_BATCH_MAX_PROMPTS` prompts, or a body larger
+    than `PROMPT_BATCH_MAX_BYTES`, is refused with 413.
+    """
+    body = await _read_batch_body(request)
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(NDJSON_MEDIA_TYPE):
+        _check_batch_size(sum(1 for line in body.splitlines() if line.strip()))
+        # A synchronous iterator is consumed in Starlette's thread pool, off the event loop.
+        return StreamingResponse(_chunk_lines(_parse_ndjson_lines(body)), media_type=NDJSON_MEDIA_TYPE)
+
+    try:
+        batch = await asyncio.to_thread(BatchPromptRequest.model_validate_json, body)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+    _check_batch_size(len(batch.prompts))
+
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        lines = (line + b"\n" for line in _parse_to_json_lines(batch.prompts))
+        return StreamingResponse(_chunk_lines(lines), media_type=NDJSON_MEDIA_TYPE)
+
+    try:
+        # Results are serialized directly, bypassing per-item response_model validation. Parsing
+        # runs in a worker thread, so a large batch does not stall the event loop.
+        body = await asyncio.to_thread(lambda: b"[" + b",".join(_parse_to_json_lines(batch.prompts)) + b"]")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+    return Response(content=body, media_type="application/json")
@@ -0,0 +1,231 @@
+import re
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# Characters inside a vocabulary term that are matched loosely, so that
+# "lo-fi", "lo fi" and "lofi" or "high-energy" and "high energy" all hit.
+_SEPARATOR_PATTERNS = {
+    " ": r"\s+",
+    "-": r"\s*-?\s*",
+}
+_SEPARATOR_CHARS_RE = re.compile(r"[\s-]+")
+# Endings a vocabulary term may take and still count as that term: plurals only.
+_INFLECTION_PATTERN = r"(?:e?s)?"
+
+
+class KeywordMatch(NamedTuple):
+    """A single entity hit (vocabulary term or pattern capture) inside a prompt."""
+    category: str
+    term: str
+    start: int
+    end: int
+    priority: int = 0  # position of the term in its vocabulary; lower wins
+    distance: int = 0  # edit distance for approximate hits, 0 for exact ones
+    confidence: float = 1.0
+
+
+class ScanResult(NamedTuple):
+    """Everything found by one pass over a prompt."""
+    matches: List[KeywordMatch]
+    # Spans of the words no exact hit explains, left for fuzzy matching.
+    open_words: List[Tuple[int, int]]
+
+
+def iter_surface_forms(
+    vocabularies: Dict[str, List[str]], aliases: Optional[Dict[str, Dict[str, str]]] = None
+) -> Iterator[Tuple[str, int, str, str]]:
+    """
+    Yields (category, priority, surface form, canonical term) for every term and alias.
+
+    An alias takes the priority of its canonical term.
+    """
+    for category, terms in vocabularies.items():
+        priorities: Dict[str, int] = {}
+        for priority, term in enumerate(terms):
+            priorities.setdefault(term, priority)
+            yield category, priority, term, term
+        for alias, canonical in (aliases or {}).get(category, {}).items():
+            if canonical not in priorities:
+                raise ValueError(f"Alias '{alias}' refers to unknown {category} '{canonical}'.")
+            yield category, priorities[canonical], alias, canonical
+
+
+def group_matches(matches: Iterable[KeywordMatch], categories: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Collects the distinct terms per category, best first.
+
+    Exact hits rank ahead of approximate ones; ties are broken by vocabulary
+    position, so the first entry of a category is the highest-priority hit.
+    """
+    found: Dict[str, Dict[str, Tuple[int, int]]] = {category: {} for category in categories}
+    for match in matches:
+        rank = (match.distance, match.priority)
+        terms = found.setdefault(match.category, {})
+        if match.term not in terms or rank < terms[match.term]:
+            terms[match.term] = rank
+
+    return {
+        category: sorted(terms, key=terms.__getitem__)
+        for category, terms in found.items()
+    }
+
+
+class _TrieNode:
+    __slots__ = ("children", "terminal")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.terminal = False
+
+
+def _compact(text: str) -> str:
+    """Reduces a term or matched span to a separator-free lookup key."""
+    return _SEPARATOR_CHARS_RE.sub("", text.lower())
+
+
+def _trie_to_pattern(node: _TrieNode) -> str:
+    """
+    Compiles a character trie into a regex fragment.
+
+    Children are tried before the terminal (empty) branch, so the regex engine
+    prefers the longest vocabulary term at each position ("reese bass" over
+    "bass", "synthwave" over "synth").
+    """
+    alternatives = []
+    for char in sorted(node.children):
+        char_pattern = _SEPARATOR_PATTERNS.get(char, re.escape(char))
+        alternatives.append(char_pattern + _trie_to_pattern(node.children[char]))
+
+    if not alternatives:
+        return ""
+
+    body = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+    if node.terminal:
+        body = "(?:" + body + ")?"
+    return body
+
+
+class KeywordMatcher:
+    """
+    Precompiled, single-pass tokenizer for keyword vocabularies and entity patterns.
+
+    All terms of all categories are folded into one character trie which is
+    compiled into a regular expression, together with any extra entity
+    patterns (tempo, key, ...) and a catch-all word alternative. A prompt is
+    therefore scanned once, regardless of how many terms the vocabularies
+    contain, and the regex only ever explores the trie branches that the text
+    actually follows.
+
+    Matches are non-overlapping and leftmost-longest: a span consumed by a
+    longer term (e.g. the genre "drum and bass") is not reported again for a
+    shorter one (e.g. the instrument "bass"). Pattern alternatives are tried
+    before vocabulary terms at each position. Terms match whole words, plus
+    an optional plural "s"/"es" ("synths", "basses"); other derived words
+    ("popular", "darkness") are not hits, and compounds such as "bassline"
+    are listed as aliases instead.
+
+    Vocabulary terms inside a pattern's captured value are reported as well,
+    and those that end the value are cut from it: "in the style of the
+    chemical brothers house" is the reference "the chemical brothers" and the
+    genre "house".
+    """
+
+    def __init__(
+        self,
+        vocabularies: Dict[str, List[str]],
+        aliases: Optional[Dict[str, Dict[str, str]]] = None,
+        patterns: Optional[Dict[str, str]] = None,
+    ):
+        """
+        `patterns` maps extra entity categories to regex fragments. Each fragment
+        must contain a named group called after its category, which captures the
+        entity value; the whole fragment match is the entity span.
+        """
+        self.categories = list(vocabularies)
+        self.pattern_categories = list(patterns or {})
+        root = _TrieNode()
+        # compact key -> [(category, priority, canonical term)]
+        self._lookup: Dict[str, List[Tuple[str, int, str]]] = {}
+
+        # An alias matches like a term but reports, and ranks as, its canonical term.
+        for category, priority, surface, term in iter_surface_forms(vocabularies, aliases):
+            self._add(root, category, priority, surface, term)
+
+        # Every alternative is wrapped in an outer named group, which closes last,
+        # so `match.lastgroup` tells which kind of token was found.
+        alternatives = [f"(?P<_pattern_{category}>{pattern})" for category, pattern in (patterns or {}).items()]
+        trie_pattern = _trie_to_pattern(root)
+        if trie_pattern:
+            alternatives.append(r"(?P<_vocabulary>\b(?P<_term>" + trie_pattern + r")" + _INFLECTION_PATTERN + r"(?!\w))")
+        # Hyphenated compounds are split, so "super-dark" still yields "dark".
+        alternatives.append(r"(?P<_word>\w+)")
+        self._regex = re.compile("|".join(alternatives), re.IGNORECASE)
+
+    def _add(self, root: _TrieNode, category: str, priority: int, surface: str, term: str) -> None:
+        """Inserts one surface form into the trie and records which term it stands for."""
+        normalized = " ".join(surface.lower().split())
+        if not normalized:
+            return
+        entries = self._lookup.setdefault(_compact(normalized), [])
+        if (category, priority, term) not in entries:
+            entries.append((category, priority, term))
+        node = root
+        for char in normalized:
+            node = node.children.setdefault(char, _TrieNode())
+        node.terminal = True
+
+    def scan(self, text: str) -> ScanResult:
+        """Tokenizes the text in one pass into entity hits and the words left open for fuzzy matching."""
+        matches: List[KeywordMatch] = []
+        open_words: List[Tuple[int, int]] = []
+
+        for match in self._regex.finditer(text):
+            kind = match.lastgroup
+            if kind == "_word":
+                open_words.append(match.span())
+            elif kind == "_vocabulary":
+                start, end = match.span()
+                for category, priority, term in self._lookup.get(_compact(match.group("_term")), ()):
+                    matches.append(KeywordMatch(category, term, start, end, priority))
+            else:
+                matches.extend(self._pattern_hits(text, match))
+
+        return ScanResult(matches, open_words)
+
+    def _pattern_hits(self, text: str, match: "re.Match[str]") -> List[KeywordMatch]:
+        """The hit of a pattern match, after the vocabulary hits inside its value, which are returned with it."""
+        category = match.lastgroup[len("_pattern_"):]
+        value_start, value_end = match.span(category)
+        end = match.end()
+        nested: List[KeywordMatch] = []
+        for inner in self._regex.finditer(text, value_start, value_end):
+            if inner.lastgroup == "_vocabulary":
+                for term_category, priority, term in self._lookup.get(_compact(inner.group("_term")), ()):
+                    nested.append(KeywordMatch(term_category, term, inner.start(), inner.end(), priority))
+
+        trimmed_end = value_end
+        for hit in reversed(nested):
+            if text[hit.end:trimmed_end].strip():
+                break
+            trimmed_end = hit.start
+        if trimmed_end < value_end:
+            end = value_start + len(text[value_start:trimmed_end].rstrip())
+        value = text[value_start:trimmed_end].strip()
+        if not value:
+            return nested
+        return [KeywordMatch(category, value, match.start(), end)] + nested
+
+    def finditer(self, text: str) -> Iterator[KeywordMatch]:
+        """Yields every vocabulary hit in the order it appears in the text."""
+        vocabulary_categories = set(self.categories)
+        for match in self.scan(text).matches:
+            if match.category in vocabulary_categories:
+                yield match
+
+    def match(self, text: str) -> Dict[str, List[str]]:
+        """
+        Scans the text once and returns the distinct terms found per category.
+
+        Terms are ordered by their position in the source vocabulary, so the
+        first entry of a category is the highest-priority hit.
+        """
+        return group_matches(self.finditer(text), self.categories)
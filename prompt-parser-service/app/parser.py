@@ -1,72 +1,105 @@
+import os
 import re
-from typing import List, Optional, Dict, Any
+from typing import List
 
-from .schemas import StructuredPrompt
+from .schemas import StructuredPrompt, Entity
+from .vocabulary import VocabularyStore, DEFAULT_VOCABULARY_PATH, Vocabulary
+from .matcher import KeywordMatch, group_matches
 
-# These could be loaded from a config file or database in a real application.
-KNOWN_GENRES = [
-    "drum and bass", "dnb", "house", "techno", "trance", "dubstep", "hip hop",
-    "ambient", "lo-fi", "synthwave", "trap", "pop", "rock", "jazz"
-]
-KNOWN_INSTRUMENTS = [
-    "piano", "guitar", "bass", "drums", "synth", "vocal", "strings",
-    "brass", "pads", "arp", "lead", "reese bass"
-]
-KNOWN_MOODS = [
-    "high-energy", "energetic", "chill", "relaxed", "dark", "aggressive",
-    "melancholic", "sad", "euphoric", "uplifting", "groovy", "funky"
-]
+# Non-vocabulary entities. Each pattern captures its value in a group named after the
+# entity type; all of them are compiled with the vocabulary into one single-pass scanner.
+ENTITY_PATTERNS = {
+    "tempo": r'\b(?P<tempo>\d{2,3})\s*bpm',
+    "key": r'(?:\bin (?:the )?key of )?\b(?P<key>[A-G][#b]? (?:major|minor|maj|min))\b',
+    # Names stop before a tempo or a key, so "in the style of daft punk 128 bpm" still yields the tempo,
+    # while names with digits ("deadmau5", "blink-182", "the 1975") are kept whole.
+    "style_reference": (
+        r'in the style of (?P<style_reference>[\w\s-]+?)'
+        r'(?=\s+at|\s+in|\s+with|\s+\d{2,3}\s*bpm|\s+[A-G][#b]? (?:major|minor|maj|min)\b|$|,)'
+    ),
+}
+KEY_QUALITY_REGEX = re.compile(r'\b(maj|min)\b')
 
-KEY_REGEX = re.compile(
-    r'in (?:the )?key of ([A-G][#b]? (?:major|minor|maj|min))|([A-G][#b]? (?:major|minor|maj|min))', 
-    re.IGNORECASE
-)
-BPM_REGEX = re.compile(r'(\d{2,3})\s*bpm', re.IGNORECASE)
-STYLE_REGEX = re.compile(r'in the style of ([\w\s-]+?)(?=\s+at|\s+in|\s+with|$|,)', re.IGNORECASE)
+# Vocabularies (terms and aliases) live in a data file and are indexed once at startup.
+# The store swaps in a rebuilt index when the file changes; see VocabularyStore.
+VOCABULARY_PATH = os.getenv("PROMPT_VOCABULARY_PATH", DEFAULT_VOCABULARY_PATH)
+vocabulary_store = VocabularyStore(VOCABULARY_PATH, patterns=ENTITY_PATTERNS)
 
+# Approximate matching for typos ("techo", "synthwav"). A distance of 0 disables it;
+# words shorter than the minimum length, the vocabulary's `common_words`, and English words at least
+# as frequent as the maximum Zipf frequency ("stings", "rocky") are never fuzzy-matched.
+FUZZY_MAX_DISTANCE = int(os.getenv("PROMPT_FUZZY_MAX_DISTANCE", "1"))
+FUZZY_MIN_LENGTH = int(os.getenv("PROMPT_FUZZY_MIN_LENGTH", "5"))
+FUZZY_MAX_WORD_FREQUENCY = float(os.getenv("PROMPT_FUZZY_MAX_WORD_FREQUENCY", "3.0"))
 
-def _normalize_key(match: re.Match) -> str:
-    """Normalizes a found key into a consistent format from regex match groups."""
-    key_str = match.group(1) or match.group(2)
-    if not key_str:
-        return ""
 
-    key_str = key_str.lower().replace('maj', 'major').replace('min', 'minor')
+def _normalize_key(key_str: str) -> str:
+    """Normalizes a found key into a consistent format, e.g. "c# min" -> "C# Minor"."""
+    key_str = KEY_QUALITY_REGEX.sub(r'\1or', key_str.lower())  # maj -> major, min -> minor
     parts = key_str.split()
     return " ".join([p[0].upper() + p[1:] for p in parts])
 
+def _find_entities(vocabulary: Vocabulary, prompt: str) -> List[KeywordMatch]:
+    """Finds every entity in one scan, then fuzzy-matches the words the scan left open."""
+    scan = vocabulary.matcher.scan(prompt)
+    if FUZZY_MAX_DISTANCE <= 0 or not scan.open_words:
+        return scan.matches
+
+    fuzzy = list(vocabulary.fuzzy.finditer(
+        prompt,
+        scan.open_words,
+        max_distance=FUZZY_MAX_DISTANCE,
+        min_length=FUZZY_MIN_LENGTH,
+        max_word_frequency=FUZZY_MAX_WORD_FREQUENCY,
+    ))
+    if not fuzzy:
+        return scan.matches
+    return sorted(scan.matches + fuzzy, key=lambda hit: hit.start)
+
 def parse_prompt(prompt: str) -> StructuredPrompt:
     """
     Parses a natural language prompt to extract musical entities using regex and keyword matching.
-    """
-    lower_prompt = prompt.lower()
-    parsed_data: Dict[str, Any] = {
-        "instruments": [],
-        "style_references": [],
-    }
 
-    # 1. Extract BPM
-    bpm_match = BPM_REGEX.search(lower_prompt)
-    parsed_data["tempo"] = int(bpm_match.group(1)) if bpm_match else None
-
-    # 2. Extract Key
-    key_match = KEY_REGEX.search(lower_prompt)
-    parsed_data["key"] = _normalize_key(key_match) if key_match else None
-
-    # 3. Extract Style References
-    style_match = STYLE_REGEX.search(lower_prompt)
-    if style_match:
-        parsed_data["style_references"].append(style_match.group(1).strip().title())
+    The prompt is tokenized once; every entity is reported in `entities` with its
+    character span in `prompt` and a confidence, while the single-valued fields
+    keep their first-match (tempo, key) or best-match (genre, mood) semantics.
+    """
+    vocabulary = vocabulary_store.current
+    hits = _find_entities(vocabulary, prompt)
 
-    # 4. Extract Genre (first match wins)
-    parsed_data["genre"] = next((genre for genre in KNOWN_GENRES if re.search(r'\b' + re.escape(genre) + r'\b', lower_prompt)), None)
+    entities: List[Entity] = []
+    tempos: List[int] = []
+    keys: List[str] = []
+    style_references: List[str] = []
+    for hit in hits:
+        if hit.category == "tempo":
+            value = hit.term
+            tempos.append(int(value))
+        elif hit.category == "key":
+            value = _normalize_key(hit.term)
+            keys.append(value)
+        elif hit.category == "style_reference":
+            value = hit.term.title()
+            if value not in style_references:
+                style_references.append(value)
+        else:
+            value = hit.term
+        entities.append(Entity(
+            type=hit.category, value=value, start=hit.start, end=hit.end, confidence=round(hit.confidence, 3)
+        ))
 
-    # 5. Extract Instruments
-    for instrument in KNOWN_INSTRUMENTS:
-        if re.search(r'\b' + re.escape(instrument) + r'\b', lower_prompt):
-            parsed_data["instruments"].append(instrument)
+    # Genre and mood keep the best hit (exact before fuzzy, then vocabulary order);
+    # instruments keep all of them.
+    vocabulary_hits = group_matches(hits, vocabulary.matcher.categories)
 
-    # 6. Extract Mood (first match wins)
-    parsed_data["mood"] = next((mood for mood in KNOWN_MOODS if re.search(r'\b' + re.escape(mood).replace('-', r'\s*-?\s*') + r'\b', lower_prompt)), None)
-            
-    return StructuredPrompt(**parsed_data)
+    return StructuredPrompt(
+        tempo=tempos[0] if tempos else None,
+        key=keys[0] if keys else None,
+        genre=next(iter(vocabulary_hits["genre"]), None),
+        instruments=vocabulary_hits["instrument"],
+        style_references=style_references,
+        mood=next(iter(vocabulary_hits["mood"]), None),
+        genres=vocabulary_hits["genre"],
+        moods=vocabulary_hits["mood"],
+        entities=entities,
+    )
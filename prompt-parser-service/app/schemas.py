@@ -7,6 +7,16 @@ class PromptRequest(BaseModel):
     """
     prompt: str = Field(..., description="The natural language prompt to be parsed.")
 
+class Entity(BaseModel):
+    """
+    A single entity found in the prompt, with its location and match confidence.
+    """
+    type: str = Field(..., description="Entity type: tempo, key, style_reference, genre, instrument or mood.", example="genre")
+    value: str = Field(..., description="The normalized entity value.", example="drum and bass")
+    start: int = Field(..., description="Start character offset of the match in the parsed prompt.", example=16)
+    end: int = Field(..., description="End character offset (exclusive) of the match in the parsed prompt.", example=19)
+    confidence: float = Field(..., description="1.0 for exact matches, lower for approximate ones.", example=1.0)
+
 class StructuredPrompt(BaseModel):
     """
     Defines the structured output of the parsing service.
@@ -15,9 +25,52 @@ class StructuredPrompt(BaseModel):
     tempo: Optional[int] = Field(None, description="The beats per minute (BPM) of the track.", example=128)
     key: Optional[str] = Field(None, description="The musical key of the track.", example="C# Minor")
     genre: Optional[str] = Field(None, description="The primary genre of the track.", example="House")
-    instruments: List[str] = Field(default_factory=list, description="A list of requested instruments.", example=["piano", "synth bass"])
-    style_references: List[str] = Field(default_factory=list, description="A list of artist or track style references.", example=["Daft Punk", "Skrillex"])
+    instruments: List[str] = Field(
+        default_factory=list,
+        description="A list of requested instruments.",
+        example=["piano", "synth bass"]
+    )
+    style_references: List[str] = Field(
+        default_factory=list,
+        description="A list of artist or track style references.",
+        example=["Daft Punk", "Skrillex"]
+    )
     mood: Optional[str] = Field(None, description="The desired mood or feel of the track.", example="energetic")
+    genres: List[str] = Field(
+        default_factory=list,
+        description="Every genre found, best match first. `genre` is the first entry.",
+        example=["house", "techno"]
+    )
+    moods: List[str] = Field(
+        default_factory=list,
+        description="Every mood found, best match first. `mood` is the first entry.",
+        example=["energetic", "dark"]
+    )
+    entities: List[Entity] = Field(
+        default_factory=list,
+        description="All entities found, in prompt order, with character spans and confidence."
+    )
 
     class Config:
         from_attributes = True
+
+class BatchPromptRequest(BaseModel):
+    """
+    Defines the shape of a batch parse request.
+    """
+    prompts: List[str] = Field(
+        ...,
+        description="The natural language prompts to be parsed, in order.",
+        example=["128bpm house music with piano", "A chill lo-fi track in C major"]
+    )
+
+class CacheStats(BaseModel):
+    """
+    Defines the counters reported by the parse result cache.
+    """
+    hits: int = Field(..., description="Lookups answered from the cache.", example=9120)
+    misses: int = Field(..., description="Lookups that had to run the parser.", example=880)
+    evictions: int = Field(..., description="Entries dropped to stay within the size bound.", example=0)
+    size: int = Field(..., description="Number of entries currently cached.", example=880)
+    maxsize: int = Field(..., description="Maximum number of cached entries.", example=4096)
+    hit_rate: float = Field(..., description="Fraction of lookups answered from the cache.", example=0.912)
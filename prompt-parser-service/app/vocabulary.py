@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .matcher import KeywordMatcher
+from .fuzzy import FuzzyIndex
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ("genre", "instrument", "mood")
+DEFAULT_VOCABULARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vocabulary.json")
+
+
+class Vocabulary(NamedTuple):
+    """An immutable snapshot of the vocabularies together with their prebuilt indexes."""
+    terms: Dict[str, List[str]]
+    aliases: Dict[str, Dict[str, str]]
+    matcher: KeywordMatcher
+    fuzzy: FuzzyIndex
+    version: int
+
+
+def load_vocabulary(path: str, version: int = 0, patterns: Optional[Dict[str, str]] = None) -> Vocabulary:
+    """
+    Loads the vocabulary data file and builds its exact and fuzzy indexes.
+
+    `patterns` are extra entity regexes compiled into the same single-pass
+    matcher (see `KeywordMatcher`).
+
+    The file is a JSON object with one entry per category, each holding an
+    ordered `terms` list (earlier terms win for single-valued fields) and an
+    `aliases` mapping from alternative spellings to a canonical term. An
+    optional top-level `common_words` list names ordinary words that are one
+    typo away from a term ("horse", "local") and are never fuzzy-matched.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    terms: Dict[str, List[str]] = {}
+    aliases: Dict[str, Dict[str, str]] = {}
+    for category in CATEGORIES:
+        entry = data.get(category)
+        if not isinstance(entry, dict) or not isinstance(entry.get("terms"), list):
+            raise ValueError(f"Vocabulary file {path} has no 'terms' list for '{category}'.")
+        terms[category] = [str(term) for term in entry["terms"]]
+        aliases[category] = {str(alias): str(term) for alias, term in entry.get("aliases", {}).items()}
+    common_words = data.get("common_words", [])
+    if not isinstance(common_words, list):
+        raise ValueError(f"Vocabulary file {path} has a 'common_words' entry that is not a list.")
+
+    return Vocabulary(
+        terms=terms,
+        aliases=aliases,
+        matcher=KeywordMatcher(terms, aliases, patterns),
+        fuzzy=FuzzyIndex(terms, aliases, [str(word) for word in common_words]),
+        version=version,
+    )
+
+
+class VocabularyStore:
+    """
+    Holds the active vocabulary and swaps in a rebuilt one when the data file changes.
+
+    Readers take `store.current` once per parse and keep using that snapshot,
+    so a reload never blocks or disturbs in-flight requests: the new matcher
+    is built off to the side and published with a single reference assignment.
+    A file that fails to load or validate is logged and the previous
+    vocabulary stays active.
+    """
+
+    def __init__(self, path: str, patterns: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.patterns = patterns
+        self._reload_lock = threading.Lock()
+        self._signature = self._file_signature()
+        self.current: Vocabulary = load_vocabulary(path, version=1, patterns=patterns)
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload_if_changed(self) -> bool:
+        """Rebuilds the vocabulary if the data file changed since the last load. Returns True on swap."""
+        with self._reload_lock:
+            signature = self._file_signature()
+            if signature is None or signature == self._signature:
+                return False
+            self._signature = signature
+            try:
+                vocabulary = load_vocabulary(self.path, version=self.current.version + 1, patterns=self.patterns)
+            except (OSError, ValueError) as e:
+                logger.error(f"Keeping vocabulary v{self.current.version}; could not reload {self.path}: {e}")
+                return False
+            self.current = vocabulary
+            logger.info(f"Loaded vocabulary v{vocabulary.version} from {self.path}.")
+            return True
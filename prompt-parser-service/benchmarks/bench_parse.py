@@ -0,0 +1,144 @@
+"""
+Microbenchmarks for `parse_prompt`.
+
+Runs the generated corpus (short, long and adversarial prompts) through the
+parser, reports the per-call latency distribution, throughput and memory
+allocated per call, and compares them with the stored baseline.
+
+    python -m benchmarks.bench_parse                    # compare with baseline.json
+    python -m benchmarks.bench_parse --update-baseline  # record a new baseline
+
+The process exits with status 1 when any metric regresses past its tolerance.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+from app.parser import parse_prompt
+from benchmarks.corpus import generate_corpus
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Metrics where a higher value is a regression, and the one where a lower value is.
+HIGHER_IS_WORSE = ("p50_us", "p95_us", "p99_us", "mean_alloc_bytes", "peak_alloc_bytes")
+LOWER_IS_WORSE = ("throughput_per_s",)
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(prompts: List[str], min_seconds: float) -> Dict[str, float]:
+    """Times every prompt individually, repeating the corpus until `min_seconds` have elapsed."""
+    for prompt in prompts[:50]:  # warm-up
+        parse_prompt(prompt)
+
+    latencies: List[float] = []
+    started = time.perf_counter()
+    while True:
+        for prompt in prompts:
+            t0 = time.perf_counter()
+            parse_prompt(prompt)
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            break
+
+    # Allocations are measured in a separate pass; tracing skews the timings.
+    allocations: List[int] = []
+    tracemalloc.start()
+    for prompt in prompts:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        parse_prompt(prompt)
+        _, peak = tracemalloc.get_traced_memory()
+        allocations.append(peak - before)
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "calls": len(latencies),
+        "p50_us": _percentile(latencies, 0.50) * 1e6,
+        "p95_us": _percentile(latencies, 0.95) * 1e6,
+        "p99_us": _percentile(latencies, 0.99) * 1e6,
+        "throughput_per_s": len(latencies) / elapsed,
+        "mean_alloc_bytes": statistics.mean(allocations),
+        "peak_alloc_bytes": max(allocations),
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            time_tolerance: float, alloc_tolerance: float) -> List[str]:
+    """Returns a description of every metric that regressed past its tolerance."""
+    regressions = []
+    for category, metrics in results.items():
+        reference = baseline.get(category)
+        if not reference:
+            continue
+        for name in HIGHER_IS_WORSE + LOWER_IS_WORSE:
+            if name not in reference:
+                continue
+            tolerance = alloc_tolerance if "alloc" in name else time_tolerance
+            if name in HIGHER_IS_WORSE:
+                limit = reference[name] * (1 + tolerance)
+                failed = metrics[name] > limit
+            else:
+                limit = reference[name] / (1 + tolerance)
+                failed = metrics[name] < limit
+            if failed:
+                regressions.append(
+                    f"{category}.{name}: {metrics[name]:.1f} vs baseline {reference[name]:.1f} (limit {limit:.1f})"
+                )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file.")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--min-seconds", type=float, default=2.0, help="Minimum timed duration per category.")
+    parser.add_argument("--time-tolerance", type=float, default=0.5,
+                        help="Allowed relative slowdown for latency and throughput (default 0.5 = 50%%).")
+    parser.add_argument("--alloc-tolerance", type=float, default=0.2,
+                        help="Allowed relative growth of allocated bytes per call (default 0.2 = 20%%).")
+    args = parser.parse_args(argv)
+
+    corpus = generate_corpus()
+    results = {category: measure(prompts, args.min_seconds) for category, prompts in corpus.items()}
+
+    print(f"{'category':<12} {'calls':>8} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'prompts/s':>11} {'alloc/call':>11}")
+    for category, m in results.items():
+        print(f"{category:<12} {m['calls']:>8} {m['p50_us']:>10.1f} {m['p95_us']:>10.1f} {m['p99_us']:>10.1f} "
+              f"{m['throughput_per_s']:>11.1f} {m['mean_alloc_bytes'] / 1024:>9.1f}Ki")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline first.")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.time_tolerance, args.alloc_tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        return 1
+    print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
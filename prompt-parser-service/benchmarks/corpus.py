@@ -0,0 +1,62 @@
+import random
+from typing import Dict, List
+
+# Building blocks for realistic prompts. The vocabulary words intentionally mix
+# exact terms, aliases and typos so every matching path is exercised.
+GENRES = ["drum and bass", "dnb", "house", "techno", "techo", "trance", "dubstep", "hip-hop", "lo-fi", "synthwav", "jazz"]
+INSTRUMENTS = ["piano", "pianno", "reese bass", "bassline", "drums", "synth", "vocal chops", "strings", "pads", "arp", "lead"]
+MOODS = ["high-energy", "high energy", "chill", "dark", "melancolic", "euphoric", "uplifting", "groovy"]
+KEYS = ["C major", "F# minor", "Bb min", "in the key of A minor", "E maj"]
+ARTISTS = ["Pendulum", "Daft Punk", "Burial", "Aphex Twin", "Noisia", "Bonobo", "Four Tet"]
+FILLER = [
+    "a", "track", "with", "some", "heavy", "soft", "warm", "wide", "stereo", "intro", "breakdown",
+    "drop", "build", "and", "the", "for", "late", "night", "driving", "crisp", "hats", "vinyl", "crackle",
+]
+
+
+def _short_prompt(rng: random.Random) -> str:
+    parts = [rng.choice(MOODS), rng.choice(GENRES)]
+    if rng.random() < 0.5:
+        parts.append(f"at {rng.randint(70, 180)} bpm")
+    return " ".join(parts)
+
+
+def _long_prompt(rng: random.Random) -> str:
+    sentences = []
+    for _ in range(rng.randint(3, 6)):
+        words = rng.choices(FILLER, k=rng.randint(6, 14))
+        words.insert(rng.randrange(len(words)), rng.choice(INSTRUMENTS))
+        sentences.append(" ".join(words))
+    sentences.insert(
+        0,
+        f"A {rng.choice(MOODS)} {rng.choice(GENRES)} track at {rng.randint(70, 180)} bpm in {rng.choice(KEYS)}",
+    )
+    sentences.insert(1, f"in the style of {rng.choice(ARTISTS)}, with {rng.choice(INSTRUMENTS)} and {rng.choice(INSTRUMENTS)}")
+    return ". ".join(sentences)
+
+
+def _adversarial_prompts() -> List[str]:
+    """Inputs aimed at the worst cases of the regexes and the fuzzy matcher."""
+    return [
+        # Style-reference pattern: many lazy captures that never find a terminator.
+        ("in the style of " + "wordy " * 40 + "! ") * 25,
+        "in the style of " + "x" * 20000,
+        # One very long prompt of ordinary words.
+        " ".join(FILLER * 400),
+        # Long runs of digits and near-miss BPM / key tokens.
+        "1" * 5000 + " bpm " + "C# " * 2000,
+        # Thousands of near-miss vocabulary words for the fuzzy index.
+        " ".join(["techo", "synthwav", "pianno", "melancolic"] * 500),
+        # Separator soup around hyphenated terms.
+        "high - - - energy lo - fi " * 500,
+    ]
+
+
+def generate_corpus(seed: int = 1234, short: int = 2000, long: int = 300) -> Dict[str, List[str]]:
+    """Returns a deterministic corpus of prompts grouped by category."""
+    rng = random.Random(seed)
+    return {
+        "short": [_short_prompt(rng) for _ in range(short)],
+        "long": [_long_prompt(rng) for _ in range(long)],
+        "adversarial": _adversarial_prompts(),
+    }
@@ -1,23 +1,32 @@
+import json
 import pytest
+from fastapi.testclient import TestClient
+from app.main import app
 from app.parser import parse_prompt
 from app.schemas import StructuredPrompt
+from app.matcher import KeywordMatcher
+from app.cache import PromptCache
+from app.vocabulary import VocabularyStore
+from app.fuzzy import FuzzyIndex
+
+client = TestClient(app)
 
 @pytest.mark.parametrize("prompt, expected", [
     (
         "A high-energy drum and bass track at 174 bpm in the style of Pendulum, with a heavy reese bass in F# minor",
-        StructuredPrompt(tempo=174, key="F# Minor", genre="drum and bass", instruments=["reese bass"], style_references=["Pendulum"], mood="high-energy")
+        StructuredPrompt(tempo=174, key="F# Minor", genre="drum and bass", instruments=["reese bass"], style_references=["Pendulum"], mood="high-energy", genres=["drum and bass"], moods=["high-energy"])
     ),
     (
         "128bpm house music with a groovy bassline and piano chords",
-        StructuredPrompt(tempo=128, key=None, genre="house", instruments=["piano", "bass"], style_references=[], mood="groovy")
+        StructuredPrompt(tempo=128, key=None, genre="house", instruments=["piano", "bass"], style_references=[], mood="groovy", genres=["house"], moods=["groovy"])
     ),
     (
         "A chill lo-fi track in C major",
-        StructuredPrompt(tempo=None, key="C Major", genre="lo-fi", instruments=[], style_references=[], mood="chill")
+        StructuredPrompt(tempo=None, key="C Major", genre="lo-fi", instruments=[], style_references=[], mood="chill", genres=["lo-fi"], moods=["chill"])
     ),
     (
         "Just a simple rock beat",
-        StructuredPrompt(tempo=None, key=None, genre="rock", instruments=[], style_references=[], mood=None)
+        StructuredPrompt(tempo=None, key=None, genre="rock", instruments=[], style_references=[], mood=None, genres=["rock"])
     ),
     (
         "",
@@ -27,13 +36,21 @@ from app.schemas import StructuredPrompt
         "Make something in the style of Daft Punk",
         StructuredPrompt(style_references=["Daft Punk"])
     ),
+    (
+        "in the style of daft punk 128 bpm",
+        StructuredPrompt(tempo=128, style_references=["Daft Punk"])
+    ),
+    (
+        "in the style of burial c minor",
+        StructuredPrompt(key="C Minor", style_references=["Burial"])
+    ),
 ])
 def test_parse_prompt(prompt, expected):
     """Test the prompt parser with various inputs."""
     result = parse_prompt(prompt)
     
-    # Pydantic models are compared by value, which is convenient
-    assert result == expected
+    # Pydantic models are compared by value, which is convenient; entity spans are covered separately
+    assert result.model_dump(exclude={"entities"}) == expected.model_dump(exclude={"entities"})
 
 def test_key_normalization():
     """Test that different key formats are normalized correctly."""
@@ -46,3 +63,232 @@ def test_key_normalization():
     assert parse_prompt(prompt1).key == expected_key
     assert parse_prompt(prompt2).key == expected_key
     assert parse_prompt(prompt3).key == expected_key
+
+def test_keyword_matcher_prefers_longest_term():
+    """Test that overlapping vocabulary terms resolve to the longest match."""
+    matcher = KeywordMatcher({"genre": ["synth", "synthwave"], "instrument": ["bass", "reese bass"]})
+    hits = matcher.match("a synthwave tune with a reese bass")
+
+    assert hits["genre"] == ["synthwave"]
+    assert hits["instrument"] == ["reese bass"]
+
+def test_keyword_matcher_hyphen_variants():
+    """Test that hyphenated terms match their spaced and joined spellings."""
+    matcher = KeywordMatcher({"mood": ["high-energy"], "genre": ["lo-fi"]})
+
+    for prompt in ["high-energy lo-fi", "high energy lo fi", "highenergy lofi"]:
+        assert matcher.match(prompt) == {"mood": ["high-energy"], "genre": ["lo-fi"]}
+
+def test_keyword_matcher_matches_whole_words_and_plurals():
+    """Test that terms match whole words and plurals, not every word they start."""
+    matcher = KeywordMatcher({"genre": ["pop", "rock", "trap"], "instrument": ["lead", "synth", "bass"], "mood": ["dark"]})
+
+    assert matcher.match("popular rocking leading darkness trapped") == {"genre": [], "instrument": [], "mood": []}
+    assert matcher.match("dark synths and basses") == {"genre": [], "instrument": ["synth", "bass"], "mood": ["dark"]}
+
+def test_parse_prompt_finds_terms_in_compounds_and_after_references():
+    """Test that terms inside hyphenated words and after a style reference are still found."""
+    result = parse_prompt("super-dark techno")
+    assert (result.mood, result.genre) == ("dark", "techno")
+
+    result = parse_prompt("in the style of the chemical brothers house 128 bpm")
+    assert (result.genre, result.tempo, result.style_references) == ("house", 128, ["The Chemical Brothers"])
+
+@pytest.mark.parametrize("prompt, references, tempo", [
+    ("in the style of deadmau5", ["Deadmau5"], None),
+    ("in the style of blink-182", ["Blink-182"], None),
+    ("in the style of 2Pac, with piano", ["2Pac"], None),
+    ("in the style of The 1975", ["The 1975"], None),
+    ("in the style of the 1975 120 bpm", ["The 1975"], 120),
+])
+def test_parse_prompt_keeps_digits_in_style_references(prompt, references, tempo):
+    """Test that artist names containing digits are kept whole, while a trailing tempo is still found."""
+    result = parse_prompt(prompt)
+
+    assert (result.style_references, result.tempo) == (references, tempo)
+
+@pytest.mark.parametrize("prompt", ["a popular song", "a rocking tune", "the leading edge", "darkness falls", "trapped"])
+def test_parse_prompt_ignores_words_starting_with_terms(prompt):
+    """Test that words which merely start with a vocabulary term are not entities."""
+    assert parse_prompt(prompt).entities == []
+
+def test_keyword_matcher_large_vocabulary():
+    """Test that a vocabulary of thousands of terms compiles and matches correctly."""
+    terms = [f"genre{i}" for i in range(5000)]
+    matcher = KeywordMatcher({"genre": terms})
+
+    hits = list(matcher.finditer("mix genre4999 with genre12 please"))
+
+    assert [(hit.term, hit.start) for hit in hits] == [("genre4999", 4), ("genre12", 19)]
+    assert matcher.match("mix genre4999 with genre12 please")["genre"] == ["genre12", "genre4999"]
+
+def test_batch_endpoint_preserves_order():
+    """Test that the batch endpoint returns one result per prompt, in order."""
+    prompts = ["128bpm house music", "A chill lo-fi track in C major", ""]
+    response = client.post("/api/v1/parse/batch", json={"prompts": prompts})
+
+    assert response.status_code == 200
+    assert [StructuredPrompt(**item) for item in response.json()] == [parse_prompt(p) for p in prompts]
+
+def test_batch_endpoint_refuses_oversized_batches(monkeypatch):
+    """Test that batches over the prompt or byte limit are refused with 413."""
+    import app.main
+    monkeypatch.setattr(app.main, "BATCH_MAX_PROMPTS", 2)
+    assert client.post("/api/v1/parse/batch", json={"prompts": ["techno", "house"]}).status_code == 200
+    assert client.post("/api/v1/parse/batch", json={"prompts": ["techno", "house", "jazz"]}).status_code == 413
+    body = "\n".join(json.dumps({"prompt": p}) for p in ["techno", "house", "jazz"])
+    response = client.post("/api/v1/parse/batch", content=body, headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 413
+
+    monkeypatch.setattr(app.main, "BATCH_MAX_BYTES", 64)
+    assert client.post("/api/v1/parse/batch", json={"prompts": ["dark techno at 130 bpm " * 4]}).status_code == 413
+
+def test_batch_endpoint_ndjson_stream():
+    """Test that an NDJSON batch streams back one line per input line, flagging bad lines."""
+    body = '{"prompt": "dark techno at 130 bpm"}\nnot json\n"uplifting trance"\n'
+    response = client.post("/api/v1/parse/batch", content=body, headers={"content-type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 3
+    assert lines[0]["genre"] == "techno" and lines[0]["tempo"] == 130
+    assert lines[1]["line"] == 2 and "error" in lines[1]
+    assert lines[2]["genre"] == "trance" and lines[2]["mood"] == "uplifting"
+
+def test_prompt_cache_normalizes_and_counts():
+    """Test that equivalent prompts share one cache entry and that evictions are counted."""
+    cache = PromptCache(parse_prompt, maxsize=2)
+
+    cache.parse("Dark  Techno at 130 BPM")
+    cache.parse("dark techno at 130 bpm")
+    cache.parse("chill lo-fi")
+    cache.parse("uplifting trance")
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.size) == (1, 3, 1, 2)
+
+def test_parse_endpoint_spans_index_into_the_prompt_as_sent():
+    """Test that entity spans point into the request text, not the normalized cache key, on misses and hits."""
+    expected = [("mood", "Dark"), ("genre", "techno"), ("tempo", "130 BPM")]
+    for prompt in ["Dark    techno   at 130 BPM", "  DARK  Techno\tat 130 bpm"]:
+        response = client.post("/api/v1/parse", json={"prompt": prompt})
+
+        assert response.status_code == 200
+        spans = [(e["type"], prompt[e["start"]:e["end"]]) for e in response.json()["entities"]]
+        assert [(kind, text.casefold()) for kind, text in spans] == [(kind, text.casefold()) for kind, text in expected]
+        assert [e["start"] for e in response.json()["entities"]] == [prompt.index(text) for _, text in spans]
+
+    response = client.post("/api/v1/parse/batch", json={"prompts": ["Dark    techno   at 130 BPM"]})
+    assert [(e["start"], e["end"]) for e in response.json()[0]["entities"]] == [(0, 4), (8, 14), (20, 27)]
+
+def test_prompt_cache_returns_defensive_copies():
+    """Test that mutating a returned result does not alter the cached entry."""
+    cache = PromptCache(parse_prompt, maxsize=8)
+
+    first = cache.parse("house with piano and strings")
+    first.instruments.append("kazoo")
+    first.genre = "polka"
+
+    second = cache.parse("house with piano and strings")
+    assert second.genre == "house"
+    assert second.instruments == ["piano", "strings"]
+
+def test_cache_stats_endpoint():
+    """Test that the stats endpoint reports the service cache counters."""
+    client.post("/api/v1/parse", json={"prompt": "stats endpoint jazz"})
+    client.post("/api/v1/parse", json={"prompt": "Stats endpoint JAZZ"})
+
+    response = client.get("/api/v1/parse/cache/stats")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["hits"] >= 1
+    assert set(data) == {"hits", "misses", "evictions", "size", "maxsize", "hit_rate"}
+
+def test_vocabulary_aliases_resolve_to_canonical_terms():
+    """Test that aliases from the vocabulary file report their canonical term."""
+    result = parse_prompt("some dnb with hip-hop keys")
+
+    assert result.genre == "drum and bass"
+    assert result.instruments == ["piano"]
+
+def test_vocabulary_store_hot_reload(tmp_path):
+    """Test that the store swaps in a new vocabulary when the file changes and keeps it on bad input."""
+    path = tmp_path / "vocabulary.json"
+    vocab = {category: {"terms": [], "aliases": {}} for category in ("genre", "instrument", "mood")}
+    vocab["genre"]["terms"] = ["house"]
+    path.write_text(json.dumps(vocab))
+    store = VocabularyStore(str(path))
+    before = store.current
+
+    assert store.reload_if_changed() is False
+
+    vocab["genre"] = {"terms": ["house", "gqom"], "aliases": {"gqom house": "gqom"}}
+    path.write_text(json.dumps(vocab) + "\n")
+    assert store.reload_if_changed() is True
+    assert store.current.version == before.version + 1
+    assert store.current.matcher.match("gqom house")["genre"] == ["gqom"]
+    # Snapshots held by in-flight requests are untouched by the swap.
+    assert before.matcher.match("gqom")["genre"] == []
+
+    path.write_text("{ not json")
+    assert store.reload_if_changed() is False
+    assert store.current.matcher.match("gqom")["genre"] == ["gqom"]
+
+@pytest.mark.parametrize("prompt, genre, instruments, mood", [
+    ("a techo track", "techno", [], None),
+    ("a synthwav tune with a lead", "synthwave", ["lead"], None),
+    ("tehcno with pianno", "techno", ["piano"], None),
+    ("a melancolic trance piece", "trance", [], "melancholic"),
+])
+def test_parse_prompt_fuzzy_matches_typos(prompt, genre, instruments, mood):
+    """Test that misspelled vocabulary terms are recovered by approximate matching."""
+    result = parse_prompt(prompt)
+
+    assert (result.genre, result.instruments, result.mood) == (genre, instruments, mood)
+
+@pytest.mark.parametrize("prompt", [
+    "a horse", "local music", "a funny song", "grass", "trace it",
+    "a baseline", "stings", "a groove", "rocky", "a chilly morning",
+])
+def test_parse_prompt_does_not_fuzzy_match_common_words(prompt):
+    """Test that ordinary words one typo away from a term are not reported as entities."""
+    assert parse_prompt(prompt).entities == []
+
+def test_fuzzy_index_respects_distance_threshold():
+    """Test that the fuzzy index only returns forms within the configured distance."""
+    index = FuzzyIndex({"genre": ["synthwave", "techno"]})
+
+    assert index.lookup("synthwav", max_distance=1) == [("synthwave", 1)]
+    assert index.lookup("sinthwav", max_distance=1) == []
+    assert index.lookup("sinthwav", max_distance=2) == [("synthwave", 2)]
+    assert [hit.term for hit in index.finditer("techo", [(0, 5)], max_distance=1)] == ["techno"]
+    assert list(index.finditer("techo", [(0, 5)], max_distance=0)) == []
+    # Words shorter than min_length are never fuzzy-matched.
+    assert list(index.finditer("techo", [(0, 5)], max_distance=1, min_length=6)) == []
+    # Listed common words are never fuzzy-matched.
+    index = FuzzyIndex({"genre": ["house"]}, common_words=["Horse"])
+    assert list(index.finditer("horse", [(0, 5)], max_distance=1)) == []
+    assert [hit.term for hit in index.finditer("hosue", [(0, 5)], max_distance=1)] == ["house"]
+    # Frequent English words are taken as written unless the frequency bound is raised.
+    index = FuzzyIndex({"instrument": ["strings"]})
+    assert list(index.finditer("stings", [(0, 6)], max_distance=1)) == []
+    assert [hit.term for hit in index.finditer("stings", [(0, 6)], max_word_frequency=8.0)] == ["strings"]
+
+def test_parse_prompt_reports_entity_spans():
+    """Test that every entity is reported with its span, value and confidence."""
+    prompt = "Dark techno and house at 130 BPM in A minor with a techo bassline"
+    result = parse_prompt(prompt)
+
+    # Multi-valued fields are ordered by vocabulary priority, like the single-valued ones.
+    assert result.genres == ["house", "techno"]
+    assert result.genre == "house"
+    spans = [(e.type, e.value, prompt[e.start:e.end], e.confidence) for e in result.entities]
+    assert spans == [
+        ("mood", "dark", "Dark", 1.0),
+        ("genre", "techno", "techno", 1.0),
+        ("genre", "house", "house", 1.0),
+        ("tempo", "130", "130 BPM", 1.0),
+        ("key", "A Minor", "A minor", 1.0),
+        ("genre", "techno", "techo", 0.833),
+        ("instrument", "bass", "bassline", 1.0),
+    ]
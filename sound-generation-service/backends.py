@@ -0,0 +1,303 @@
+"""
+Stem generation backends.
+
+A backend turns one `StemTask` (an instrument of a track) into a WAV file at
+`task.path`. `generate_stems` fans the instruments of a job out to the
+backend concurrently and collects the stems as they finish; how many of
+them actually run at once is up to the backend:
+
+- `LocalSynthBackend` renders with the procedural synthesizer (`synth.py`)
+  in a pool of worker processes;
+- `RemoteBackend` calls a remote text-to-audio API (Stable Audio's
+  `text-to-audio` endpoint, or the local stand-in in `stand_in_api.py`)
+  through one pooled `httpx.AsyncClient`, within the provider's concurrency
+  and rate limits, and streams each response straight to disk.
+
+`create_backend` picks one from `GENERATION_BACKEND`.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+import httpx
+
+from synth import Arrangement, DEFAULT_KEY, DEFAULT_TEMPO, RENDERERS, render_stem, wav_bytes
+
+logger = logging.getLogger(__name__)
+
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "local")
+# Processes rendering stems in parallel with the local backend; each stem is rendered by one of them.
+SYNTH_WORKERS = int(os.getenv("SYNTH_WORKERS", str(os.cpu_count() or 1)))
+REMOTE_API_URL = os.getenv("REMOTE_API_URL", "https://api.stability.ai/v2beta/audio/stable-audio-2/text-to-audio")
+STABILITY_AI_API_KEY = os.getenv("STABILITY_AI_API_KEY", "")
+# Provider limits: requests in flight, and requests per rolling window.
+REMOTE_MAX_CONCURRENT = int(os.getenv("REMOTE_MAX_CONCURRENT", "4"))
+REMOTE_RATE_LIMIT = int(os.getenv("REMOTE_RATE_LIMIT", "150"))
+REMOTE_RATE_WINDOW_SECONDS = float(os.getenv("REMOTE_RATE_WINDOW_SECONDS", "10"))
+REMOTE_TIMEOUT_SECONDS = float(os.getenv("REMOTE_TIMEOUT_SECONDS", "200"))
+REMOTE_MAX_RETRIES = int(os.getenv("REMOTE_MAX_RETRIES", "3"))
+# Longest audio the remote model generates in one request.
+REMOTE_MAX_DURATION = 180.0
+# Statuses worth retrying: rate limited, or a transient failure on the provider's side.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class BackendError(Exception):
+    """Raised when a backend cannot produce a stem."""
+
+
+class StemTask(NamedTuple):
+    job_id: str
+    instrument: str
+    path: str  # where the WAV file goes
+    arrangement: Arrangement
+    seed: int
+    prompt: str  # text description of the stem, for backends that take one
+
+
+def write_stem(path: str, data: bytes) -> None:
+    """Writes a file atomically, so a reader never sees a partly written stem."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class StemBackend:
+    """Interface of a stem generation backend."""
+
+    name = "base"
+    # Longest stem the backend renders, in seconds; None for no limit.
+    max_duration: Optional[float] = None
+
+    async def start(self) -> None:
+        """Prepares the backend (connections, workers) before the first stem."""
+
+    async def render(self, task: StemTask) -> float:
+        """Writes the stem to `task.path`; returns the seconds spent generating it."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Releases the backend's resources."""
+
+
+def render_stem_file(path: str, arrangement: Arrangement, instrument: str, seed: int) -> float:
+    """Worker task: renders one stem and writes it to `path`; returns the seconds it took."""
+    started = time.perf_counter()
+    write_stem(path, wav_bytes(render_stem(arrangement, instrument, seed), arrangement.sr))
+    return time.perf_counter() - started
+
+
+def _warm_up() -> None:
+    """Renders one bar of every voice, so imports and first-call costs are paid before the first job."""
+    arrangement = Arrangement(DEFAULT_TEMPO, *DEFAULT_KEY, n_bars=1)
+    for voice in RENDERERS:
+        render_stem(arrangement, voice, 0)
+
+
+class LocalSynthBackend(StemBackend):
+    """Procedural synthesis in a process pool; at most `workers` stems render at once."""
+
+    name = "local"
+
+    def __init__(self, workers: int = SYNTH_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn rather than fork: forking a process that runs an event loop and threads is unsafe.
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def start(self) -> None:
+        """Starts the synth workers and warms them up."""
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        await asyncio.gather(*[loop.run_in_executor(pool, _warm_up) for _ in range(self.workers)])
+
+    async def render(self, task: StemTask) -> float:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_pool(), render_stem_file, task.path, task.arrangement,
+                                          task.instrument, task.seed)
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+class RateWindow:
+    """
+    A rolling-window request quota: at most `limit` requests in any `window`
+    seconds. `acquire` waits for room; `try_acquire` takes it only if there is
+    room now.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._times: "deque[float]" = deque()
+
+    def delay(self) -> float:
+        """Seconds until another request fits in the window (0 if it fits now)."""
+        now = time.monotonic()
+        while self._times and self._times[0] <= now - self.window:
+            self._times.popleft()
+        return 0.0 if len(self._times) < self.limit else self._times[0] + self.window - now
+
+    def try_acquire(self) -> bool:
+        if self.delay() > 0:
+            return False
+        self._times.append(time.monotonic())
+        return True
+
+    async def acquire(self) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    """The provider's `Retry-After` when it sends one, else exponential backoff from one second."""
+    try:
+        return max(0.0, float(response.headers["retry-after"]))
+    except (KeyError, ValueError):
+        return float(2 ** attempt)
+
+
+class RemoteBackend(StemBackend):
+    """
+    A remote text-to-audio API, called once per stem.
+
+    All requests share one `httpx.AsyncClient`, so connections (and TLS
+    sessions) are pooled across stems and jobs. At most `max_concurrent`
+    requests are in flight and at most `rate_limit` start in any
+    `rate_window` seconds, matching the provider's limits so requests are not
+    refused in the first place. Rate-limited (429) and transient (5xx)
+    responses and connection errors are retried up to `max_retries` times,
+    after the provider's `Retry-After` or an exponential backoff. Audio is
+    written to disk chunk by chunk as it arrives.
+    """
+
+    name = "remote"
+    max_duration = REMOTE_MAX_DURATION
+
+    def __init__(self, url: str = REMOTE_API_URL, api_key: str = STABILITY_AI_API_KEY,
+                 max_concurrent: int = REMOTE_MAX_CONCURRENT, rate_limit: int = REMOTE_RATE_LIMIT,
+                 rate_window: float = REMOTE_RATE_WINDOW_SECONDS, timeout: float = REMOTE_TIMEOUT_SECONDS,
+                 max_retries: int = REMOTE_MAX_RETRIES, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.url = url
+        self.api_key = api_key
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate = RateWindow(rate_limit, rate_window)
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None  # created inside the running loop
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                transport=self._transport,
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(max_connections=self.max_concurrent, max_keepalive_connections=self.max_concurrent),
+                headers={"Authorization": f"Bearer {self.api_key}", "Accept": "audio/wav"},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._client
+
+    async def start(self) -> None:
+        if not self.api_key:
+            logger.warning("STABILITY_AI_API_KEY is not set; requests to the remote backend will be refused.")
+        self._get_client()
+
+    async def render(self, task: StemTask) -> float:
+        duration = task.arrangement.duration
+        if duration > self.max_duration:
+            raise BackendError(f"The remote backend generates at most {self.max_duration:.0f} s per stem, "
+                               f"{duration:.0f} s requested.")
+        client = self._get_client()
+        # One seed per stem, so stems of the same job differ.
+        seed = (task.seed + zlib.crc32(task.instrument.encode("utf-8"))) % (2 ** 32 - 1)
+        form = {
+            "prompt": (None, task.prompt),
+            "duration": (None, f"{duration:.2f}"),
+            "seed": (None, str(seed)),
+            "output_format": (None, "wav"),
+        }
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                await self.rate.acquire()
+                started = time.perf_counter()
+                try:
+                    async with client.stream("POST", self.url, files=form) as response:
+                        if response.status_code == 200:
+                            await self._save(response, task.path)
+                            return time.perf_counter() - started
+                        await response.aread()
+                except httpx.TransportError as e:
+                    if attempt == self.max_retries:
+                        raise BackendError(f"Could not reach the remote backend: {e}") from e
+                    logger.warning(f"[{task.job_id}] Remote request for '{task.instrument}' failed ({e}); retrying.")
+                    await asyncio.sleep(2 ** attempt)
+                    attempt += 1
+                    continue
+
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    raise BackendError(f"Remote backend answered {response.status_code}: {self._error_message(response)}")
+                delay = _retry_delay(response, attempt)
+                logger.warning(f"[{task.job_id}] Remote backend answered {response.status_code} for "
+                               f"'{task.instrument}'; retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    @staticmethod
+    async def _save(response: httpx.Response, path: str) -> None:
+        content_type = response.headers.get("content-type", "")
+        if not content_type.startswith("audio/"):
+            raise BackendError(f"Remote backend returned {content_type or 'no content type'} instead of audio.")
+        tmp_path = f"{path}.tmp"
+        try:
+            # File I/O goes through a thread, so writing a large stem does not hold up the event loop.
+            f = await asyncio.to_thread(open, tmp_path, "wb")
+            try:
+                async for chunk in response.aiter_bytes(STREAM_CHUNK_BYTES):
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _error_message(response: httpx.Response) -> str:
+        try:
+            body = response.json()
+            return "; ".join(body.get("errors", [])) or body.get("message") or body.get("name") or response.text
+        except ValueError:
+            return response.text[:200]
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def create_backend(name: str = GENERATION_BACKEND) -> StemBackend:
+    if name == "local":
+        return LocalSynthBackend()
+    if name == "remote":
+        return RemoteBackend()
+    raise ValueError(f"Unknown generation backend '{name}'; expected 'local' or 'remote'.")
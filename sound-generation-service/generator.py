@@ -1,20 +1,128 @@
 import asyncio
 import logging
+import os
+import re
+import secrets
+import time
 import uuid
-from typing import Dict, Any
+from typing import Callable, Dict, Any, List, NamedTuple, Optional, Tuple
 
+from backends import BackendError, StemBackend, StemTask, create_backend
 from schemas import GenerationRequest
+from synth import Arrangement, SAMPLE_RATE, clamp_tempo, key_label, parse_key
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-SIMULATED_DELAY_SECONDS = 5
+# Shared volume the mixing service reads the stems from.
+STEMS_DIR = os.getenv("STEMS_DIR", "/stems")
+DEFAULT_INSTRUMENTS = ["drums", "bass", "synth", "lead"]
 
-async def mock_generate_stems(request: GenerationRequest) -> Dict[str, Any]:
+# The backend stems are generated with; see `backends.py`.
+backend: StemBackend = create_backend()
+
+
+class StemResult(NamedTuple):
+    instrument: str
+    path: str
+    render_seconds: float  # generating and writing the stem, once the backend started on it
+    finished_after: float  # seconds from the start of the job
+
+
+StemCallback = Callable[[StemResult], None]
+
+
+# Characters of an instrument name that are not kept in its stem's file name.
+UNSAFE_FILENAME_CHARS = re.compile(r"[^\w-]+")
+
+
+def stem_path(job_id: str, instrument: str) -> str:
+    """Where an instrument's stem goes; "acid/303 line" becomes `<job_id>_acid_303_line.wav`."""
+    return os.path.join(STEMS_DIR, f"{job_id}_{UNSAFE_FILENAME_CHARS.sub('_', instrument)}.wav")
+
+
+async def render_stems(job_id: str, arrangement: Arrangement, instruments: List[str], seed: int, prompt: str,
+                       on_stem: Optional[StemCallback] = None) -> List[StemResult]:
     """
-    Simulates the audio generation process.
+    Generates every stem concurrently with the backend, so a job takes about
+    as long as its slowest stem rather than the sum of all of them (within
+    the backend's own concurrency limit). Results are returned (and passed to
+    `on_stem`) in the order the stems finish.
     """
-    job_id = f"job_{uuid.uuid4().hex[:12]}"
+    os.makedirs(STEMS_DIR, exist_ok=True)
+    started = time.perf_counter()
+
+    async def render(instrument: str) -> StemResult:
+        path = stem_path(job_id, instrument)
+        seconds = await backend.render(StemTask(job_id, instrument, path, arrangement, seed, f"{instrument}, {prompt}"))
+        return StemResult(instrument, path, seconds, time.perf_counter() - started)
+
+    tasks = [asyncio.ensure_future(render(instrument)) for instrument in instruments]
+    results = []
+    try:
+        for finished in asyncio.as_completed(tasks):
+            stem = await finished
+            logger.info(f"[{job_id}] Stem '{stem.instrument}' rendered in {stem.render_seconds:.2f}s "
+                        f"({stem.finished_after:.2f}s into the job).")
+            if on_stem is not None:
+                on_stem(stem)
+            results.append(stem)
+    finally:
+        # One failed stem fails the job; do not leave the others running.
+        for task in tasks:
+            task.cancel()
+    return results
+
+
+def describe_track(request: GenerationRequest, tempo: float, key: str) -> str:
+    """Text description of the track, for backends that generate from a prompt."""
+    prompt = request.prompt_spec
+    parts = [f"{prompt.genre} stem" if prompt.genre else "stem"]
+    if prompt.mood:
+        parts.append(prompt.mood)
+    if prompt.style_references:
+        parts.append(f"in the style of {', '.join(prompt.style_references)}")
+    parts.append(f"in {key}")
+    parts.append(f"at {tempo:.0f} BPM")
+    return ", ".join(parts)
+
+
+def new_job_id() -> str:
+    return f"job_{uuid.uuid4().hex[:12]}"
+
+
+def requested_tempo_and_key(request: GenerationRequest) -> Tuple[Optional[float], Optional[str]]:
+    """The tempo and key to generate at, preferring the more accurate ones from style analysis."""
+    style = request.style_features
+    tempo = style.tempo if style and style.tempo else request.prompt_spec.tempo
+    key = style.key if style and style.key else request.prompt_spec.key
+    return tempo, key
+
+
+def plan_arrangement(request: GenerationRequest) -> Arrangement:
+    """The arrangement of a request: whole bars of 4/4, as close to the requested duration as possible."""
+    tempo, key = requested_tempo_and_key(request)
+    tempo = clamp_tempo(tempo)
+    tonic, mode = parse_key(key)
+    return Arrangement(tempo, tonic, mode, max(1, round(request.duration * tempo / 240.0)), SAMPLE_RATE)
+
+
+def check_duration(request: GenerationRequest) -> None:
+    """Raises `BackendError` when the stems would be longer than the active backend renders."""
+    duration = plan_arrangement(request).duration
+    if backend.max_duration is not None and duration > backend.max_duration:
+        raise BackendError(f"The {backend.name} backend generates at most {backend.max_duration:.0f} s per stem, "
+                           f"{duration:.0f} s requested.")
+
+
+async def generate_stems(request: GenerationRequest, on_stem: Optional[StemCallback] = None,
+                         job_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Synthesizes the requested stems at the track's tempo and key and writes
+    them to `STEMS_DIR` as WAV files. The same request with the same seed
+    always produces the same audio. `on_stem` is called as each stem finishes.
+    """
+    job_id = job_id or new_job_id()
     
     prompt = request.prompt_spec
     log_message_parts = [f"Received job {job_id}: Generate track"]
@@ -22,35 +130,47 @@ async def mock_generate_stems(request: GenerationRequest) -> Dict[str, Any]:
     if prompt.genre:
         log_message_parts.append(f"in genre '{prompt.genre}'")
     
-    # Prefer the more accurate key from style analysis if available
-    if request.style_features and request.style_features.key:
-         log_message_parts.append(f"in key of {request.style_features.key}")
-    elif prompt.key:
-        log_message_parts.append(f"in key of {prompt.key}")
-    
-    # Prefer the more accurate tempo from style analysis
-    if request.style_features and request.style_features.tempo:
-        log_message_parts.append(f"at {request.style_features.tempo:.0f} BPM")
-    elif prompt.tempo:
-        log_message_parts.append(f"at {prompt.tempo} BPM")
+    tempo, key = requested_tempo_and_key(request)
+    if key:
+        log_message_parts.append(f"in key of {key}")
+    if tempo:
+        log_message_parts.append(f"at {tempo:.0f} BPM")
         
     if prompt.style_references:
         log_message_parts.append(f"in the style of {', '.join(prompt.style_references)}")
 
     logger.info(" ".join(log_message_parts))
 
-    logger.info(f"[{job_id}] Simulating generation... process will take {SIMULATED_DELAY_SECONDS} seconds.")
-    await asyncio.sleep(SIMULATED_DELAY_SECONDS)
-    
     # Determine which stems to generate based on the prompt's instrument list.
     # If the list is empty, default to a standard set of instruments.
-    instruments_to_generate = prompt.instruments if prompt.instruments else ["drums", "bass", "synth", "lead"]
-    
-    stems = {
-        instrument: f"/stems/{job_id}_{instrument.replace(' ', '_')}.wav"
-        for instrument in instruments_to_generate
-    }
+    instruments_to_generate = prompt.instruments if prompt.instruments else DEFAULT_INSTRUMENTS
+    # Instruments that map to the same file ("vocal chops", "vocal_chops") would render over each
+    # other; the first of them is kept.
+    unique_stems: Dict[str, str] = {}
+    for instrument in instruments_to_generate:
+        unique_stems.setdefault(stem_path(job_id, instrument), instrument)
+    instruments_to_generate = list(unique_stems.values())
+
+    arrangement = plan_arrangement(request)
+    tempo, tonic, mode = arrangement.tempo, arrangement.tonic, arrangement.mode
+    seed = request.seed if request.seed is not None else secrets.randbelow(2 ** 32)
+
+    logger.info(f"[{job_id}] Generating {len(instruments_to_generate)} stems with the {backend.name} backend: "
+                f"{arrangement.n_bars} bars, seed {seed}.")
+    started = time.perf_counter()
+    prompt_text = describe_track(request, tempo, key_label(tonic, mode))
+    results = await render_stems(job_id, arrangement, instruments_to_generate, seed, prompt_text, on_stem)
+    seconds = time.perf_counter() - started
     
-    logger.info(f"[{job_id}] Successfully generated {len(stems)} stems.")
+    logger.info(f"[{job_id}] Successfully generated {len(results)} stems in {seconds:.2f}s.")
 
-    return {"job_id": job_id, "stems": stems}
+    return {
+        "job_id": job_id,
+        "stems": {stem.instrument: stem.path for stem in results},
+        "stem_seconds": {stem.instrument: round(stem.render_seconds, 3) for stem in results},
+        "seconds": round(seconds, 3),
+        "seed": seed,
+        "tempo": tempo,
+        "key": key_label(tonic, mode),
+        "duration": arrangement.duration,
+    }
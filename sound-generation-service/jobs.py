@@ -0,0 +1,172 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from generator import StemResult
+from schemas import GenerationJob, GenerationResponse
+
+FINISHED_STATUSES = ("done", "failed")
+
+
+class GenerationOverloaded(Exception):
+    """Raised when every render slot is busy and the wait queue is full."""
+
+
+class RenderSlots:
+    """
+    Admission control for renders: at most `max_running` run at once and at
+    most `max_queue` more wait for a slot. `reserve` refuses work beyond that
+    straight away, so a caller learns it must retry before anything is queued,
+    and a reservation keeps its place in the queue until it is used.
+
+    Must be used from a single event loop; the counters are not locked.
+    """
+
+    def __init__(self, max_running: int, max_queue: int):
+        if max_running < 1:
+            raise ValueError("max_running must be at least 1")
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None  # created on first use, inside the running loop
+
+    @property
+    def full(self) -> bool:
+        return self.running + self.waiting >= self.max_running + self.max_queue
+
+    def reserve(self) -> "RenderSlot":
+        if self.full:
+            raise GenerationOverloaded()
+        self.waiting += 1
+        return RenderSlot(self)
+
+
+class RenderSlot:
+    """A reserved place in the render queue; `async with` waits for a free slot and holds it."""
+
+    def __init__(self, slots: RenderSlots):
+        self._slots = slots
+
+    async def __aenter__(self) -> None:
+        slots = self._slots
+        if slots._semaphore is None:
+            slots._semaphore = asyncio.Semaphore(slots.max_running)
+        try:
+            await slots._semaphore.acquire()
+        finally:
+            slots.waiting -= 1
+        slots.running += 1
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._slots.running -= 1
+        self._slots._semaphore.release()
+
+
+class _JobRecord:
+    def __init__(self, job: GenerationJob):
+        self.job = job
+        self.submitted_at = time.perf_counter()
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.changed = asyncio.Event()
+
+
+class GenerationJobStore:
+    """
+    In-memory registry of asynchronous generation jobs and their events.
+
+    A job goes from `queued` to `running` to `done`, or to `failed` at any
+    point; every transition and every finished stem is also recorded as an
+    event, which `events` replays and then follows live (for the SSE stream).
+    At most `max_jobs` jobs are kept; beyond that the oldest finished jobs are
+    forgotten. Unfinished jobs are bounded by the render queue and are never
+    dropped.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, max_jobs: int):
+        self.max_jobs = max_jobs
+        self._records: "OrderedDict[str, _JobRecord]" = OrderedDict()  # oldest first
+
+    def create(self, job_id: str) -> GenerationJob:
+        record = _JobRecord(GenerationJob(job_id=job_id, status="queued"))
+        self._records[job_id] = record
+        self._publish(record, "queued", self._snapshot(record))
+        self._evict()
+        return record.job.model_copy(deep=True)
+
+    def get(self, job_id: str) -> Optional[GenerationJob]:
+        record = self._records.get(job_id)
+        return None if record is None else record.job.model_copy(deep=True)
+
+    def running(self, job_id: str) -> None:
+        record = self._records.get(job_id)
+        if record is not None:
+            record.job.status, record.job.queued_seconds = "running", self._elapsed(record)
+            self._publish(record, "running", self._snapshot(record))
+
+    def stem(self, job_id: str, stem: StemResult) -> None:
+        record = self._records.get(job_id)
+        if record is not None:
+            record.job.stems[stem.instrument] = stem.path
+            self._publish(record, "stem", stem._asdict())
+
+    def finish(self, job_id: str, result: GenerationResponse) -> None:
+        record = self._records.get(job_id)
+        if record is not None:
+            record.job.status, record.job.result, record.job.stems = "done", result, dict(result.stems)
+            record.job.done_seconds = self._elapsed(record)
+            self._publish(record, "done", self._snapshot(record))
+
+    def fail(self, job_id: str, error: str) -> None:
+        record = self._records.get(job_id)
+        if record is not None:
+            record.job.status, record.job.error, record.job.done_seconds = "failed", error, self._elapsed(record)
+            self._publish(record, "failed", self._snapshot(record))
+
+    async def events(self, job_id: str, after: int = -1,
+                     keepalive: Optional[float] = None) -> AsyncIterator[Optional[Tuple[int, str, Dict[str, Any]]]]:
+        """
+        Yields `(event_id, name, data)` for every event of a job after
+        `after`, waiting for new ones until the job has finished. With
+        `keepalive`, yields None whenever that many seconds pass without one.
+        """
+        next_id = after + 1
+        while True:
+            record = self._records.get(job_id)
+            if record is None:
+                return
+            changed = record.changed
+            while next_id < len(record.events):
+                name, data = record.events[next_id]
+                yield next_id, name, data
+                next_id += 1
+            if record.job.status in FINISHED_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+    def _publish(self, record: _JobRecord, name: str, data: Dict[str, Any]) -> None:
+        record.events.append((name, data))
+        # Wake every follower, and give later waits a fresh event.
+        changed, record.changed = record.changed, asyncio.Event()
+        changed.set()
+
+    @staticmethod
+    def _snapshot(record: _JobRecord) -> Dict[str, Any]:
+        return record.job.model_dump(mode="json")
+
+    @staticmethod
+    def _elapsed(record: _JobRecord) -> float:
+        return time.perf_counter() - record.submitted_at
+
+    def _evict(self) -> None:
+        excess = len(self._records) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in [j for j, r in self._records.items() if r.job.status in FINISHED_STATUSES][:excess]:
+            del self._records[job_id]
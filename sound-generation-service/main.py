@@ -1,27 +1,166 @@
-from fastapi import FastAPI, HTTPException
-from schemas import GenerationRequest, GenerationResponse
-from generator import mock_generate_stems
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Optional, Set
+
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from schemas import GenerationJob, GenerationRequest, GenerationResponse
+import generator
+from backends import BackendError
+from generator import generate_stems, new_job_id
+from jobs import GenerationJobStore, GenerationOverloaded, RenderSlot, RenderSlots
+
+logger = logging.getLogger(__name__)
+
+# Renders running at once, and renders allowed to wait for one of those slots.
+GENERATION_MAX_RUNNING = int(os.getenv("GENERATION_MAX_RUNNING", "2"))
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "16"))
+# Finished jobs kept for polling.
+GENERATION_MAX_JOBS = int(os.getenv("GENERATION_MAX_JOBS", "1000"))
+OVERLOAD_RETRY_AFTER_SECONDS = 5
+# Comment lines sent on an idle event stream, so proxies do not time it out.
+SSE_KEEPALIVE_SECONDS = 15.0
+
+render_slots = RenderSlots(GENERATION_MAX_RUNNING, GENERATION_MAX_QUEUE)
+generation_jobs = GenerationJobStore(GENERATION_MAX_JOBS)
+_job_tasks: Set[asyncio.Task] = set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts the generation backend (synth workers or the API client), and stops it on shutdown."""
+    await generator.backend.start()
+    try:
+        yield
+    finally:
+        for task in list(_job_tasks):
+            task.cancel()
+        await generator.backend.close()
+
 
 app = FastAPI(
     title="Sound Generation Service",
     description="A microservice to generate audio stems based on structured prompts.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
+
+def check_duration(request: GenerationRequest) -> None:
+    """Refuses stems longer than the active backend renders with a 422, before a render slot is taken."""
+    try:
+        generator.check_duration(request)
+    except BackendError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def reserve_render_slot() -> RenderSlot:
+    """Reserves a place in the render queue, or answers 503 with `Retry-After` when it is full."""
+    try:
+        return render_slots.reserve()
+    except GenerationOverloaded:
+        raise HTTPException(
+            status_code=503,
+            detail="The sound generation service is at capacity. Please retry later.",
+            headers={"Retry-After": str(OVERLOAD_RETRY_AFTER_SECONDS)},
+        )
+
+
 @app.post("/generate", response_model=GenerationResponse, tags=["Generation"])
 async def generate_track(request: GenerationRequest):
     """
     Accepts a structured prompt and style features to generate audio stems.
-    
-    This endpoint simulates the generation process, introduces an artificial delay,
-    and returns mock file paths for the generated audio stems.
+
+    The stems are generated at the requested tempo and key by the configured
+    backend and written as WAV files to the shared stems volume; the response
+    lists their paths. The
+    connection stays open for the whole render; long renders should use
+    `POST /jobs` instead. Stems longer than the backend can render are
+    refused with 422.
     """
+    check_duration(request)
+    slot = reserve_render_slot()
     try:
-        result = await mock_generate_stems(request)
+        async with slot:
+            result = await generate_stems(request)
         return GenerationResponse(**result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred during generation: {str(e)}")
 
+
+async def _run_job(job_id: str, request: GenerationRequest, slot: RenderSlot) -> None:
+    """Waits for a render slot, renders the job's stems and records its progress and result."""
+    try:
+        async with slot:
+            generation_jobs.running(job_id)
+            result = await generate_stems(request, on_stem=lambda stem: generation_jobs.stem(job_id, stem), job_id=job_id)
+        generation_jobs.finish(job_id, GenerationResponse(**result))
+    except asyncio.CancelledError:
+        generation_jobs.fail(job_id, "The service shut down before the job finished.")
+        raise
+    except Exception as e:
+        logger.error(f"Error during generation job {job_id}: {e}", exc_info=True)
+        generation_jobs.fail(job_id, f"An error occurred during generation: {str(e)}")
+
+
+@app.post("/jobs", response_model=GenerationJob, status_code=202, tags=["Generation"])
+async def create_generation_job(request: GenerationRequest, response: Response):
+    """
+    Starts generating stems and returns a job to poll at `GET /jobs/{job_id}`
+    or follow at `GET /jobs/{job_id}/events`.
+
+    The request body is that of `POST /generate`. The job is `queued` until a
+    render slot is free; when the queue is full the job is refused with 503
+    and `Retry-After` instead. Stems longer than the backend can render are
+    refused with 422, as by `POST /generate`.
+    """
+    check_duration(request)
+    slot = reserve_render_slot()
+    job = generation_jobs.create(new_job_id())
+    task = asyncio.ensure_future(_run_job(job.job_id, request, slot))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    logger.info(f"Queued generation job {job.job_id}")
+    response.headers["Location"] = f"/jobs/{job.job_id}"
+    return job
+
+
+@app.get("/jobs/{job_id}", response_model=GenerationJob, tags=["Generation"])
+async def get_generation_job(job_id: str):
+    """Returns the state of a generation job, with the stems finished so far."""
+    job = generation_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired generation job.")
+    return job
+
+
+@app.get("/jobs/{job_id}/events", tags=["Generation"])
+async def stream_generation_job(job_id: str, last_event_id: Optional[int] = Header(None)):
+    """
+    Streams a job's progress as server-sent events: `queued`, `running`, one
+    `stem` per finished stem, and finally `done` or `failed`. Past events are
+    replayed first; a reconnecting client sends `Last-Event-ID` to resume
+    after the last event it saw. The stream ends when the job has finished.
+    """
+    if generation_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired generation job.")
+
+    async def stream():
+        after = -1 if last_event_id is None else last_event_id
+        async for event in generation_jobs.events(job_id, after, keepalive=SSE_KEEPALIVE_SECONDS):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                event_id, name, data = event
+                yield f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/", tags=["Health Check"])
 async def read_root():
     """Health check endpoint to confirm the service is running."""
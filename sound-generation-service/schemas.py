@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Literal, Optional, Dict, Any
 
 class PromptSpec(BaseModel):
     """
@@ -34,6 +34,16 @@ class GenerationRequest(BaseModel):
     """
     prompt_spec: PromptSpec = Field(..., description="The structured output from the Prompt Parser Service.")
     style_features: Optional[StyleFeatures] = Field(None, description="The JSON output from the Style Analysis Service (optional).")
+    duration: float = Field(
+        30.0, gt=0, le=600,
+        description="Approximate length of the stems in seconds; rounded to whole bars.",
+        example=30.0
+    )
+    seed: Optional[int] = Field(
+        None, ge=0, lt=2 ** 32,
+        description="Seed of the synthesizer; the same request and seed always produce the same audio. Random if omitted.",
+        example=42
+    )
 
 class GenerationResponse(BaseModel):
     """
@@ -45,3 +55,33 @@ class GenerationResponse(BaseModel):
         "bass": "/stems/job_xyz_bass.wav",
         "synth": "/stems/job_xyz_synth.wav"
     })
+    seed: int = Field(..., description="The seed the stems were synthesized with; pass it back to reproduce them.", example=42)
+    tempo: float = Field(..., description="Tempo of the stems in BPM.", example=174.0)
+    key: str = Field(..., description="Key of the stems.", example="F# Minor")
+    duration: float = Field(..., description="Length of every stem in seconds.", example=30.34)
+    stem_seconds: Dict[str, float] = Field(
+        ...,
+        description="Time spent rendering each stem, in the order they finished.",
+        example={"drums": 0.05, "bass": 0.12, "synth": 0.37}
+    )
+    seconds: float = Field(
+        ...,
+        description="Time the whole job took; with parallel rendering, about the slowest stem.",
+        example=0.41
+    )
+
+class GenerationJob(BaseModel):
+    """
+    State of an asynchronous generation job.
+    """
+    job_id: str = Field(
+        ...,
+        description="Identifier to poll the job with; also the prefix of its stem files.",
+        example="job_1a2b3c4d5e6f"
+    )
+    status: Literal["queued", "running", "done", "failed"] = Field(..., description="'queued' until a render slot is free.")
+    stems: Dict[str, str] = Field(default_factory=dict, description="Stems finished so far, in the order they finished.")
+    result: Optional[GenerationResponse] = Field(None, description="The full generation result once 'done'.")
+    error: Optional[str] = Field(None, description="Why the job failed.")
+    queued_seconds: Optional[float] = Field(None, description="Time from submission until rendering started.")
+    done_seconds: Optional[float] = Field(None, description="Time from submission until the job finished.")
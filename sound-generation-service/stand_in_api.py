@@ -0,0 +1,109 @@
+"""
+Local stand-in for the remote text-to-audio API.
+
+Serves `POST /v2beta/audio/stable-audio-2/text-to-audio` the way the remote
+backend expects it (multipart form with `prompt`, `duration`, `seed` and
+`output_format`, bearer authentication, WAV bytes back), so the remote path
+can be exercised offline. It emulates the provider's behaviour under load:
+
+- a generation latency of `latency_seconds` plus `seconds_per_audio_second`
+  for every second of audio requested;
+- at most `max_concurrent` requests in flight and `rate_limit` requests per
+  `rate_window` seconds; beyond either, 429 with `Retry-After`.
+
+The audio is rendered with the local synthesizer: the voice is picked from
+the prompt like an instrument name, and the tempo and key are read from
+"at 128 BPM" and "in A Minor" in the prompt when present.
+
+    STAND_IN_LATENCY_SECONDS=1 uvicorn stand_in_api:app --port 8100
+    GENERATION_BACKEND=remote REMOTE_API_URL=http://localhost:8100/v2beta/audio/stable-audio-2/text-to-audio \\
+        STABILITY_AI_API_KEY=anything uvicorn main:app
+"""
+import asyncio
+import math
+import os
+import re
+from typing import Optional
+
+from fastapi import FastAPI, Form, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from backends import RateWindow, STREAM_CHUNK_BYTES
+from synth import Arrangement, DEFAULT_TEMPO, clamp_tempo, parse_key, render_stem, wav_bytes
+
+TEXT_TO_AUDIO_PATH = "/v2beta/audio/stable-audio-2/text-to-audio"
+MAX_DURATION = 190.0
+TEMPO_REGEX = re.compile(r"(\d+(?:\.\d+)?)\s*BPM", re.IGNORECASE)
+KEY_REGEX = re.compile(r"\bin ([A-G][#b]?\s+(?:major|minor))\b", re.IGNORECASE)
+
+
+def _error(status_code: int, name: str, message: str, retry_after: Optional[float] = None) -> JSONResponse:
+    headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after is not None else None
+    return JSONResponse({"name": name, "errors": [message]}, status_code=status_code, headers=headers)
+
+
+def _render(prompt: str, duration: float, seed: int) -> bytes:
+    tempo_match = TEMPO_REGEX.search(prompt)
+    tempo = clamp_tempo(float(tempo_match.group(1))) if tempo_match else DEFAULT_TEMPO
+    key_match = KEY_REGEX.search(prompt)
+    tonic, mode = parse_key(key_match.group(1) if key_match else None)
+    arrangement = Arrangement(tempo, tonic, mode, max(1, round(duration * tempo / 240.0)))
+    # The instrument name leads the prompt; the voice is picked from it as from an instrument name.
+    return wav_bytes(render_stem(arrangement, prompt.split(",")[0], seed), arrangement.sr)
+
+
+def create_app(latency_seconds: float = 2.0, seconds_per_audio_second: float = 0.05, max_concurrent: int = 4,
+               rate_limit: int = 150, rate_window: float = 10.0, api_key: Optional[str] = None) -> FastAPI:
+    """
+    Builds a stand-in server. With `api_key`, only that bearer token is
+    accepted; otherwise any token is. `app.state.stats` counts the requests
+    served and refused, and records the most generations that ran at once.
+    """
+    app = FastAPI(title="Text-to-audio API stand-in")
+    app.state.stats = {"served": 0, "rate_limited": 0, "concurrency_limited": 0, "peak_concurrency": 0}
+    rate = RateWindow(rate_limit, rate_window)
+    in_flight = 0
+
+    @app.post(TEXT_TO_AUDIO_PATH)
+    async def text_to_audio(prompt: str = Form(...), duration: float = Form(30.0), seed: int = Form(0),
+                            output_format: str = Form("mp3"), authorization: Optional[str] = Header(None)):
+        nonlocal in_flight
+        if not authorization or not authorization.startswith("Bearer ") or (api_key and authorization[7:] != api_key):
+            return _error(401, "unauthorized", "Missing or invalid API key.")
+        if output_format != "wav":
+            return _error(400, "bad_request", "The stand-in only serves output_format=wav.")
+        if not 0 < duration <= MAX_DURATION:
+            return _error(400, "bad_request", f"duration must be in (0, {MAX_DURATION:.0f}].")
+        if in_flight >= max_concurrent:
+            app.state.stats["concurrency_limited"] += 1
+            return _error(429, "too_many_requests", f"At most {max_concurrent} concurrent generations.", latency_seconds)
+        if not rate.try_acquire():
+            app.state.stats["rate_limited"] += 1
+            return _error(429, "rate_limit_exceeded", f"At most {rate_limit} requests per {rate_window:g} s.", rate.delay())
+
+        in_flight += 1
+        app.state.stats["peak_concurrency"] = max(app.state.stats["peak_concurrency"], in_flight)
+        try:
+            await asyncio.sleep(latency_seconds + seconds_per_audio_second * duration)
+            audio = await asyncio.to_thread(_render, prompt, duration, seed)
+        finally:
+            in_flight -= 1
+        app.state.stats["served"] += 1
+
+        async def chunks():
+            for start in range(0, len(audio), STREAM_CHUNK_BYTES):
+                yield audio[start:start + STREAM_CHUNK_BYTES]
+
+        return StreamingResponse(chunks(), media_type="audio/wav", headers={"finish-reason": "SUCCESS", "seed": str(seed)})
+
+    return app
+
+
+app = create_app(
+    latency_seconds=float(os.getenv("STAND_IN_LATENCY_SECONDS", "2.0")),
+    seconds_per_audio_second=float(os.getenv("STAND_IN_SECONDS_PER_AUDIO_SECOND", "0.05")),
+    max_concurrent=int(os.getenv("STAND_IN_MAX_CONCURRENT", "4")),
+    rate_limit=int(os.getenv("STAND_IN_RATE_LIMIT", "150")),
+    rate_window=float(os.getenv("STAND_IN_RATE_WINDOW_SECONDS", "10")),
+    api_key=os.getenv("STAND_IN_API_KEY") or None,
+)
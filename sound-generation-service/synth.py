@@ -0,0 +1,261 @@
+"""
+Procedural stem synthesizer.
+
+Renders drums, bass, pads and leads for a tempo and key with NumPy, one
+whole stem at a time: every note or hit is laid out on the sample grid with
+array arithmetic, so there is no per-sample Python loop. The output depends
+only on the arguments, so a given seed always renders the same audio.
+
+The harmony is a four-bar progression, one chord per bar (I-V-vi-IV in
+major, i-VI-III-VII in minor); the bass follows the chord roots and the lead
+plays a seeded melody over the chord and scale tones.
+"""
+import io
+import re
+import wave
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 48000
+DEFAULT_TEMPO = 120.0
+DEFAULT_KEY = (9, "minor")  # A minor
+MIN_TEMPO, MAX_TEMPO = 40.0, 300.0
+# Peak level of every rendered stem (-1 dBFS).
+PEAK_LEVEL = 10 ** (-1 / 20)
+# Samples rendered per step of `Arrangement.notes`, bounding its temporary arrays (~22 s at 48 kHz).
+BLOCK_SAMPLES = 1 << 20
+# Samples per cycle of the wavetables the oscillators read from.
+TABLE_SIZE = 2048
+
+NOTES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+SCALES = {"major": (0, 2, 4, 5, 7, 9, 11), "minor": (0, 2, 3, 5, 7, 8, 10)}
+# Scale degree of the chord root in each bar of the progression.
+PROGRESSIONS = {"major": (0, 4, 5, 3), "minor": (0, 5, 2, 6)}
+KEY_REGEX = re.compile(r"^\s*([A-G])([#b]?)\s*(major|maj|minor|min|m)?\s*$", re.IGNORECASE)
+
+
+def parse_key(label: Optional[str]) -> Tuple[int, str]:
+    """
+    Parses a key label such as "F# Minor" or "Bb maj" into (pitch class of
+    the tonic, "major" or "minor"). A missing quality means major; missing or
+    unparseable labels fall back to `DEFAULT_KEY`.
+    """
+    match = KEY_REGEX.match(label or "")
+    if match is None:
+        return DEFAULT_KEY
+    note, accidental, quality = match.groups()
+    tonic = (NOTES[note.upper()] + {"#": 1, "b": -1}.get(accidental, 0)) % 12
+    minor = quality is not None and quality.lower() in ("minor", "min", "m")
+    return tonic, "minor" if minor else "major"
+
+
+def key_label(tonic: int, mode: str) -> str:
+    """The label of a parsed key, in the style-analysis format ("F# Minor")."""
+    return f"{NOTE_NAMES[tonic]} {mode.capitalize()}"
+
+
+def clamp_tempo(tempo: Optional[float]) -> float:
+    return float(np.clip(tempo, MIN_TEMPO, MAX_TEMPO)) if tempo else DEFAULT_TEMPO
+
+
+def midi_to_hz(note: np.ndarray) -> np.ndarray:
+    return 440.0 * 2.0 ** ((np.asarray(note, dtype=np.float64) - 69) / 12)
+
+
+class Arrangement:
+    """The time grid and harmony shared by all stems of one track."""
+
+    def __init__(self, tempo: float, tonic: int, mode: str, n_bars: int, sr: int = SAMPLE_RATE):
+        self.tempo, self.tonic, self.mode, self.n_bars, self.sr = tempo, tonic, mode, n_bars, sr
+        self.beat_samples = 60.0 * sr / tempo
+        self.n_samples = int(round(4 * n_bars * self.beat_samples))
+        scale = np.array(SCALES[mode])
+        # Diatonic triads on each bar's root, as MIDI notes around middle C.
+        degrees = np.array(PROGRESSIONS[mode])[np.arange(n_bars) % 4]
+        steps = degrees[:, None] + np.array([0, 2, 4])
+        self.chords = 60 + tonic + scale[steps % 7] + 12 * (steps // 7)  # (n_bars, 3)
+        self.scale_notes = 60 + tonic + scale
+
+    @property
+    def duration(self) -> float:
+        return self.n_samples / self.sr
+
+    def grid(self, per_beat: int) -> np.ndarray:
+        """Start samples of every 1/`per_beat` beat subdivision."""
+        return np.round(np.arange(4 * self.n_bars * per_beat) * self.beat_samples / per_beat).astype(np.int64)
+
+    def notes(self, starts: np.ndarray, pitches: np.ndarray, gains: np.ndarray,
+              voice: Callable[[np.ndarray], np.ndarray], decay: float, attack: float = 0.005) -> np.ndarray:
+        """
+        Renders notes: note `i` sounds from `starts[i]` until the next start.
+        `pitches` holds one MIDI pitch per note, or one row of pitches per note
+        for chords, which share the note's envelope. `voice` maps the phase in
+        cycles to one period of the waveform; it is sampled once into a
+        wavetable, which the oscillators read with linear interpolation (the
+        phase restarts at every note). Rendered in blocks of `BLOCK_SAMPLES`.
+        """
+        table = voice(np.arange(TABLE_SIZE + 1) / TABLE_SIZE).astype(np.float32)
+        out = np.zeros(self.n_samples, dtype=np.float32)
+        frequencies = midi_to_hz(pitches).reshape(len(starts), -1)
+        ends = np.append(starts[1:], self.n_samples)
+        for block in range(0, self.n_samples, BLOCK_SAMPLES):
+            samples = np.arange(block, min(block + BLOCK_SAMPLES, self.n_samples))
+            index = np.searchsorted(starts, samples, side="right") - 1
+            playing = index >= 0
+            index = np.maximum(index, 0)
+            elapsed = (samples - starts[index]) / self.sr
+            envelope = np.minimum(elapsed / attack, 1.0) * np.exp(-elapsed / decay) * gains[index]
+            # A short release at the end of each note avoids clicks where the next one starts.
+            envelope *= np.minimum((ends[index] - samples) / (0.004 * self.sr), 1.0) * playing
+            wave_sum = np.zeros(len(samples), dtype=np.float32)
+            for column in frequencies.T:
+                position = np.mod(elapsed * column[index], 1.0) * TABLE_SIZE
+                whole = position.astype(np.int64)
+                fraction = (position - whole).astype(np.float32)
+                wave_sum += table[whole] + (table[whole + 1] - table[whole]) * fraction
+            out[block:block + len(samples)] = wave_sum * envelope
+        return out
+
+    def hits(self, sample: np.ndarray, starts: np.ndarray, gains: np.ndarray) -> np.ndarray:
+        """
+        Places a one-shot sample at every start. The sample is cut to the
+        shortest gap between starts (with a short fade) so hits never overlap,
+        which lets all of them be written with a single indexed assignment.
+        """
+        out = np.zeros(self.n_samples)
+        if len(starts) == 0:
+            return out
+        gap = int(np.diff(starts).min()) if len(starts) > 1 else len(sample)
+        length = min(len(sample), gap, self.n_samples - int(starts[-1]))
+        fade = min(length, int(0.005 * self.sr))
+        sample = sample[:length].copy()
+        sample[length - fade:] *= np.linspace(1.0, 0.0, fade)
+        out[starts[:, None] + np.arange(length)] = sample * gains[:, None]
+        return out
+
+
+def _kick(sr: int) -> np.ndarray:
+    t = np.arange(int(0.45 * sr)) / sr
+    # Pitch falls from 150 Hz to 45 Hz; the phase is the integral of the frequency.
+    phase = 45.0 * t + (105.0 * 0.04) * (1.0 - np.exp(-t / 0.04))
+    return np.sin(2 * np.pi * phase) * np.exp(-t / 0.18)
+
+
+def _snare(sr: int, rng: np.random.Generator) -> np.ndarray:
+    t = np.arange(int(0.25 * sr)) / sr
+    noise = np.diff(rng.standard_normal(len(t) + 1))  # first difference: a tilt towards the highs
+    return (0.6 * noise * np.exp(-t / 0.06) + np.sin(2 * np.pi * 185.0 * t) * np.exp(-t / 0.05)) * 0.7
+
+
+def _hat(sr: int, rng: np.random.Generator) -> np.ndarray:
+    t = np.arange(int(0.08 * sr)) / sr
+    noise = np.diff(rng.standard_normal(len(t) + 2), n=2)
+    return 0.25 * noise * np.exp(-t / 0.015)
+
+
+def render_drums(arr: Arrangement, rng: np.random.Generator) -> np.ndarray:
+    """Kick on every beat, snare on two and four, eighth-note hats with accents."""
+    beats = arr.grid(1)
+    eighths = arr.grid(2)
+    backbeats = beats[1::2]
+    out = arr.hits(_kick(arr.sr), beats, np.full(len(beats), 1.0))
+    out += arr.hits(_snare(arr.sr, rng), backbeats, rng.uniform(0.85, 1.0, len(backbeats)))
+    hat = _hat(arr.sr, rng)
+    # Off-beat hats are quieter.
+    out += arr.hits(hat, eighths, np.where(np.arange(len(eighths)) % 2, 0.6, 1.0) * rng.uniform(0.8, 1.0, len(eighths)))
+    return out
+
+
+def render_bass(arr: Arrangement, rng: np.random.Generator) -> np.ndarray:
+    """Eighth notes on the chord root two octaves down, with the odd octave jump."""
+    starts = arr.grid(2)
+    bar = np.arange(len(starts)) // 8
+    octave = np.where(rng.random(len(starts)) < 0.2, 12, 0)
+    pitches = arr.chords[bar, 0] - 24 + octave
+
+    def voice(phase):
+        return np.tanh(2.5 * np.sin(2 * np.pi * phase)) + 0.3 * np.sin(4 * np.pi * phase)
+
+    return arr.notes(starts, pitches, np.where(np.arange(len(starts)) % 2, 0.75, 1.0), voice, decay=0.25)
+
+
+def render_pad(arr: Arrangement, rng: np.random.Generator) -> np.ndarray:
+    """Sustained chords, one per bar: each tone is two slightly detuned voices with soft harmonics."""
+    starts = arr.grid(1)[::4]
+    cents = rng.uniform(3, 7)
+    pitches = np.hstack([arr.chords - cents / 100, arr.chords + cents / 100])
+
+    def voice(phase):
+        return np.sin(2 * np.pi * phase) + 0.35 * np.sin(4 * np.pi * phase) + 0.15 * np.sin(6 * np.pi * phase)
+
+    return arr.notes(starts, pitches, np.ones(len(starts)), voice, decay=8.0, attack=0.3)
+
+
+def render_lead(arr: Arrangement, rng: np.random.Generator) -> np.ndarray:
+    """A seeded melody in sixteenths, mostly chord tones, an octave above the pads, with rests."""
+    starts = arr.grid(4)
+    bar = np.arange(len(starts)) // 16
+    chord_tones = arr.chords[bar, rng.integers(0, 3, len(starts))]
+    scale_tones = arr.scale_notes[rng.integers(0, 7, len(starts))]
+    pitches = np.where(rng.random(len(starts)) < 0.7, chord_tones, scale_tones) + 12
+    # Rests: keep a note with probability 0.6, always on the beat.
+    keep = (rng.random(len(starts)) < 0.6) | (np.arange(len(starts)) % 4 == 0)
+    gains = rng.uniform(0.7, 1.0, len(starts))
+
+    def voice(phase):
+        # Odd harmonics: a softened square wave.
+        return sum(np.sin(2 * np.pi * k * phase) / k for k in (1, 3, 5, 7))
+
+    return arr.notes(starts[keep], pitches[keep], gains[keep], voice, decay=0.18)
+
+
+RENDERERS: Dict[str, Callable[[Arrangement, np.random.Generator], np.ndarray]] = {
+    "drums": render_drums,
+    "bass": render_bass,
+    "pad": render_pad,
+    "lead": render_lead,
+}
+# Keywords that map a requested instrument name to a renderer, checked in order.
+VOICE_KEYWORDS = (
+    ("lead", ("lead", "arp", "melody", "vocal", "pluck", "hook")),
+    ("drums", ("drum", "kick", "snare", "hat", "perc", "beat", "break")),
+    ("bass", ("bass", "808", "sub")),
+    ("pad", ("pad", "synth", "chord", "string", "keys", "piano", "organ")),
+)
+
+
+def voice_for(instrument: str) -> str:
+    """The renderer for a requested instrument name; anything unrecognized is played as a lead."""
+    name = instrument.lower()
+    for voice, keywords in VOICE_KEYWORDS:
+        if any(keyword in name for keyword in keywords):
+            return voice
+    return "lead"
+
+
+def stem_seed(seed: int, instrument: str) -> np.random.SeedSequence:
+    """Per-instrument seed, so adding an instrument does not change the others."""
+    return np.random.SeedSequence([seed, zlib.crc32(instrument.encode("utf-8"))])
+
+
+def render_stem(arr: Arrangement, instrument: str, seed: int) -> np.ndarray:
+    """Renders one stem, normalized to `PEAK_LEVEL`, as float32."""
+    audio = RENDERERS[voice_for(instrument)](arr, np.random.default_rng(stem_seed(seed, instrument))).astype(np.float32)
+    peak = np.abs(audio).max()
+    audio *= PEAK_LEVEL / peak if peak > 0 else 0.0
+    return audio
+
+
+def wav_bytes(audio: np.ndarray, sr: int = SAMPLE_RATE) -> bytes:
+    """Encodes mono float audio as a 16-bit PCM WAV file."""
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(pcm.tobytes())
+    return buffer.getvalue()
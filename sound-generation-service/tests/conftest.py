@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Keep the tests' stems away from the shared volume.
+os.environ.setdefault("STEMS_DIR", tempfile.mkdtemp(prefix="sound-generation-stems-"))
@@ -1,6 +1,13 @@
+import asyncio
+import json
+import os
+import wave
+
+import numpy as np
 import pytest
-from generator import mock_generate_stems
-from schemas import GenerationRequest, PromptSpec
+from generator import STEMS_DIR, generate_stems
+from schemas import GenerationRequest, PromptSpec, StyleFeatures
+from synth import parse_key
 
 @pytest.mark.asyncio
 async def test_generate_with_specific_instruments():
@@ -8,7 +15,7 @@ async def test_generate_with_specific_instruments():
     prompt_spec = PromptSpec(instruments=["drums", "bass", "vocal chops"])
     request = GenerationRequest(prompt_spec=prompt_spec)
     
-    result = await mock_generate_stems(request)
+    result = await generate_stems(request)
     
     assert "job_id" in result
     assert "stems" in result
@@ -19,13 +26,27 @@ async def test_generate_with_specific_instruments():
     assert "bass" in stems
     assert "vocal_chops" in stems["vocal chops"] # Check space handling
 
+@pytest.mark.asyncio
+async def test_instrument_names_are_safe_file_names():
+    """Test that any instrument name maps to a file in the stems directory, one file per stem."""
+    request = GenerationRequest(prompt_spec=PromptSpec(instruments=["acid/303 line", "vocal chops", "vocal_chops", "../pad"]),
+                                duration=2, seed=3)
+
+    result = await generate_stems(request)
+
+    assert list(result["stems"]) == ["acid/303 line", "vocal chops", "../pad"]
+    assert os.path.basename(result["stems"]["acid/303 line"]) == f"{result['job_id']}_acid_303_line.wav"
+    assert os.path.basename(result["stems"]["../pad"]) == f"{result['job_id']}__pad.wav"
+    for path in result["stems"].values():
+        assert os.path.dirname(path) == STEMS_DIR and _read_wav(path)[1].size
+
 @pytest.mark.asyncio
 async def test_generate_with_default_instruments():
     """Test generation when no instruments are requested, using defaults."""
     prompt_spec = PromptSpec(instruments=[]) # Empty list
     request = GenerationRequest(prompt_spec=prompt_spec)
     
-    result = await mock_generate_stems(request)
+    result = await generate_stems(request)
     
     stems = result["stems"]
     assert len(stems) == 4
@@ -40,7 +61,7 @@ async def test_generate_returns_valid_structure():
     prompt_spec = PromptSpec()
     request = GenerationRequest(prompt_spec=prompt_spec)
     
-    result = await mock_generate_stems(request)
+    result = await generate_stems(request)
 
     assert isinstance(result, dict)
     assert "job_id" in result
@@ -48,7 +69,236 @@ async def test_generate_returns_valid_structure():
     assert "stems" in result
     assert isinstance(result["stems"], dict)
     
-    # Check that paths look like paths
+    # Check that the stems were written to the stems directory
     for instrument, path in result["stems"].items():
-        assert path.startswith("/stems/")
+        assert path.startswith(STEMS_DIR + os.sep)
         assert path.endswith(".wav")
+        assert os.path.isfile(path)
+
+
+def _read_wav(path):
+    with wave.open(path, "rb") as f:
+        return f.getframerate(), np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+
+
+@pytest.mark.asyncio
+async def test_same_seed_renders_same_audio():
+    """A seed fixes the audio; each instrument's audio does not depend on the others."""
+    def request(instruments, seed):
+        return GenerationRequest(prompt_spec=PromptSpec(tempo=140, key="C Major", instruments=instruments),
+                                 duration=4, seed=seed)
+
+    first = await generate_stems(request(["drums", "lead"], 7))
+    second = await generate_stems(request(["drums", "lead", "pad"], 7))
+    other_seed = await generate_stems(request(["drums", "lead"], 8))
+
+    assert first["seed"] == 7
+    for instrument in ("drums", "lead"):
+        assert _read_wav(first["stems"][instrument])[1].tobytes() == _read_wav(second["stems"][instrument])[1].tobytes()
+    assert _read_wav(first["stems"]["lead"])[1].tobytes() != _read_wav(other_seed["stems"]["lead"])[1].tobytes()
+
+
+@pytest.mark.asyncio
+async def test_stems_follow_tempo_and_key():
+    """Style-analysis features win over the prompt; stems span whole bars and the bass plays the tonic."""
+    request = GenerationRequest(
+        prompt_spec=PromptSpec(tempo=90, key="A Minor", instruments=["bass"]),
+        style_features=StyleFeatures(tempo=150.0, key="D Minor", segments=[]),
+        duration=6,
+    )
+    result = await generate_stems(request)
+
+    assert result["tempo"] == 150.0
+    assert result["key"] == "D Minor"
+    sr, samples = _read_wav(result["stems"]["bass"])
+    assert sr == 48000
+    # 6 s at 150 BPM is 3.75 bars of 4/4, rounded to 4.
+    assert len(samples) == round(4 * 4 * 60 * sr / 150)
+    assert result["duration"] == pytest.approx(6.4)
+
+    first_bar = samples[:round(4 * 60 * sr / 150)].astype(float)
+    spectrum = np.abs(np.fft.rfft(first_bar))
+    frequencies = np.fft.rfftfreq(len(first_bar), 1 / sr)
+    audible = frequencies > 30
+    assert frequencies[audible][spectrum[audible].argmax()] == pytest.approx(73.4, abs=3)  # D2
+
+
+def test_parse_key():
+    assert parse_key("F# Minor") == (6, "minor")
+    assert parse_key("Bb maj") == (10, "major")
+    assert parse_key("E") == (4, "major")
+    assert parse_key("not a key") == (9, "minor")
+    assert parse_key(None) == (9, "minor")
+
+
+@pytest.mark.asyncio
+async def test_stems_reported_as_they_finish():
+    """Each stem is reported once it is on disk, with its render time, in the order they finish."""
+    finished = []
+
+    def on_stem(stem):
+        assert os.path.isfile(stem.path)
+        finished.append(stem.instrument)
+
+    request = GenerationRequest(prompt_spec=PromptSpec(instruments=["drums", "bass", "pad", "lead", "drums"]), duration=2)
+    result = await generate_stems(request, on_stem=on_stem)
+
+    assert sorted(finished) == ["bass", "drums", "lead", "pad"]
+    assert list(result["stems"]) == finished
+    assert list(result["stem_seconds"]) == finished
+    assert all(seconds > 0 for seconds in result["stem_seconds"].values())
+    assert result["seconds"] >= max(result["stem_seconds"].values())
+
+
+def _job_client():
+    from fastapi.testclient import TestClient
+    import main
+    return main, TestClient(main.app)
+
+
+def _parse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+        events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_generation_job_lifecycle():
+    """A job is accepted at once, reports each stem, and its event stream replays and resumes."""
+    main, client = _job_client()
+    with client:
+        body = {"prompt_spec": {"tempo": 128, "instruments": ["drums", "bass"]}, "duration": 2, "seed": 3}
+        response = client.post("/jobs", json=body)
+        assert response.status_code == 202
+        job = response.json()
+        assert job["status"] == "queued"
+        assert response.headers["location"] == f"/jobs/{job['job_id']}"
+
+        with client.stream("GET", f"/jobs/{job['job_id']}/events") as stream:
+            assert stream.headers["content-type"].startswith("text/event-stream")
+            events = _parse_events(stream.read().decode())
+        assert [event_id for event_id, _, _ in events] == list(range(len(events)))
+        names = [name for _, name, _ in events]
+        assert names[:2] == ["queued", "running"] and names[-1] == "done"
+        assert sorted(data["instrument"] for _, name, data in events if name == "stem") == ["bass", "drums"]
+
+        done = client.get(f"/jobs/{job['job_id']}").json()
+        assert done["status"] == "done"
+        assert done["result"]["seed"] == 3
+        assert done["stems"] == done["result"]["stems"]
+        assert all(os.path.isfile(path) and os.path.basename(path).startswith(job["job_id"])
+                   for path in done["stems"].values())
+        assert done["queued_seconds"] <= done["done_seconds"]
+
+        # Resuming after the second to last event only sends the last one.
+        resumed = client.get(f"/jobs/{job['job_id']}/events", headers={"Last-Event-ID": str(len(events) - 2)})
+        assert [name for _, name, _ in _parse_events(resumed.text)] == ["done"]
+        assert client.get("/jobs/job_unknown").status_code == 404
+        assert client.get("/jobs/job_unknown/events").status_code == 404
+
+
+def test_generation_jobs_refused_when_queue_full(monkeypatch):
+    """Beyond the running and queued limits, jobs and synchronous requests get 503 with Retry-After."""
+    from jobs import RenderSlots
+    main, client = _job_client()
+    monkeypatch.setattr(main, "render_slots", RenderSlots(max_running=1, max_queue=1))
+    with client:
+        body = {"prompt_spec": {"instruments": ["pad"]}, "duration": 4}
+        first = client.post("/jobs", json=body).json()
+        assert client.post("/jobs", json=body).status_code == 202
+        for refused in (client.post("/jobs", json=body), client.post("/generate", json=body)):
+            assert refused.status_code == 503
+            assert refused.headers["retry-after"] == str(main.OVERLOAD_RETRY_AFTER_SECONDS)
+
+        with client.stream("GET", f"/jobs/{first['job_id']}/events") as stream:
+            stream.read()
+        assert client.get(f"/jobs/{first['job_id']}").json()["status"] == "done"
+
+
+def test_stems_longer_than_backend_limit_refused(monkeypatch):
+    """Durations beyond the backend's limit get 422 on both endpoints, without taking a render slot."""
+    import generator
+    main, client = _job_client()
+    monkeypatch.setattr(generator.backend, "max_duration", 60.0)
+    with client:
+        body = {"prompt_spec": {"instruments": ["pad"], "tempo": 120}, "duration": 120}
+        for refused in (client.post("/generate", json=body), client.post("/jobs", json=body)):
+            assert refused.status_code == 422
+            assert "at most 60 s per stem" in refused.json()["detail"]
+        assert main.render_slots.waiting == main.render_slots.running == 0
+        assert client.post("/generate", json={**body, "duration": 4}).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_job_events_keep_alive():
+    """A follower of an idle job gets a keep-alive, then the job's events as they happen."""
+    from jobs import GenerationJobStore
+    store = GenerationJobStore(max_jobs=10)
+    store.create("job_a")
+    follower = store.events("job_a", keepalive=0.05)
+
+    assert (await follower.__anext__())[1] == "queued"
+    assert await follower.__anext__() is None
+    store.fail("job_a", "boom")
+    event_id, name, data = await follower.__anext__()
+    assert (event_id, name, data["error"]) == (1, "failed", "boom")
+    with pytest.raises(StopAsyncIteration):
+        await follower.__anext__()
+
+
+def _remote_backend(app, **kwargs):
+    import httpx
+    from backends import RemoteBackend
+    from stand_in_api import TEXT_TO_AUDIO_PATH
+    return RemoteBackend(url=f"http://stand-in{TEXT_TO_AUDIO_PATH}", transport=httpx.ASGITransport(app=app), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_remote_backend_with_stand_in(monkeypatch):
+    """Stems come from the remote API, written to disk, with requests in parallel up to the provider's limit."""
+    import generator
+    from stand_in_api import create_app
+    app = create_app(latency_seconds=0.3, seconds_per_audio_second=0, max_concurrent=2, api_key="secret")
+    backend = _remote_backend(app, api_key="secret", max_concurrent=2)
+    monkeypatch.setattr(generator, "backend", backend)
+
+    request = GenerationRequest(prompt_spec=PromptSpec(tempo=128, key="D Minor", genre="techno",
+                                                       instruments=["drums", "bass", "pad", "lead"]), duration=2, seed=1)
+    result = await generate_stems(request)
+    await backend.close()
+
+    # Two at a time, never more than the provider allows.
+    assert app.state.stats == {"served": 4, "rate_limited": 0, "concurrency_limited": 0, "peak_concurrency": 2}
+    for path in result["stems"].values():
+        sr, samples = _read_wav(path)
+        assert sr == 48000 and len(samples) == round(4 * 60 * sr / 128)
+
+
+@pytest.mark.asyncio
+async def test_remote_backend_respects_rate_limits():
+    """Rate-limited requests are retried after Retry-After; with the provider's limit configured, none are refused."""
+    from backends import BackendError, StemTask
+    from stand_in_api import create_app
+    from synth import Arrangement
+
+    def tasks(prefix):
+        return [StemTask("job_rate", f"{prefix} {i}", os.path.join(STEMS_DIR, f"job_rate_{prefix}_{i}.wav"),
+                         Arrangement(120, 9, "minor", 1), i, f"lead {i}") for i in range(3)]
+
+    app = create_app(latency_seconds=0, seconds_per_audio_second=0, rate_limit=2, rate_window=1.0)
+    unaware = _remote_backend(app, api_key="k", rate_limit=100)
+    await asyncio.gather(*[unaware.render(task) for task in tasks("unaware")])
+    await unaware.close()
+    assert app.state.stats["served"] == 3 and app.state.stats["rate_limited"] >= 1
+
+    app = create_app(latency_seconds=0, seconds_per_audio_second=0, rate_limit=2, rate_window=1.0)
+    aware = _remote_backend(app, api_key="k", rate_limit=2, rate_window=1.0)
+    await asyncio.gather(*[aware.render(task) for task in tasks("aware")])
+    await aware.close()
+    assert (app.state.stats["served"], app.state.stats["rate_limited"], app.state.stats["concurrency_limited"]) == (3, 0, 0)
+
+    refused = _remote_backend(create_app(latency_seconds=0, api_key="right"), api_key="wrong")
+    with pytest.raises(BackendError, match="401"):
+        await refused.render(tasks("refused")[0])
+    await refused.close()
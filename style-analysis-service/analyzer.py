@@ -1,53 +1,205 @@
 import numpy as np
 import librosa
+import soundfile as sf
+from functools import cached_property
+import io
+import math
+import os
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Union
 from schemas import AnalysisResult, Segment
+import keys
+from keys import KeyEstimate
+from similarity import N_MFCC, style_vector
 import logging
 
 logger = logging.getLogger(__name__)
 
-def estimate_key(y, sr):
+HOP_LENGTH = 512
+# CQT layout used by librosa.feature.chroma_cqt by default: 7 octaves at 36 bins per octave.
+CQT_BINS_PER_OCTAVE = 36
+CQT_N_BINS = 7 * CQT_BINS_PER_OCTAVE
+# Segment count scales with the track length: one segment per SECONDS_PER_SEGMENT, within bounds.
+SECONDS_PER_SEGMENT = 20.0
+MIN_SEGMENTS = 2
+MAX_SEGMENTS = 64
+# Frame grouping used for segmentation when too few beats were found.
+COARSE_FRAME_SECONDS = 0.5
+
+# Bump whenever a change to the analysis can change its results; cached results are keyed on it.
+ANALYZER_VERSION = "6"
+
+# Analysis profiles: the rate audio is analyzed at and how it is resampled to get there.
+# Tempo, key and structure need nothing above ~11 kHz, so "fast" analyzes at 22.05 kHz
+# (resampled with soxr's high-quality filter); "accurate" keeps the native rate.
+ANALYSIS_PROFILES: Dict[str, Dict[str, Any]] = {
+    "fast": {"sr": 22050, "res_type": "soxr_hq"},
+    "accurate": {"sr": None, "res_type": None},
+}
+DEFAULT_PROFILE = "fast"
+
+# An upload held in memory, or the path of a file on disk.
+AudioSource = Union[bytes, str]
+
+# Receives the partial result (tempo and key, no segments yet) while the analysis continues.
+ProgressCallback = Callable[[AnalysisResult], None]
+
+# Tracks at least this long are analyzed block by block with bounded memory (see streaming.py).
+STREAMING_MIN_DURATION = float(os.getenv("ANALYSIS_STREAMING_MIN_SECONDS", "600"))
+
+
+def analysis_params(profile: str = DEFAULT_PROFILE, offset: float = 0.0, duration: Optional[float] = None) -> Dict[str, Any]:
+    """Everything besides the audio itself that determines the output of `analyze_audio`."""
+    if profile not in ANALYSIS_PROFILES:
+        raise ValueError(f"Unknown analysis profile '{profile}'. Expected one of: {', '.join(ANALYSIS_PROFILES)}.")
+    check_window(offset, duration)
+    params = {
+        **ANALYSIS_PROFILES[profile],
+        "mono": True,
+        "hop_length": HOP_LENGTH,
+        "segments": [SECONDS_PER_SEGMENT, MIN_SEGMENTS, MAX_SEGMENTS],
+        "streaming_min_duration": STREAMING_MIN_DURATION,
+    }
+    if offset or duration is not None:
+        # Only windowed analyses carry the window, so whole-file parameters (and cache keys) are unchanged.
+        params["window"] = [offset, duration]
+    return params
+
+
+def check_window(offset: float, duration: Optional[float]) -> None:
+    """Rejects a time window that cannot select any audio, including NaN and infinite bounds."""
+    if not math.isfinite(offset) or offset < 0:
+        raise ValueError("offset must be a finite number, zero or positive.")
+    if duration is not None and (not math.isfinite(duration) or duration <= 0):
+        raise ValueError("duration must be a finite positive number.")
+
+
+class FeatureContext:
     """
-    Estimates the musical key of an audio track using a chromagram and key profiles.
+    Per-request container for the intermediate features shared by the analysis steps.
+
+    Each feature is computed lazily on first access and memoized, so tempo, key
+    and segmentation all reuse the same CQT, chroma, onset envelope and
+    spectral centroid instead of recomputing them from the signal.
     """
-    chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-    chroma_mean = np.mean(chroma, axis=1)
-    
-    # Key profiles based on Krumhansl-Schmuckler
-    major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-    minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
 
-    major_profile /= np.sum(major_profile)
-    minor_profile /= np.sum(minor_profile)
-    
-    notes = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    keys = [note + ' Major' for note in notes] + [note + ' Minor' for note in notes]
-    
-    correlations = []
-    for i in range(12):
-        correlations.append(np.corrcoef(chroma_mean, np.roll(major_profile, i))[0, 1])
-    for i in range(12):
-        correlations.append(np.corrcoef(chroma_mean, np.roll(minor_profile, i))[0, 1])
+    def __init__(self, y: np.ndarray, sr: int, hop_length: int = HOP_LENGTH):
+        self.y = y
+        self.sr = sr
+        self.hop_length = hop_length
 
-    best_key_index = np.argmax(correlations)
-    return keys[best_key_index]
+    @cached_property
+    def duration(self) -> float:
+        return librosa.get_duration(y=self.y, sr=self.sr)
 
+    @cached_property
+    def cqt(self) -> np.ndarray:
+        """Constant-Q magnitude spectrogram, the most expensive transform in the service."""
+        return np.abs(librosa.cqt(
+            y=self.y, sr=self.sr, hop_length=self.hop_length,
+            n_bins=CQT_N_BINS, bins_per_octave=CQT_BINS_PER_OCTAVE, tuning=None,  # estimate tuning, as chroma_cqt does
+        ))
 
-def segment_audio(y, sr, num_segments=10):
+    @cached_property
+    def chroma(self) -> np.ndarray:
+        return librosa.feature.chroma_cqt(
+            C=self.cqt, sr=self.sr, hop_length=self.hop_length, bins_per_octave=CQT_BINS_PER_OCTAVE
+        )
+
+    @cached_property
+    def onset_envelope(self) -> np.ndarray:
+        return librosa.onset.onset_strength(y=self.y, sr=self.sr, hop_length=self.hop_length)
+
+    @cached_property
+    def spectral_centroid(self) -> np.ndarray:
+        return librosa.feature.spectral_centroid(y=self.y, sr=self.sr, hop_length=self.hop_length)
+
+    @cached_property
+    def mfcc(self) -> np.ndarray:
+        """MFCCs 1 to N_MFCC of a log-mel spectrogram without a dynamic-range floor (as streaming.py computes them)."""
+        mel = librosa.feature.melspectrogram(y=self.y, sr=self.sr, hop_length=self.hop_length)
+        return librosa.feature.mfcc(S=librosa.power_to_db(mel, top_db=None), n_mfcc=N_MFCC + 1)[1:]
+
+    @cached_property
+    def beats(self):
+        """(tempo, beat frames) from the shared onset envelope."""
+        return librosa.beat.beat_track(
+            onset_envelope=self.onset_envelope, sr=self.sr, hop_length=self.hop_length
+        )
+
+
+def estimate_key(y, sr, features: Optional[FeatureContext] = None) -> KeyEstimate:
+    """
+    Estimates the musical key of an audio track from its chromagram; see keys.py.
+    """
+    features = features or FeatureContext(y, sr)
+    return keys.estimate_key(features.chroma)
+
+
+def timbre_frames(features: FeatureContext) -> np.ndarray:
+    """Per-frame timbre: spectral centroid (as a fraction of the Nyquist rate) over the MFCCs."""
+    centroid = features.spectral_centroid / (features.sr / 2.0)
+    n_frames = min(centroid.shape[1], features.mfcc.shape[1])
+    return np.vstack([centroid[:, :n_frames], features.mfcc[:, :n_frames]])
+
+
+def adaptive_num_segments(duration: float) -> int:
+    """Number of segments for a track of the given length in seconds."""
+    return int(np.clip(round(duration / SECONDS_PER_SEGMENT), MIN_SEGMENTS, MAX_SEGMENTS))
+
+
+def cluster_boundaries(features: np.ndarray, beat_columns: np.ndarray, num_segments: int, coarse_columns: int) -> np.ndarray:
+    """
+    Agglomerative segmentation on beat-synchronous features.
+
+    Feature columns are averaged between consecutive beats before clustering,
+    so the cost depends on the number of beats rather than frames. When there
+    are too few beats, fixed groups of `coarse_columns` columns are used
+    instead. Returns the segment start positions as column indices of `features`.
+    """
+    n_columns = features.shape[1]
+    starts = librosa.util.fix_frames(beat_columns, x_min=0, x_max=n_columns)
+    if len(starts) - 1 <= num_segments:
+        starts = librosa.util.fix_frames(np.arange(0, n_columns, max(1, coarse_columns)), x_min=0, x_max=n_columns)
+    synced = librosa.util.sync(features, starts, aggregate=np.mean, pad=False)
+    boundaries = librosa.segment.agglomerative(synced, k=min(num_segments, synced.shape[1]))
+    return starts[boundaries]
+
+
+def segment_audio(y, sr, num_segments: Optional[int] = None, features: Optional[FeatureContext] = None,
+                  segment_start: float = 0.0):
     """
     Performs structural segmentation on an audio track.
+
+    Without `num_segments`, the count adapts to the track length. Segment
+    times are shifted by `segment_start`; see `segments_from_boundaries`.
     """
-    chroma_seg = librosa.feature.chroma_cqt(y=y, sr=sr)
+    features = features or FeatureContext(y, sr)
+    num_segments = num_segments or adaptive_num_segments(features.duration)
     
     try:
-        margin_chroma = librosa.util.stack([chroma_seg, librosa.feature.spectral_centroid(y=y, sr=sr)])
-        boundaries = librosa.segment.agglomerative(margin_chroma, k=num_segments)
-        boundary_times = librosa.frames_to_time(boundaries, sr=sr)
+        # Chroma is in [0, 1]; scale the centroid (Hz) to the same range so it cannot dominate.
+        centroid = features.spectral_centroid / (sr / 2.0)
+        n_frames = min(features.chroma.shape[1], centroid.shape[1])
+        margin_chroma = np.vstack([features.chroma[:, :n_frames], centroid[:, :n_frames]])
+        _, beats = features.beats
+        coarse_frames = int(round(COARSE_FRAME_SECONDS * sr / features.hop_length))
+        boundaries = cluster_boundaries(margin_chroma, beats, num_segments, coarse_frames)
+        boundary_times = librosa.frames_to_time(boundaries, sr=sr, hop_length=features.hop_length)
     except Exception as e:
         logger.warning(f"Agglomerative segmentation failed: {e}. Falling back to fixed splitting.")
-        duration = librosa.get_duration(y=y, sr=sr)
-        boundary_times = np.linspace(0, duration, num_segments + 1)
+        boundary_times = np.linspace(0, features.duration, num_segments + 1)
+
+    return segments_from_boundaries(boundary_times, features.duration, segment_start)
 
-    full_duration = librosa.get_duration(y=y, sr=sr)
+
+def segments_from_boundaries(boundary_times: np.ndarray, full_duration: float, segment_start: float = 0.0) -> List[Segment]:
+    """
+    Turns segment boundary times into labelled segments covering the whole track.
+
+    Boundary times are relative to the analyzed signal; `segment_start` (the
+    offset of an analyzed window) is added to the reported segment times.
+    """
     boundary_times = np.concatenate(([0], boundary_times, [full_duration]))
     boundary_times = np.unique(boundary_times)
     
@@ -58,32 +210,110 @@ def segment_audio(y, sr, num_segments=10):
         end_time = boundary_times[i+1]
         if end_time > start_time + 0.5: # Only include segments longer than 0.5s
             segments.append(
-                Segment(start_time=start_time, end_time=end_time, label=f"Part {labels[i % len(labels)]}")
+                Segment(start_time=start_time + segment_start, end_time=end_time + segment_start,
+                        label=f"Part {labels[i % len(labels)]}")
             )
             
     return segments
 
 
-def analyze_audio(file_path: str) -> AnalysisResult:
+def _window_duration(source: AudioSource, offset: float, duration: Optional[float]) -> float:
+    """Length of the analyzed window according to the file header, or 0 when soundfile cannot read the format."""
+    remaining = max(_duration_from_header(source) - offset, 0.0)
+    return remaining if duration is None else min(duration, remaining)
+
+
+def _duration_from_header(source: AudioSource) -> float:
+    """The track length according to the file header, or 0 when soundfile cannot read the format."""
+    try:
+        return sf.info(io.BytesIO(source) if isinstance(source, bytes) else source).duration
+    except Exception:
+        return 0.0
+
+
+def load_audio(source: AudioSource, sr: Optional[int], res_type: Optional[str], offset: float = 0.0,
+               duration: Optional[float] = None):
+    """
+    Decodes an upload held in memory or a file on disk to a mono signal.
+
+    Bytes are decoded straight from memory when soundfile supports the format
+    (WAV, FLAC, OGG, MP3, ...). Other formats are decoded by librosa's audioread
+    fallback, which needs a real file, so only those are written to disk.
+
+    Only `duration` seconds from `offset` are returned. soundfile seeks to the
+    offset, so nothing outside the window is decoded; the audioread fallback
+    decodes from the start and discards what precedes the window.
+    """
+    kwargs = {"sr": sr, "mono": True, "offset": offset, "duration": duration}
+    if sr is not None:
+        kwargs["res_type"] = res_type
+    if not isinstance(source, bytes):
+        return librosa.load(source, **kwargs)
+    try:
+        return librosa.load(io.BytesIO(source), **kwargs)
+    except Exception as e:
+        logger.info(f"Decoding from memory failed ({e}); decoding from a temporary file.")
+    with tempfile.NamedTemporaryFile() as tmp_file:
+        tmp_file.write(source)
+        tmp_file.flush()
+        return librosa.load(tmp_file.name, **kwargs)
+
+
+def analyze_audio(source: AudioSource, profile: str = DEFAULT_PROFILE, offset: float = 0.0,
+                  duration: Optional[float] = None, progress: Optional[ProgressCallback] = None) -> AnalysisResult:
     """
     Main analysis function. Loads an audio file and extracts features.
+
+    The source is the path of an audio file, or its encoded bytes.
+    The profile selects the analysis sample rate; see `ANALYSIS_PROFILES`.
+    Files of at least `STREAMING_MIN_DURATION` seconds are analyzed by
+    `streaming.analyze_stream`, whose memory use does not grow with the
+    track length; everything else is decoded into memory.
+
+    `offset` and `duration` (in seconds) restrict the analysis to a window of
+    the track: only the window is decoded, tempo, key and segments describe
+    just the window, and segment times stay on the track's timeline.
+
+    If `progress` is given, it receives a partial result with the tempo and
+    key as soon as they are known, before segmentation starts.
     """
+    params = analysis_params(profile, offset, duration)
+    if _window_duration(source, offset, duration) >= STREAMING_MIN_DURATION:
+        from streaming import analyze_stream  # imports this module
+        logger.info("Analyzing block by block")
+        return analyze_stream(source, params["sr"], HOP_LENGTH, params["res_type"], progress=progress,
+                              offset=offset, duration=duration)
+
     try:
-        y, sr = librosa.load(file_path, sr=None, mono=True)
+        y, sr = load_audio(source, params["sr"], params["res_type"], offset, duration)
     except Exception as e:
         raise IOError(f"Could not load audio file: {e}")
+    if len(y) == 0:
+        raise IOError("Could not load audio file: the window contains no audio.")
+
+    # Intermediate features are computed once and shared by all three steps.
+    features = FeatureContext(y, sr)
 
     # 1. Estimate Tempo
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    tempo, _ = features.beats
     
     # 2. Estimate Key
-    key = estimate_key(y, sr)
+    key = estimate_key(y, sr, features)
+    if progress is not None:
+        progress(AnalysisResult(tempo=float(tempo), key=key.key, key_confidence=key.confidence, segments=[]))
     
     # 3. Perform Segmentation
-    segments = segment_audio(y, sr)
+    segments = segment_audio(y, sr, features=features, segment_start=offset)
+
+    # 4. Summarize the style for the similarity index
+    timbre = timbre_frames(features)
+    vector = style_vector(features.chroma.mean(axis=1), float(tempo), timbre.mean(axis=1), timbre.std(axis=1),
+                          segments, features.duration)
     
     return AnalysisResult(
         tempo=float(tempo),
-        key=key,
-        segments=segments
+        key=key.key,
+        key_confidence=key.confidence,
+        segments=segments,
+        style_vector=vector,
     )
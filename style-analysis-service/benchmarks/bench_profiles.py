@@ -0,0 +1,64 @@
+"""
+Speed and accuracy of the analysis profiles.
+
+Renders synthetic tracks with a known tempo and key at several sample rates,
+writes them as WAV files and runs `analyze_audio` on each with every profile.
+
+    python -m benchmarks.bench_profiles
+    python -m benchmarks.bench_profiles --duration 60 --rates 44100 48000 96000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import soundfile as sf
+
+from analyzer import ANALYSIS_PROFILES, analyze_audio
+from benchmarks.signals import cases, synthetic_track, tempo_error
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=60.0, help="Track length in seconds.")
+    parser.add_argument("--rates", type=int, nargs="+", default=[44100, 48000, 96000], help="Sample rates to test.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per track and profile; the median is reported.")
+    args = parser.parse_args(argv)
+
+    print(f"{'rate':>7} {'profile':<9} {'median s':>9} {'speed-up':>9} {'tempo err':>10} {'key ok':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for rate in args.rates:
+            paths = []
+            for i, (tempo, tonic, mode) in enumerate(cases()):
+                y, key = synthetic_track(args.duration, rate, tempo, tonic, mode, seed=i)
+                path = os.path.join(directory, f"{rate}_{i}.wav")
+                sf.write(path, y, rate, subtype="PCM_16")
+                paths.append((path, tempo, key))
+
+            rows = {}
+            for profile in ANALYSIS_PROFILES:
+                timings, errors, keys_ok = [], [], 0
+                for path, tempo, key in paths:
+                    analyze_audio(path, profile)  # warm-up (numba, FFT plans, page cache)
+                    runs = []
+                    for _ in range(args.repeat):
+                        started = time.perf_counter()
+                        result = analyze_audio(path, profile)
+                        runs.append(time.perf_counter() - started)
+                    timings.append(statistics.median(runs))
+                    errors.append(tempo_error(result.tempo, tempo))
+                    keys_ok += result.key == key
+                rows[profile] = (statistics.mean(timings), statistics.mean(errors), keys_ok)
+
+            # Speed-up is relative to analyzing at the native rate.
+            native_time = rows["accurate"][0]
+            for profile, (elapsed, error, keys_ok) in rows.items():
+                print(f"{rate:>7} {profile:<9} {elapsed:>9.2f} {native_time / elapsed:>8.2f}x "
+                      f"{error * 100:>9.2f}% {keys_ok:>3}/{len(paths)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
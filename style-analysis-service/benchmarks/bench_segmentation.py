@@ -0,0 +1,67 @@
+"""
+Segmentation time against track duration.
+
+Times `segment_audio` (beat-synchronous clustering) and, for comparison,
+agglomerative clustering on the frame-level features, on synthetic tracks of
+increasing length. Feature extraction is done before timing, so only the
+segmentation step is measured.
+
+    python -m benchmarks.bench_segmentation
+    python -m benchmarks.bench_segmentation --durations 30 120 600 --frame-level-max 120
+"""
+import argparse
+import sys
+import time
+
+import librosa
+import numpy as np
+
+from analyzer import FeatureContext, adaptive_num_segments, segment_audio
+from benchmarks.signals import synthetic_track
+
+
+def frame_level_segmentation(features: FeatureContext, num_segments: int) -> np.ndarray:
+    """The previous approach: cluster every frame of the stacked chroma and centroid."""
+    centroid = features.spectral_centroid / (features.sr / 2.0)
+    n_frames = min(features.chroma.shape[1], centroid.shape[1])
+    stacked = np.vstack([features.chroma[:, :n_frames], centroid[:, :n_frames]])
+    return librosa.segment.agglomerative(stacked, k=num_segments)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 60, 120, 300, 600, 1200],
+                        help="Track lengths in seconds.")
+    parser.add_argument("--sr", type=int, default=22050, help="Analysis sample rate.")
+    parser.add_argument("--frame-level-max", type=float, default=1200,
+                        help="Longest duration to also time frame-level clustering for (it grows quickly).")
+    args = parser.parse_args(argv)
+
+    # Warm-up: the first clustering call pays for importing scikit-learn.
+    y, _ = synthetic_track(10, args.sr)
+    segment_audio(y, args.sr)
+
+    print(f"{'duration s':>10} {'frames':>8} {'beats':>6} {'segments':>9} {'beat-sync s':>12} {'frame-level s':>14}")
+    for duration in args.durations:
+        y, _ = synthetic_track(duration, args.sr)
+        features = FeatureContext(y, args.sr)
+        _ = features.chroma, features.spectral_centroid, features.beats  # precompute
+        num_segments = adaptive_num_segments(features.duration)
+
+        started = time.perf_counter()
+        segment_audio(y, args.sr, features=features)
+        beat_sync = time.perf_counter() - started
+
+        frame_level = float("nan")
+        if duration <= args.frame_level_max:
+            started = time.perf_counter()
+            frame_level_segmentation(features, num_segments)
+            frame_level = time.perf_counter() - started
+
+        print(f"{duration:>10.0f} {features.chroma.shape[1]:>8} {len(features.beats[1]):>6} {num_segments:>9} "
+              f"{beat_sync:>12.3f} {frame_level:>14.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Speed, memory and accuracy of the style analysis over track length and sample rate.
+
+Writes synthetic tracks with a known tempo, key and section layout (see
+`signals.write_track`) for every duration, sample rate and test case, then
+runs each measurement in a fresh worker process:
+
+- `analyze_audio` (default profile): wall time, peak RSS, tempo error, key,
+  and the F-measure of the segment boundaries against the sections (3 s window);
+- `estimate_key` and `segment_audio` on the decoded signal, for tracks short
+  enough for the in-memory path (longer ones are analyzed block by block and
+  never call them).
+
+Each worker first runs the service's warm-up, so the timings exclude numba
+compilation; peak RSS is the worker's high-water mark and includes the
+memory of the imports and the warm-up (reported as the baseline).
+
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --durations 10 60 --rates 22050 --json before.json
+    python -m benchmarks.bench_suite --durations 10 60 --rates 22050 --compare before.json
+
+With `--compare`, accuracy is checked against an earlier `--json` run of the
+same grid, and the exit status is 1 if any tempo error grew by more than
+`--tempo-tolerance`, a key that was right is now wrong, or a boundary
+F-measure fell by more than `--boundary-tolerance`.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.signals import boundary_f_measure, cases, tempo_error, write_track
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _measure(path: str, measurement: str) -> Dict[str, Any]:
+    """Runs one measurement in this (fresh) worker process after warming it up."""
+    from analyzer import ANALYSIS_PROFILES, DEFAULT_PROFILE, estimate_key, load_audio, segment_audio, analyze_audio
+    from worker_pool import _warm_up
+
+    _warm_up()
+    baseline = _peak_rss_mb()
+    if measurement == "analyze_audio":
+        started = time.perf_counter()
+        result = analyze_audio(path)
+        elapsed = time.perf_counter() - started
+        output = {"tempo": result.tempo, "key": result.key,
+                  "boundaries": [segment.start_time for segment in result.segments[1:]]}
+    else:
+        profile = ANALYSIS_PROFILES[DEFAULT_PROFILE]
+        y, sr = load_audio(path, profile["sr"], profile["res_type"])
+        baseline = _peak_rss_mb()
+        started = time.perf_counter()
+        if measurement == "estimate_key":
+            output = {"key": estimate_key(y, sr).key}
+        else:
+            output = {"boundaries": [segment.start_time for segment in segment_audio(y, sr)[1:]]}
+        elapsed = time.perf_counter() - started
+    return {**output, "seconds": elapsed, "peak_rss_mb": _peak_rss_mb(), "baseline_rss_mb": baseline}
+
+
+def run_suite(durations: List[float], rates: List[int], section_seconds: float) -> List[Dict[str, Any]]:
+    """Measures every (duration, rate, case); returns one record per measurement."""
+    from analyzer import STREAMING_MIN_DURATION
+
+    records = []
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        for duration in durations:
+            for rate in rates:
+                for i, (tempo, tonic, mode) in enumerate(cases()):
+                    path = os.path.join(directory, "track.wav")
+                    # Short tracks get shorter sections, so there is at least one boundary.
+                    key, truth = write_track(path, duration, rate, tempo, tonic, mode,
+                                             min(section_seconds, duration / 2), seed=i)
+                    measurements = ["analyze_audio"]
+                    if duration < STREAMING_MIN_DURATION:
+                        measurements += ["estimate_key", "segment_audio"]
+                    for measurement in measurements:
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as worker:
+                            out = worker.submit(_measure, path, measurement).result()
+                        record = {"measurement": measurement, "duration": duration, "rate": rate, "case": i,
+                                  "seconds": out["seconds"], "peak_rss_mb": out["peak_rss_mb"],
+                                  "baseline_rss_mb": out["baseline_rss_mb"]}
+                        if "tempo" in out:
+                            record["tempo_error"] = tempo_error(out["tempo"], tempo)
+                        if "key" in out:
+                            record["key_ok"] = out["key"] == key
+                        if "boundaries" in out:
+                            record["boundary_f"] = boundary_f_measure(out["boundaries"], truth)
+                        records.append(record)
+                        print(_describe(record), file=sys.stderr)
+    return records
+
+
+def _describe(record: Dict[str, Any]) -> str:
+    accuracy = []
+    if "tempo_error" in record:
+        accuracy.append(f"tempo err {record['tempo_error'] * 100:.2f}%")
+    if "key_ok" in record:
+        accuracy.append(f"key {'ok' if record['key_ok'] else 'WRONG'}")
+    if "boundary_f" in record:
+        accuracy.append(f"boundary F {record['boundary_f']:.2f}")
+    return (f"{record['measurement']:<14} {record['duration']:>6.0f}s {record['rate']:>6} case {record['case']}: "
+            f"{record['seconds']:.2f}s, peak {record['peak_rss_mb']:.0f} MB, {', '.join(accuracy)}")
+
+
+def summarize(records: List[Dict[str, Any]]) -> None:
+    """Prints one row per measurement, duration and rate, averaged over the test cases."""
+    print(f"{'measurement':<14} {'duration':>9} {'rate':>6} {'time s':>8} {'peak MB':>8} {'base MB':>8} "
+          f"{'tempo err':>10} {'keys':>5} {'bound F':>8}")
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for record in records:
+        groups.setdefault((record["measurement"], record["duration"], record["rate"]), []).append(record)
+    for (measurement, duration, rate), group in groups.items():
+        tempo = (f"{statistics.mean(r['tempo_error'] for r in group) * 100:>9.2f}%"
+                 if "tempo_error" in group[0] else f"{'-':>10}")
+        keys = f"{sum(r['key_ok'] for r in group)}/{len(group)}" if "key_ok" in group[0] else "-"
+        boundary = f"{statistics.mean(r['boundary_f'] for r in group):.2f}" if "boundary_f" in group[0] else "-"
+        print(f"{measurement:<14} {duration:>8.0f}s {rate:>6} {statistics.mean(r['seconds'] for r in group):>8.2f} "
+              f"{max(r['peak_rss_mb'] for r in group):>8.0f} {min(r['baseline_rss_mb'] for r in group):>8.0f} "
+              f"{tempo} {keys:>5} {boundary:>8}")
+
+
+def compare(records: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tempo_tolerance: float,
+            boundary_tolerance: float) -> List[str]:
+    """Returns a description of every accuracy regression against a baseline run."""
+    def identity(record):
+        return record["measurement"], record["duration"], record["rate"], record["case"]
+
+    before = {identity(record): record for record in baseline}
+    regressions = []
+    for record in records:
+        old = before.get(identity(record))
+        if old is None:
+            continue
+        name = "{} {:.0f}s {} Hz case {}".format(*identity(record))
+        if "tempo_error" in record and record["tempo_error"] > old["tempo_error"] + tempo_tolerance:
+            regressions.append(f"{name}: tempo error {old['tempo_error']:.2%} -> {record['tempo_error']:.2%}")
+        if "key_ok" in record and old["key_ok"] and not record["key_ok"]:
+            regressions.append(f"{name}: key no longer correct")
+        if "boundary_f" in record and record["boundary_f"] < old["boundary_f"] - boundary_tolerance:
+            regressions.append(f"{name}: boundary F {old['boundary_f']:.2f} -> {record['boundary_f']:.2f}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=float, nargs="+", default=[10, 60, 300, 1200, 3600],
+                        help="Track lengths in seconds.")
+    parser.add_argument("--rates", type=int, nargs="+", default=[22050, 44100, 48000], help="Sample rates of the tracks.")
+    parser.add_argument("--section-seconds", type=float, default=20.0, help="Length of the synthetic sections.")
+    parser.add_argument("--json", help="Write every measurement to this file.")
+    parser.add_argument("--compare", help="A previous --json output to check accuracy against.")
+    parser.add_argument("--tempo-tolerance", type=float, default=0.005, help="Allowed growth of the relative tempo error.")
+    parser.add_argument("--boundary-tolerance", type=float, default=0.1, help="Allowed drop of a boundary F-measure.")
+    args = parser.parse_args(argv)
+
+    records = run_suite(args.durations, args.rates, args.section_seconds)
+    summarize(records)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=1)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(records, json.load(f), args.tempo_tolerance, args.boundary_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No accuracy regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
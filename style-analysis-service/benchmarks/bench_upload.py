@@ -0,0 +1,83 @@
+"""
+Request latency and file I/O of `POST /analyze/` for small and large uploads.
+
+Posts synthetic WAV files through the ASGI app (result cache disabled, one
+analysis worker) and reports the median request latency together with the
+bytes written and read through files by the server and worker processes,
+taken from /proc/<pid>/io (Linux only). Starlette itself spools multipart
+uploads above 1 MB to a temporary file; that cost is included in the numbers.
+
+    python -m benchmarks.bench_upload
+    python -m benchmarks.bench_upload --seconds 10 480 --repeat 5
+"""
+import argparse
+import io
+import logging
+import os
+import statistics
+import sys
+import time
+
+os.environ["ANALYSIS_CACHE_DIR"] = ""
+os.environ.setdefault("ANALYSIS_WORKERS", "1")
+
+import numpy as np  # noqa: E402
+import soundfile as sf  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from benchmarks.signals import synthetic_track  # noqa: E402
+
+IO_FIELDS = ("rchar", "wchar", "read_bytes", "write_bytes")
+
+
+def _io_counters(pids) -> dict:
+    totals = dict.fromkeys(IO_FIELDS, 0)
+    for pid in pids:
+        with open(f"/proc/{pid}/io", "r", encoding="ascii") as f:
+            for line in f:
+                name, value = line.split(":")
+                if name in totals:
+                    totals[name] += int(value)
+    return totals
+
+
+def main_(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, nargs="+", default=[10, 480],
+                        help="Durations of the uploaded stereo 44.1 kHz WAV files.")
+    parser.add_argument("--repeat", type=int, default=3, help="Requests per file; the median latency is reported.")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    client = TestClient(main.app)
+    print(f"{'upload MB':>9} {'median ms':>10} {'written MB':>11} {'read MB':>8} {'write() MB':>11} {'read() MB':>10}")
+    for seconds in args.seconds:
+        y, _ = synthetic_track(seconds, 44100)
+        buffer = io.BytesIO()
+        sf.write(buffer, np.stack([y, y], axis=1), 44100, format="WAV", subtype="PCM_16")
+        audio = buffer.getvalue()
+
+        def post():
+            response = client.post("/analyze/", files={"file": ("track.wav", audio, "audio/wav")})
+            assert response.status_code == 200, response.text
+
+        post()  # warm-up; also starts the worker
+        pids = [os.getpid()] + [w.pid for w in main.analysis_pool.stats().per_worker]
+        latencies = []
+        before = _io_counters(pids)
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            post()
+            latencies.append(time.perf_counter() - started)
+        after = _io_counters(pids)
+        delta = {name: (after[name] - before[name]) / args.repeat / 2**20 for name in IO_FIELDS}
+
+        print(f"{len(audio) / 2**20:>9.1f} {statistics.median(latencies) * 1000:>10.0f} {delta['write_bytes']:>11.1f} "
+              f"{delta['read_bytes']:>8.1f} {delta['wchar']:>11.1f} {delta['rchar']:>10.1f}")
+    main.analysis_pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_())
@@ -0,0 +1,139 @@
+from typing import List, Tuple
+
+import numpy as np
+import soundfile as sf
+
+# Pitch classes as used by the analyzer's key labels.
+NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+MAJOR_TRIAD = (0, 4, 7)
+MINOR_TRIAD = (0, 3, 7)
+
+
+def _tone(frequency: float, n: int, sr: int) -> np.ndarray:
+    """A tone with a few decaying harmonics, so chroma sees more than a bare sine."""
+    t = np.arange(n) / sr
+    return sum((0.6 ** k) * np.sin(2 * np.pi * frequency * (k + 1) * t) for k in range(4))
+
+
+def _chord(bar_index: int, tonic: str, mode: str, n: int, sr: int, octave: int = 0) -> np.ndarray:
+    """The triad of a I-IV-V-I (or i-iv-v-i) progression for the given bar."""
+    root = NOTES.index(tonic)
+    triad = MAJOR_TRIAD if mode == "Major" else MINOR_TRIAD
+    degree = (0, 5, 7, 0)[bar_index % 4]
+    return sum(
+        _tone(220.0 * 2 ** (((root + degree + interval) % 12 - 9) / 12 + octave), n, sr) for interval in triad
+    )
+
+
+def synthetic_track(
+    duration: float,
+    sr: int,
+    tempo: float = 128.0,
+    tonic: str = "A",
+    mode: str = "Minor",
+    seed: int = 0,
+) -> Tuple[np.ndarray, str]:
+    """
+    Returns a mono test track and its ground-truth key label.
+
+    The track is a click on every beat at `tempo` over a I-IV-V-I (or i-iv-v-i)
+    progression of sustained triads, one chord per bar, plus a little noise.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration * sr)
+    y = np.zeros(n, dtype=np.float32)
+
+    bar = int(4 * 60.0 / tempo * sr)
+    for i, start in enumerate(range(0, n, bar)):
+        length = min(bar, n - start)
+        y[start:start + length] += 0.08 * _chord(i, tonic, mode, length, sr).astype(np.float32)
+
+    click = (np.exp(-np.arange(int(0.02 * sr)) / (0.003 * sr)) * rng.standard_normal(int(0.02 * sr))).astype(np.float32)
+    for beat in np.arange(0, duration, 60.0 / tempo):
+        start = int(beat * sr)
+        end = min(start + len(click), n)
+        y[start:end] += 0.8 * click[:end - start]
+
+    y += 0.005 * rng.standard_normal(n).astype(np.float32)
+    return y / np.max(np.abs(y)), f"{tonic} {mode}"
+
+
+def tempo_error(estimated: float, truth: float) -> float:
+    """Relative tempo error, forgiving the usual half/double-time confusion."""
+    return min(abs(estimated * factor - truth) / truth for factor in (0.5, 1.0, 2.0))
+
+
+def cases() -> List[Tuple[float, str, str]]:
+    """A few (tempo, tonic, mode) combinations covering both modes and a range of tempi."""
+    return [(128.0, "A", "Minor"), (95.0, "E", "Major"), (174.0, "F#", "Minor")]
+
+
+def write_track(
+    path: str,
+    duration: float,
+    sr: int,
+    tempo: float = 128.0,
+    tonic: str = "A",
+    mode: str = "Minor",
+    section_seconds: float = 20.0,
+    seed: int = 0,
+) -> Tuple[str, List[float]]:
+    """
+    Writes a test track with known sections to a 16-bit WAV file, bar by bar,
+    so hour-long tracks never sit in memory. Returns the ground-truth key
+    label and section boundary times (in seconds, excluding 0).
+
+    Like `synthetic_track`, it is a click on every beat over the chord
+    progression. Every other section instead holds the tonic chord, doubled
+    an octave up over a noise layer, which changes harmony and timbre but not
+    the key. Sections change on the first bar at or after each
+    multiple of `section_seconds`.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration * sr)
+    bar = int(4 * 60.0 / tempo * sr)
+    beat_samples = [int(k * 60.0 / tempo * sr) for k in range(4)]
+    click = np.exp(-np.arange(int(0.02 * sr)) / (0.003 * sr)) * rng.standard_normal(int(0.02 * sr))
+
+    boundaries: List[float] = []
+    section = 0
+    with sf.SoundFile(path, "w", samplerate=sr, channels=1, subtype="PCM_16") as f:
+        for i, start in enumerate(range(0, n, bar)):
+            if start / sr >= (section + 1) * section_seconds:
+                section += 1
+                boundaries.append(start / sr)
+            length = min(bar, n - start)
+            if section % 2:
+                # A "drop": the tonic chord held, doubled an octave up, over a noise layer.
+                block = 0.08 * _chord(0, tonic, mode, length, sr) + 0.05 * _chord(0, tonic, mode, length, sr, octave=1)
+                block += 0.03 * rng.standard_normal(length)
+            else:
+                block = 0.08 * _chord(i, tonic, mode, length, sr)
+            for offset in beat_samples:
+                end = min(offset + len(click), length)
+                if offset < end:
+                    block[offset:end] += 0.4 * click[:end - offset]
+            block += 0.005 * rng.standard_normal(length)
+            f.write(np.clip(0.9 * block, -1.0, 1.0).astype(np.float32))
+    return f"{tonic} {mode}", boundaries
+
+
+def boundary_f_measure(estimated: List[float], truth: List[float], window: float = 3.0) -> float:
+    """
+    F-measure of estimated segment boundaries against the true ones: an
+    estimate within `window` seconds of a true boundary is a hit, and each
+    true boundary can be hit once. Two empty lists score 1.
+    """
+    if not estimated and not truth:
+        return 1.0
+    unmatched = list(truth)
+    hits = 0
+    for time in sorted(estimated):
+        nearest = min(unmatched, key=lambda t: abs(t - time), default=None)
+        if nearest is not None and abs(nearest - time) <= window:
+            unmatched.remove(nearest)
+            hits += 1
+    if hits == 0:
+        return 0.0
+    precision, recall = hits / len(estimated), hits / len(truth)
+    return 2 * precision * recall / (precision + recall)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from schemas import AnalysisResult, CacheStats
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(content_hash: str, params: Dict[str, Any], version: str) -> str:
+    """Combines the upload's SHA-256 with the analysis parameters and version into one cache key."""
+    material = json.dumps({"content": content_hash, "params": params, "version": version}, sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class AnalysisCache:
+    """
+    On-disk cache of `AnalysisResult`s with a total size cap and LRU eviction.
+
+    Each entry is one small JSON file named after its key. Recency is tracked in
+    memory and mirrored to the file mtime, so the LRU order survives restarts.
+    Writes go through a temporary file and `os.replace`, so readers never see a
+    partial entry.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size in bytes, oldest first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        existing = []
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            existing.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[AnalysisResult]:
+        """Returns the cached result for the key, or None."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                result = AnalysisResult.model_validate_json(f.read())
+            os.utime(self._path(key))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            self._discard(key)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key: str, result: AnalysisResult) -> None:
+        """Stores a result and evicts the least recently used entries beyond the size cap."""
+        data = result.model_dump_json().encode()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        evicted = []
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._remove_file(old_key)
+
+    def _discard(self, key: str) -> None:
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+        self._remove_file(key)
+
+    def _remove_file(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> CacheStats:
+        """Returns a snapshot of the cache counters."""
+        with self._lock:
+            return CacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                bytes=self._total_bytes,
+                max_bytes=self.max_bytes,
+            )
@@ -0,0 +1,73 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from schemas import AnalysisJob, AnalysisResult
+
+FINISHED_STATUSES = ("done", "failed")
+
+
+class AnalysisJobStore:
+    """
+    In-memory registry of asynchronous analyses.
+
+    A job goes from `pending` to `partial` (tempo and key known) to `done`,
+    or to `failed` at any point. At most `max_jobs` jobs are kept; beyond
+    that the oldest finished jobs are forgotten. Unfinished jobs are bounded
+    by the worker pool's queue and are never dropped.
+    """
+
+    def __init__(self, max_jobs: int):
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, AnalysisJob]" = OrderedDict()  # oldest first
+        self._submitted_at: Dict[str, float] = {}
+
+    def create(self, name: str) -> AnalysisJob:
+        job = AnalysisJob(job_id=uuid.uuid4().hex, name=name, status="pending")
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._submitted_at[job.job_id] = time.perf_counter()
+            self._evict()
+        return job.model_copy()
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else job.model_copy()
+
+    def partial(self, job_id: str, result: AnalysisResult) -> None:
+        """Publishes the tempo and key of a job whose segmentation is still running."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status == "pending":
+                job.status, job.result, job.partial_seconds = "partial", result, self._elapsed(job_id)
+
+    def finish(self, job_id: str, result: AnalysisResult, cached: bool) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.status, job.result, job.cached = "done", result, cached
+                job.done_seconds = self._elapsed(job_id)
+                if job.partial_seconds is None:
+                    # Served from the cache: tempo and key arrived with everything else.
+                    job.partial_seconds = job.done_seconds
+
+    def fail(self, job_id: str, error: str) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.status, job.error, job.done_seconds = "failed", error, self._elapsed(job_id)
+
+    def _elapsed(self, job_id: str) -> float:
+        return time.perf_counter() - self._submitted_at[job_id]
+
+    def _evict(self) -> None:
+        excess = len(self._jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in [j for j, job in self._jobs.items() if job.status in FINISHED_STATUSES][:excess]:
+            del self._jobs[job_id]
+            del self._submitted_at[job_id]
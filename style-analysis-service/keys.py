@@ -0,0 +1,107 @@
+"""
+Krumhansl-Schmuckler key estimation, shared by the style-analysis and QA services.
+
+Each service is built from its own Docker context, so this file is kept as an
+identical copy in both (style-analysis-service/keys.py and n3ziZ84/keys.py);
+the style-analysis tests check that the copies match.
+
+The 24 key profiles (12 major, 12 minor rotations) are z-normalized once into
+a matrix, so the Pearson correlation of a chroma vector with every key is a
+single matrix product, and many chroma vectors (e.g. windows of a track) are
+scored in one product as well.
+"""
+from typing import List, NamedTuple
+
+import numpy as np
+
+NOTES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+KEY_LABELS = [note + ' Major' for note in NOTES] + [note + ' Minor' for note in NOTES]
+UNKNOWN_KEY = "N/A"
+
+# Krumhansl-Schmuckler probe-tone profiles, tonic first.
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+def _z_normalize(x: np.ndarray, axis: int) -> np.ndarray:
+    """Centres along `axis` and scales to unit norm; all-constant slices become zero."""
+    centred = x - x.mean(axis=axis, keepdims=True)
+    norm = np.linalg.norm(centred, axis=axis, keepdims=True)
+    return np.divide(centred, norm, out=np.zeros_like(centred, dtype=float), where=norm > 0)
+
+
+# (24, 12): row k is the profile of KEY_LABELS[k], rotated to its tonic and z-normalized.
+KEY_PROFILES = _z_normalize(
+    np.array([np.roll(MAJOR_PROFILE, i) for i in range(12)] + [np.roll(MINOR_PROFILE, i) for i in range(12)]),
+    axis=1,
+)
+
+
+class KeyEstimate(NamedTuple):
+    key: str
+    # Correlation of the chroma with the best key's profile, in [-1, 1].
+    correlation: float
+    # Margin of the best key over the runner-up, in [0, 1]; near 0 means ambiguous.
+    confidence: float
+
+
+def key_correlations(chroma: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation of chroma with all 24 key profiles.
+
+    `chroma` is a 12-vector, giving a (24,) result, or a (12, n) matrix of n
+    chroma vectors, giving (24, n).
+    """
+    return KEY_PROFILES @ _z_normalize(np.asarray(chroma, dtype=float), axis=0)
+
+
+def _estimates(correlations: np.ndarray) -> List[KeyEstimate]:
+    correlations = correlations.reshape(24, -1)
+    order = np.argsort(correlations, axis=0)
+    best, runner_up = order[-1], order[-2]
+    columns = np.arange(correlations.shape[1])
+    best_r = correlations[best, columns]
+    margins = np.clip(best_r - correlations[runner_up, columns], 0.0, 1.0)
+    return [
+        KeyEstimate(KEY_LABELS[k], float(r), float(m)) if r != 0.0 else KeyEstimate(UNKNOWN_KEY, 0.0, 0.0)
+        for k, r, m in zip(best, best_r, margins)
+    ]
+
+
+def estimate_key(chroma: np.ndarray) -> KeyEstimate:
+    """
+    Estimates the key of a chromagram (12, n_frames) or of a single aggregated
+    chroma vector (12,). Silence (no pitch-class variation) gives `UNKNOWN_KEY`.
+    """
+    chroma = np.asarray(chroma, dtype=float)
+    vector = chroma.sum(axis=1) if chroma.ndim == 2 else chroma
+    return _estimates(key_correlations(vector))[0]
+
+
+class KeySpan(NamedTuple):
+    start_frame: int
+    end_frame: int
+    estimate: KeyEstimate
+
+
+def track_keys(chroma: np.ndarray, window_frames: int, hop_frames: int) -> List[KeySpan]:
+    """
+    Windowed key tracking: estimates the key of every `window_frames`-long
+    window of a (12, n_frames) chromagram, advancing by `hop_frames`. All
+    windows are summed with one cumulative sum and scored with one matrix
+    product. The last window is shortened to end at the final frame.
+    """
+    if window_frames < 1 or hop_frames < 1:
+        raise ValueError("window_frames and hop_frames must be positive.")
+    n_frames = chroma.shape[1]
+    if n_frames == 0:
+        return []
+    starts = np.arange(0, max(n_frames - window_frames, 0) + 1, hop_frames)
+    if starts[-1] + window_frames < n_frames:
+        starts = np.append(starts, starts[-1] + hop_frames)
+    ends = np.minimum(starts + window_frames, n_frames)
+
+    cumulative = np.concatenate([np.zeros((12, 1)), np.cumsum(chroma, axis=1)], axis=1)
+    window_sums = cumulative[:, ends] - cumulative[:, starts]
+    estimates = _estimates(key_correlations(window_sums))
+    return [KeySpan(int(s), int(e), est) for s, e, est in zip(starts, ends, estimates)]
@@ -1,21 +1,82 @@
+import asyncio
+import hashlib
+import json
 import tempfile
-import shutil
 import os
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Optional, Set, Tuple
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import ValidationError
+from starlette.datastructures import UploadFile as StarletteUploadFile
 import logging
 
-from schemas import AnalysisResult
-from analyzer import analyze_audio
+from schemas import (
+    AnalysisJob, AnalysisResult, BatchAnalysisItem, BatchAnalysisRequest, CacheStats, PoolStats, ReadinessStatus,
+    SimilarityQuery, SimilarityResponse, SimilarTrack,
+)
+from analyzer import (
+    AudioSource, analyze_audio, analysis_params, check_window, ANALYSIS_PROFILES, ANALYZER_VERSION, DEFAULT_PROFILE,
+)
+from cache import AnalysisCache, cache_key
+from jobs import AnalysisJobStore
+from similarity import SimilarityIndex
+from worker_pool import AnalysisPool, PoolOverloaded
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Results are cached on disk keyed by the upload's SHA-256; an empty directory disables the cache.
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "style-analysis-cache"))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Style vectors of every analyzed file, for /similar; an empty path disables the index.
+ANALYSIS_INDEX_PATH = os.getenv("ANALYSIS_INDEX_PATH", os.path.join(tempfile.gettempdir(), "style-analysis-index.jsonl"))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Uploads up to this size are handed to the workers in memory; larger ones are spilled to a temporary file.
+ANALYSIS_SPILL_BYTES = int(os.getenv("ANALYSIS_SPILL_BYTES", str(32 * 1024 * 1024)))
+
+# Analyses run in worker processes; beyond the workers, at most ANALYSIS_MAX_QUEUE wait before requests get a 503.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+ANALYSIS_MAX_QUEUE = int(os.getenv("ANALYSIS_MAX_QUEUE", str(2 * ANALYSIS_WORKERS)))
+OVERLOAD_RETRY_AFTER_SECONDS = 5
+# Finished asynchronous analyses kept for polling; the oldest are forgotten beyond this.
+ANALYSIS_MAX_JOBS = int(os.getenv("ANALYSIS_MAX_JOBS", "1000"))
+# Batch requests may name files under this directory (the volume shared with the other services).
+STEMS_DIR = os.getenv("ANALYSIS_STEMS_DIR", "/stems")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# How long a batch item waits before retrying when the pool's queue is full.
+BATCH_RETRY_SECONDS = 0.5
+
+analysis_cache = AnalysisCache(ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_MAX_BYTES) if ANALYSIS_CACHE_DIR else None
+analysis_pool = AnalysisPool(ANALYSIS_WORKERS, ANALYSIS_MAX_QUEUE)
+similarity_index = SimilarityIndex(ANALYSIS_INDEX_PATH, ANALYZER_VERSION) if ANALYSIS_INDEX_PATH else None
+analysis_jobs = AnalysisJobStore(ANALYSIS_MAX_JOBS)
+# Running job tasks, referenced so they are not garbage collected mid-analysis.
+_job_tasks: Set[asyncio.Task] = set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts and warms up the analysis workers in the background, and stops them on shutdown.
+
+    The service accepts connections while the workers warm up, so `/ready` can
+    report progress; analyses submitted meanwhile wait for a warmed-up worker.
+    """
+    warm_up = asyncio.ensure_future(analysis_pool.start())
+    try:
+        yield
+    finally:
+        warm_up.cancel()
+        analysis_pool.shutdown()
+
+
 app = FastAPI(
     title="Style Analysis Service",
     description="Analyzes audio files to extract musical features like tempo, key, and structure.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -28,6 +89,21 @@ app.add_middleware(
 
 static_files_dir = os.path.dirname(os.path.abspath(__file__))
 
+@app.get("/ready", response_model=ReadinessStatus, tags=["Health"], responses={503: {"model": ReadinessStatus}})
+async def get_readiness(response: Response):
+    """
+    Answers 200 once the analysis workers are warmed up, and 503 (with
+    `Retry-After`) until then. A failed warm-up answers 503 with its `error`
+    and no `Retry-After`, since waiting will not make the service ready.
+    """
+    if not analysis_pool.ready:
+        response.status_code = 503
+        if analysis_pool.warm_up_error is None:
+            response.headers["Retry-After"] = str(OVERLOAD_RETRY_AFTER_SECONDS)
+    return ReadinessStatus(ready=analysis_pool.ready, warm_up_seconds=analysis_pool.warm_up_seconds,
+                           error=analysis_pool.warm_up_error)
+
+
 @app.get("/", include_in_schema=False)
 async def read_index():
     return FileResponse(os.path.join(static_files_dir, 'index.html'))
@@ -37,32 +113,371 @@ async def read_script():
     return FileResponse(os.path.join(static_files_dir, 'script.js'))
 
 
+def receive_upload(file: UploadFile) -> Tuple[str, AudioSource]:
+    """
+    Reads an upload, hashing it on the way, and returns its SHA-256 and the audio source.
+
+    The source is the upload's bytes, unless it is larger than
+    `ANALYSIS_SPILL_BYTES`; then it is the path of a temporary file that the
+    caller must remove. The hash is updated chunk by chunk while the upload is
+    read, so it costs no extra pass.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    spill = None
+    try:
+        while chunk := file.file.read(UPLOAD_CHUNK_BYTES):
+            digest.update(chunk)
+            if spill is None and len(buffer) + len(chunk) > ANALYSIS_SPILL_BYTES:
+                spill = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1])
+                spill.write(buffer)
+                buffer = bytearray()
+            if spill is None:
+                buffer += chunk
+            else:
+                spill.write(chunk)
+    except BaseException:
+        if spill is not None:
+            spill.close()
+            os.remove(spill.name)
+        raise
+    finally:
+        file.file.close()
+
+    if spill is None:
+        return digest.hexdigest(), bytes(buffer)
+    spill.close()
+    return digest.hexdigest(), spill.name
+
+
+def index_result(content_hash: str, name: str, result: AnalysisResult, replace: bool) -> None:
+    """Adds an analysis to the similarity index, unless the content is indexed already and `replace` is false."""
+    if similarity_index is None or (not replace and content_hash in similarity_index):
+        return
+    try:
+        similarity_index.add(content_hash, name, result)
+    except ValueError as e:
+        logger.warning(f"Not indexing {name}: {e}")
+
+
+async def analyze_cached(content_hash: str, source: AudioSource, profile: str, name: str,
+                         progress: Optional[Callable[[AnalysisResult], None]] = None,
+                         offset: float = 0.0, duration: Optional[float] = None) -> Tuple[AnalysisResult, bool]:
+    """
+    Returns the cached result for the content, or analyzes it in the worker
+    pool and caches it. Also reports whether it was a hit.
+
+    Either way a whole-file result is added to the similarity index; results
+    for a time window (`offset`, `duration`) are cached but not indexed. If
+    `progress` is given and the content is analyzed, it receives the partial
+    result with tempo and key before segmentation finishes.
+    """
+    key = cache_key(content_hash, analysis_params(profile, offset, duration), ANALYZER_VERSION)
+    whole_file = not offset and duration is None
+    if analysis_cache is not None:
+        # The cache reads and writes small files; keep that disk I/O off the event loop.
+        cached = await asyncio.to_thread(analysis_cache.get, key)
+        if cached is not None:
+            logger.info(f"Cache hit for {name}")
+            if whole_file:
+                await asyncio.to_thread(index_result, content_hash, name, cached, False)
+            return cached, True
+
+    logger.info(f"Analyzing {name} from {'memory' if isinstance(source, bytes) else source}")
+    if progress is None:
+        analysis_result = await analysis_pool.run(analyze_audio, source, profile, offset, duration)
+    else:
+        analysis_result = await analysis_pool.run_with_progress(analyze_audio, progress, source, profile, offset, duration)
+    logger.info(f"Analysis of {name} complete.")
+    if analysis_cache is not None:
+        await asyncio.to_thread(analysis_cache.put, key, analysis_result)
+    if whole_file:
+        # Indexing appends to the index file and sometimes rewrites it, so it runs off the event loop as well.
+        await asyncio.to_thread(index_result, content_hash, name, analysis_result, True)
+    return analysis_result, False
+
+
+def validate_analysis_form(file: UploadFile, profile: str, offset: float, duration: Optional[float]) -> None:
+    """Rejects uploads that are not audio, unknown profiles and empty time windows with a 400."""
+    if not file.content_type.startswith("audio/"):
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an audio file.")
+    if profile not in ANALYSIS_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Invalid profile. Expected one of: {', '.join(ANALYSIS_PROFILES)}.")
+    try:
+        check_window(offset, duration)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/analyze/", response_model=AnalysisResult, tags=["Analysis"])
-async def create_analysis(file: UploadFile = File(...)):
+async def create_analysis(response: Response, file: UploadFile = File(...), profile: str = Form(DEFAULT_PROFILE),
+                          offset: float = Form(0.0), duration: Optional[float] = Form(None)):
     """
     Accepts an audio file, analyzes it, and returns its musical features.
 
+    Results are cached by the SHA-256 of the uploaded bytes, so a file that was
+    analyzed before is answered without decoding it again. The `X-Cache`
+    response header tells whether the result was a `HIT` or a `MISS`.
+
     - **file**: The audio file (e.g., MP3, WAV, FLAC) to be analyzed.
+    - **profile**: `fast` (analyze at 22.05 kHz) or `accurate` (analyze at the file's native rate).
+    - **offset**, **duration**: Analyze only `duration` seconds starting `offset` seconds
+      into the file (by default, all of it). Segment times stay on the file's timeline.
     """
-    if not file.content_type.startswith("audio/"):
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload an audio file.")
+    validate_analysis_form(file, profile, offset, duration)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-        try:
-            logger.info(f"Receiving file: {file.filename}")
-            shutil.copyfileobj(file.file, tmp_file)
-            tmp_file_path = tmp_file.name
-        finally:
-            file.file.close()
+    logger.info(f"Receiving file: {file.filename}")
+    content_hash, source = await asyncio.to_thread(receive_upload, file)
 
     try:
-        logger.info(f"Analyzing file at {tmp_file_path}")
-        analysis_result = analyze_audio(tmp_file_path)
-        logger.info("Analysis complete.")
+        analysis_result, cached = await analyze_cached(content_hash, source, profile, file.filename,
+                                                       offset=offset, duration=duration)
+        response.headers["X-Cache"] = "HIT" if cached else "MISS"
         return analysis_result
+    except PoolOverloaded as e:
+        logger.warning(f"Rejecting analysis of {file.filename}: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="The analysis service is at capacity. Please retry later.",
+            headers={"Retry-After": str(OVERLOAD_RETRY_AFTER_SECONDS)},
+        )
     except Exception as e:
         logger.error(f"Error during analysis: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An error occurred during audio analysis: {str(e)}")
     finally:
-        os.remove(tmp_file_path)
-        logger.info(f"Cleaned up temporary file: {tmp_file_path}")
+        if isinstance(source, str):
+            os.remove(source)
+            logger.info(f"Cleaned up temporary file: {source}")
+
+
+async def _run_job(job_id: str, content_hash: str, source: AudioSource, profile: str, name: str,
+                   offset: float, duration: Optional[float]) -> None:
+    """Runs an asynchronous analysis and records its partial and final results on the job."""
+    try:
+        result, cached = await analyze_cached(
+            content_hash, source, profile, name, progress=lambda partial: analysis_jobs.partial(job_id, partial),
+            offset=offset, duration=duration,
+        )
+        analysis_jobs.finish(job_id, result, cached)
+    except PoolOverloaded:
+        analysis_jobs.fail(job_id, "The analysis service is at capacity. Please retry later.")
+    except Exception as e:
+        logger.error(f"Error during analysis job {job_id}: {e}", exc_info=True)
+        analysis_jobs.fail(job_id, f"An error occurred during audio analysis: {str(e)}")
+    finally:
+        if isinstance(source, str):
+            os.remove(source)
+
+
+@app.post("/analyze/jobs", response_model=AnalysisJob, status_code=202, tags=["Analysis"])
+async def create_analysis_job(response: Response, file: UploadFile = File(...), profile: str = Form(DEFAULT_PROFILE),
+                              offset: float = Form(0.0), duration: Optional[float] = Form(None)):
+    """
+    Starts analyzing an audio file and returns a job to poll at `GET /analyze/jobs/{job_id}`.
+
+    The job turns `partial` as soon as tempo and key are known, with the result
+    holding them and no segments yet, and `done` once segmentation has finished.
+    Callers that only need tempo and key can stop polling at `partial`.
+    The form fields are those of `POST /analyze/`.
+    """
+    validate_analysis_form(file, profile, offset, duration)
+    if analysis_pool.full:
+        raise HTTPException(
+            status_code=503,
+            detail="The analysis service is at capacity. Please retry later.",
+            headers={"Retry-After": str(OVERLOAD_RETRY_AFTER_SECONDS)},
+        )
+
+    content_hash, source = await asyncio.to_thread(receive_upload, file)
+    job = analysis_jobs.create(file.filename)
+    task = asyncio.ensure_future(_run_job(job.job_id, content_hash, source, profile, file.filename, offset, duration))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    logger.info(f"Started analysis job {job.job_id} for {file.filename}")
+    response.headers["Location"] = f"/analyze/jobs/{job.job_id}"
+    return job
+
+
+@app.get("/analyze/jobs/{job_id}", response_model=AnalysisJob, tags=["Analysis"])
+async def get_analysis_job(job_id: str):
+    """Returns the state of an asynchronous analysis, with its partial or final result."""
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired analysis job.")
+    return job
+
+
+@app.get("/analyze/cache/stats", response_model=CacheStats, tags=["Analysis"])
+async def get_cache_stats():
+    """Returns the hit/miss counters and size of the analysis result cache."""
+    if analysis_cache is None:
+        raise HTTPException(status_code=404, detail="The analysis cache is disabled.")
+    return analysis_cache.stats()
+
+
+@app.get("/analyze/pool/stats", response_model=PoolStats, tags=["Analysis"])
+async def get_pool_stats():
+    """Returns the queue depth of the analysis worker pool and the utilization of each worker."""
+    return analysis_pool.stats()
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resolve_stem_path(path: str) -> str:
+    """Resolves a batch path against the stems volume, refusing anything outside it."""
+    root = os.path.realpath(STEMS_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Path is outside {STEMS_DIR}.")
+    if not os.path.isfile(resolved):
+        raise ValueError("File not found.")
+    return resolved
+
+
+async def _analyze_batch_item(index: int, item, profile: str, slots: asyncio.Semaphore) -> BatchAnalysisItem:
+    """Analyzes one upload or stems path of a batch; failures are reported on the item instead of raised."""
+    is_upload = isinstance(item, StarletteUploadFile)
+    name = item.filename if is_upload else item
+    async with slots:
+        source = None
+        try:
+            if is_upload:
+                if not (item.content_type or "").startswith("audio/"):
+                    raise ValueError("Invalid file type. Please upload an audio file.")
+                content_hash, source = await asyncio.to_thread(receive_upload, item)
+            else:
+                source = resolve_stem_path(item)
+                content_hash = await asyncio.to_thread(hash_file, source)
+            while True:
+                try:
+                    result, cached = await analyze_cached(content_hash, source, profile, name)
+                    break
+                except PoolOverloaded:
+                    # Other requests filled the queue; a batch waits its turn instead of failing.
+                    await asyncio.sleep(BATCH_RETRY_SECONDS)
+            return BatchAnalysisItem(index=index, name=name, result=result, cached=cached)
+        except Exception as e:
+            logger.error(f"Error analyzing batch item {name}: {e}")
+            return BatchAnalysisItem(index=index, name=name, error=str(e))
+        finally:
+            # Uploads spilled to disk are temporary; stems paths are not ours to delete.
+            if is_upload and isinstance(source, str):
+                os.remove(source)
+
+
+async def _stream_batch(items: List, profile: str) -> AsyncIterator[bytes]:
+    """Yields one NDJSON line per item, in completion order."""
+    # One in-flight analysis per worker keeps every core busy without flooding the shared queue.
+    slots = asyncio.Semaphore(analysis_pool.workers)
+    tasks = [asyncio.ensure_future(_analyze_batch_item(i, item, profile, slots)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item = await next_done
+            yield item.model_dump_json().encode() + b"\n"
+    finally:
+        # Stop queued work if the client went away.
+        for task in tasks:
+            task.cancel()
+
+
+@app.post(
+    "/analyze/batch",
+    response_class=StreamingResponse,
+    tags=["Analysis"],
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {"schema": BatchAnalysisItem.model_json_schema()}}}},
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {"schema": {
+                    "type": "object",
+                    "properties": {
+                        "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                        "profile": {"type": "string", "enum": list(ANALYSIS_PROFILES)},
+                    },
+                }},
+                "application/json": {"schema": BatchAnalysisRequest.model_json_schema()},
+            },
+        }
+    },
+)
+async def create_batch_analysis(request: Request):
+    """
+    Analyzes many audio files in parallel across the worker pool.
+
+    - `multipart/form-data` with one or more `files` fields and an optional `profile`.
+    - `application/json` body `{"paths": [...], "profile": "fast"}` naming files on
+      the shared stems volume (relative to it, or absolute below it).
+
+    Results are streamed back as NDJSON, one `BatchAnalysisItem` per input line in
+    the order they complete; `index` refers to the input position. A file that
+    cannot be analyzed yields an item with `error` set instead of failing the batch.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # The whole body is read before streaming starts; reading it while responding deadlocks.
+        form = await request.form()
+        items: List = [f for f in form.getlist("files") + form.getlist("file") if isinstance(f, StarletteUploadFile)]
+        profile = form.get("profile") or DEFAULT_PROFILE
+    else:
+        try:
+            batch = BatchAnalysisRequest.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=json.loads(e.json()))
+        items, profile = batch.paths, batch.profile
+
+    if not items:
+        raise HTTPException(status_code=400, detail="The batch contains no files.")
+    if profile not in ANALYSIS_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Invalid profile. Expected one of: {', '.join(ANALYSIS_PROFILES)}.")
+
+    logger.info(f"Received a batch of {len(items)} files.")
+    return StreamingResponse(_stream_batch(items, profile), media_type=NDJSON_MEDIA_TYPE)
+
+
+def find_similar(query: SimilarityQuery) -> SimilarityResponse:
+    """Runs a similarity query against the index, translating bad queries into HTTP errors."""
+    if similarity_index is None:
+        raise HTTPException(status_code=404, detail="The similarity index is disabled.")
+    if (query.content_hash is None) == (query.style_vector is None):
+        raise HTTPException(status_code=400, detail="Give either a content_hash or a style_vector.")
+
+    vector = query.style_vector
+    if query.content_hash is not None:
+        indexed = similarity_index.get(query.content_hash)
+        if indexed is None:
+            raise HTTPException(status_code=404, detail="No analysis of this file is indexed.")
+        vector = indexed.style_vector
+    try:
+        neighbours = similarity_index.search(vector, query.k, exclude=query.content_hash, approximate=query.approximate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SimilarityResponse(
+        indexed=len(similarity_index),
+        matches=[SimilarTrack(**neighbour._asdict()) for neighbour in neighbours],
+    )
+
+
+@app.post("/similar", response_model=SimilarityResponse, tags=["Similarity"])
+async def query_similar(query: SimilarityQuery):
+    """
+    Finds the analyzed reference tracks most similar in style to a track.
+
+    The query names an indexed file by the SHA-256 of its bytes, or gives the
+    `style_vector` of any analysis. Every match carries its stored analysis,
+    so a caller can reuse it instead of uploading the file again.
+    """
+    return find_similar(query)
+
+
+@app.get("/similar/{content_hash}", response_model=SimilarityResponse, tags=["Similarity"])
+async def get_similar(content_hash: str, k: int = Query(5, ge=1, le=100), approximate: bool = False):
+    """Finds the reference tracks most similar to an indexed file, named by the SHA-256 of its bytes."""
+    return find_similar(SimilarityQuery(content_hash=content_hash, k=k, approximate=approximate))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Literal, Optional
 
 class Segment(BaseModel):
     """Defines the structure for a single musical segment."""
@@ -10,8 +10,104 @@ class Segment(BaseModel):
 class AnalysisResult(BaseModel):
     """Defines the structured output of the analysis service."""
     tempo: float = Field(..., description="Estimated tempo in beats per minute (BPM).", example=120.0)
-    key: str = Field(..., description="Estimated musical key of the track.", example="C Major")
+    key: str = Field(..., description="Estimated musical key of the track, or 'N/A' for silence.", example="C Major")
+    key_confidence: float = Field(
+        0.0,
+        description="Margin of the key over the runner-up key, in [0, 1]; near 0 means ambiguous.",
+        example=0.12
+    )
     segments: List[Segment] = Field(..., description="A list of structural segments found in the track.")
+    style_vector: Optional[List[float]] = Field(
+        None,
+        description="Compact style descriptor (chroma, tempo, timbre and structure) used by the similarity index."
+    )
 
     class Config:
         from_attributes = True
+
+class AnalysisJob(BaseModel):
+    """State of an asynchronous analysis."""
+    job_id: str = Field(..., description="Identifier to poll the job with.")
+    name: str = Field(..., description="Uploaded file name.")
+    status: Literal["pending", "partial", "done", "failed"] = Field(
+        ...,
+        description="'partial' means tempo and key are known and segmentation is still running."
+    )
+    result: Optional[AnalysisResult] = Field(
+        None,
+        description="Tempo and key once 'partial' (with no segments yet); the full analysis once 'done'."
+    )
+    cached: bool = Field(False, description="Whether the result came from the cache.")
+    error: Optional[str] = Field(None, description="Why the analysis failed.")
+    partial_seconds: Optional[float] = Field(None, description="Time from submission until tempo and key were known.")
+    done_seconds: Optional[float] = Field(None, description="Time from submission until the job finished.")
+
+class ReadinessStatus(BaseModel):
+    """Whether the service has finished warming up."""
+    ready: bool = Field(..., description="True once every analysis worker has run its warm-up analysis.")
+    warm_up_seconds: Optional[float] = Field(None, description="How long the warm-up took, once finished.")
+    error: Optional[str] = Field(None, description="Why the warm-up failed, if it did; the service then stays not ready.")
+
+class BatchAnalysisRequest(BaseModel):
+    """A batch of files on the shared stems volume to analyze."""
+    paths: List[str] = Field(
+        ...,
+        description="Paths relative to the stems volume, or absolute paths below it.",
+        example=["refs/track_01.wav", "refs/track_02.flac"]
+    )
+    profile: str = Field("fast", description="Analysis profile for every file: 'fast' or 'accurate'.")
+
+class BatchAnalysisItem(BaseModel):
+    """One line of a batch analysis response."""
+    index: int = Field(..., description="Position of the file in the request.")
+    name: str = Field(..., description="Uploaded file name or requested path.")
+    result: Optional[AnalysisResult] = Field(None, description="The analysis, unless it failed.")
+    cached: bool = Field(False, description="Whether the result came from the cache.")
+    error: Optional[str] = Field(None, description="Why the file could not be analyzed.")
+
+class CacheStats(BaseModel):
+    """Counters of the on-disk analysis result cache."""
+    hits: int = Field(..., description="Uploads answered from the cache.")
+    misses: int = Field(..., description="Uploads that had to be analyzed.")
+    entries: int = Field(..., description="Results currently stored.")
+    bytes: int = Field(..., description="Total size of the stored results.")
+    max_bytes: int = Field(..., description="Size cap; least recently used results are evicted beyond it.")
+
+class WorkerStats(BaseModel):
+    """Accounting for one analysis worker process."""
+    pid: int = Field(..., description="Process id of the worker.")
+    tasks: int = Field(..., description="Analyses completed by this worker.")
+    busy_seconds: float = Field(..., description="Total time spent analyzing.")
+    utilization: float = Field(..., description="Fraction of the pool's uptime this worker was busy.")
+
+class PoolStats(BaseModel):
+    """State of the analysis worker pool."""
+    workers: int = Field(..., description="Number of worker processes.")
+    max_queue: int = Field(..., description="Analyses allowed to wait for a free worker.")
+    running: int = Field(..., description="Analyses currently running.")
+    queued: int = Field(..., description="Analyses waiting for a free worker.")
+    rejected: int = Field(..., description="Requests refused with 503 because the queue was full.")
+    uptime_seconds: float = Field(..., description="Time since the pool was started.")
+    per_worker: List[WorkerStats] = Field(..., description="Per-worker accounting.")
+
+class SimilarityQuery(BaseModel):
+    """A nearest-reference query: an indexed track's content hash, or a style vector."""
+    content_hash: Optional[str] = Field(
+        None,
+        description="SHA-256 of an indexed file; the file itself is excluded from the matches."
+    )
+    style_vector: Optional[List[float]] = Field(None, description="A style vector from a previous analysis.")
+    k: int = Field(5, ge=1, le=100, description="Number of matches to return.")
+    approximate: bool = Field(False, description="Scan only the nearest clusters of a large index instead of every track.")
+
+class SimilarTrack(BaseModel):
+    """One match of a similarity query."""
+    content_hash: str = Field(..., description="SHA-256 of the matching file.")
+    name: str = Field(..., description="File name or stems path the match was analyzed from.")
+    distance: float = Field(..., description="Distance in the standardized style space; 0 is identical.")
+    result: AnalysisResult = Field(..., description="The stored analysis of the match, reusable as is.")
+
+class SimilarityResponse(BaseModel):
+    """Matches of a similarity query, nearest first."""
+    indexed: int = Field(..., description="Number of tracks in the index.")
+    matches: List[SimilarTrack] = Field(..., description="The nearest indexed tracks.")
@@ -0,0 +1,251 @@
+"""
+Reference-track similarity index.
+
+Every analysis also produces a compact style vector (see `style_vector`):
+the mean chroma profile, the tempo, timbre statistics (spectral centroid and
+MFCCs) and a summary of the segment structure. `SimilarityIndex` keeps these
+vectors, with the analysis they came from, in a flat NumPy matrix so the
+nearest references to a track are found with one matrix-vector product.
+
+The index is persisted as an append-only JSON-lines log: adding a track
+appends one line, and the matrix is rebuilt from the log on startup. A later
+line for the same content replaces the earlier one; the log is compacted when
+replaced lines outnumber live ones.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from scipy.cluster.vq import kmeans2
+
+from schemas import AnalysisResult, Segment
+
+logger = logging.getLogger(__name__)
+
+# Number of MFCCs kept for timbre; the 0th (overall loudness) is dropped.
+N_MFCC = 12
+# Column ranges of the feature groups in a style vector.
+VECTOR_GROUPS = {
+    "chroma": slice(0, 12),
+    "tempo": slice(12, 13),
+    "timbre": slice(13, 13 + 2 * (1 + N_MFCC)),
+    "structure": slice(13 + 2 * (1 + N_MFCC), 16 + 2 * (1 + N_MFCC)),
+}
+VECTOR_SIZE = VECTOR_GROUPS["structure"].stop
+
+# Approximate search clusters the index into ~sqrt(n) lists and scans the lists nearest to the query.
+APPROXIMATE_MIN_ENTRIES = 1024
+APPROXIMATE_PROBES = 4
+# The lists are rebuilt once the index has grown by this factor since they were built.
+APPROXIMATE_REBUILD_GROWTH = 1.25
+
+
+def style_vector(chroma_mean: np.ndarray, tempo: float, timbre_mean: np.ndarray, timbre_std: np.ndarray,
+                 segments: Sequence[Segment], duration: float) -> List[float]:
+    """
+    Builds the style vector of a track.
+
+    `timbre_mean` and `timbre_std` are the per-frame statistics of the
+    spectral centroid (as a fraction of the Nyquist rate) followed by MFCCs
+    1 to `N_MFCC`. The tempo is stored as log2(BPM), so a tempo that is off
+    by a factor of two is always the same distance away. The structure is
+    summarized by the segments per minute, the variation of the segment
+    lengths and the share of the track taken by the longest segment.
+    """
+    chroma_mean = np.asarray(chroma_mean, dtype=float)
+    total = chroma_mean.sum()
+    chroma = chroma_mean / total if total > 0 else np.zeros(12)
+
+    lengths = np.array([s.end_time - s.start_time for s in segments]) if segments else np.array([max(duration, 0.0)])
+    structure = [
+        len(segments) / max(duration / 60.0, 1e-9),
+        float(lengths.std() / lengths.mean()) if lengths.mean() > 0 else 0.0,
+        float(lengths.max() / max(duration, 1e-9)),
+    ]
+    vector = np.concatenate([chroma, [np.log2(max(tempo, 1.0))], timbre_mean, timbre_std, structure])
+    return [float(v) for v in vector]
+
+
+class Neighbour(NamedTuple):
+    content_hash: str
+    name: str
+    distance: float
+    result: AnalysisResult
+
+
+class SimilarityIndex:
+    """
+    Nearest-neighbour index over style vectors, keyed by content hash.
+
+    Each dimension is standardized over the indexed tracks and weighted so
+    that every feature group counts the same (the twelve chroma bins together
+    weigh as much as the tempo), and neighbours are ranked by Euclidean
+    distance in that space. `search(..., approximate=True)` scans only the
+    inverted lists nearest to the query once the index holds at least
+    `APPROXIMATE_MIN_ENTRIES` tracks; below that, or without it, the search
+    is exact.
+
+    Entries are tagged with the analyzer version; entries of other versions
+    are ignored when the log is loaded, since their vectors may differ.
+    """
+
+    def __init__(self, path: str, version: str):
+        self.path = path
+        self.version = version
+        self._lock = threading.Lock()
+        self._positions: Dict[str, int] = {}
+        self._hashes: List[str] = []
+        self._names: List[str] = []
+        self._results: List[AnalysisResult] = []
+        self._rows: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None  # scaled vectors, rebuilt lazily
+        self._norms: Optional[np.ndarray] = None  # their squared lengths
+        self._scale: Optional[np.ndarray] = None
+        self._mean: Optional[np.ndarray] = None
+        self._lists = None  # (centroids, row indices of each list, index size when built)
+        self._log_lines = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                self._log_lines += 1
+                try:
+                    record = json.loads(line)
+                    if record.get("version") != self.version:
+                        continue
+                    self._insert(record["content_hash"], record["name"], AnalysisResult.model_validate(record["result"]))
+                except (ValueError, KeyError) as e:
+                    # A partly written last line after a crash, or a malformed entry.
+                    logger.warning(f"Skipping unreadable similarity index entry: {e}")
+        logger.info(f"Loaded {len(self._names)} tracks into the similarity index.")
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, content_hash: str) -> bool:
+        return content_hash in self._positions
+
+    def _insert(self, content_hash: str, name: str, result: AnalysisResult) -> None:
+        if result.style_vector is None:
+            raise ValueError("The analysis has no style vector.")
+        row = np.asarray(result.style_vector, dtype=np.float64)
+        if row.shape != (VECTOR_SIZE,):
+            raise ValueError(f"Style vector has {row.size} values, expected {VECTOR_SIZE}.")
+        position = self._positions.get(content_hash)
+        if position is None:
+            self._positions[content_hash] = len(self._names)
+            self._hashes.append(content_hash)
+            self._names.append(name)
+            self._results.append(result)
+            self._rows.append(row)
+        else:
+            self._names[position], self._results[position], self._rows[position] = name, result, row
+        self._matrix = None
+
+    def add(self, content_hash: str, name: str, result: AnalysisResult) -> None:
+        """Adds (or replaces) a track and appends it to the log."""
+        with self._lock:
+            self._insert(content_hash, name, result)
+            record = self._record(content_hash, name, result)
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(record + "\n")
+                self._log_lines += 1
+                if self._log_lines > 2 * len(self._names) + 16:
+                    self._compact()
+            except OSError as e:
+                logger.warning(f"Could not persist similarity index entry {content_hash}: {e}")
+
+    def _record(self, content_hash: str, name: str, result: AnalysisResult) -> str:
+        return json.dumps({"version": self.version, "content_hash": content_hash, "name": name,
+                           "result": result.model_dump(mode="json")})
+
+    def _compact(self) -> None:
+        """Rewrites the log with one line per live entry, atomically."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for content_hash, name, result in zip(self._hashes, self._names, self._results):
+                    f.write(self._record(content_hash, name, result) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._log_lines = len(self._names)
+
+    def get(self, content_hash: str) -> Optional[AnalysisResult]:
+        """The stored analysis of a track, or None if it is not indexed."""
+        with self._lock:
+            position = self._positions.get(content_hash)
+            return None if position is None else self._results[position]
+
+    def _scaled_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            raw = np.vstack(self._rows)
+            std = raw.std(axis=0)
+            scale = np.divide(1.0, std, out=np.zeros_like(std), where=std > 1e-12)
+            for group in VECTOR_GROUPS.values():
+                scale[group] /= np.sqrt(group.stop - group.start)
+            self._mean, self._scale = raw.mean(axis=0), scale
+            self._matrix = ((raw - self._mean) * self._scale).astype(np.float32)
+            self._norms = (self._matrix ** 2).sum(axis=1)
+        return self._matrix
+
+    def _candidates(self, matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """
+        Rows in the inverted lists nearest to the query, plus every row added
+        since the lists were built. The lists are not rebuilt on every add, so
+        their centroids may lag slightly behind the current standardization.
+        """
+        n = len(matrix)
+        if self._lists is None or n >= self._lists[-1] * APPROXIMATE_REBUILD_GROWTH:
+            n_lists = int(np.sqrt(n))
+            centroids, labels = kmeans2(matrix, n_lists, minit="++", seed=0)
+            members = [np.flatnonzero(labels == i) for i in range(n_lists)]
+            self._lists = (centroids, members, n)
+        centroids, members, built_size = self._lists
+        nearest = np.argsort(((centroids - query) ** 2).sum(axis=1))[:APPROXIMATE_PROBES]
+        return np.concatenate([members[i] for i in nearest] + [np.arange(built_size, n)])
+
+    def search(self, vector: Sequence[float], k: int = 5, exclude: Optional[str] = None,
+               approximate: bool = False) -> List[Neighbour]:
+        """Returns up to `k` indexed tracks closest to the style vector, nearest first."""
+        query = np.asarray(vector, dtype=np.float64)
+        if query.shape != (VECTOR_SIZE,):
+            raise ValueError(f"Style vector has {query.size} values, expected {VECTOR_SIZE}.")
+        with self._lock:
+            if not self._names:
+                return []
+            matrix = self._scaled_matrix()
+            scaled = ((query - self._mean) * self._scale).astype(np.float32)
+            if approximate and len(matrix) >= APPROXIMATE_MIN_ENTRIES:
+                rows = self._candidates(matrix, scaled)
+                candidates, norms = matrix[rows], self._norms[rows]
+            else:
+                rows, candidates, norms = np.arange(len(matrix)), matrix, self._norms
+            # |m - q|^2 = |m|^2 - 2 m.q + |q|^2: one matrix-vector product instead of an (n, d) difference.
+            squared = norms - 2.0 * (candidates @ scaled) + scaled @ scaled
+            distances = np.sqrt(np.maximum(squared, 0.0))
+
+            excluded = self._positions.get(exclude) if exclude is not None else None
+            nearest = min(k + 1, len(distances))
+            order = np.argpartition(distances, nearest - 1)[:nearest]
+            neighbours = []
+            for i in order[np.argsort(distances[order])]:
+                position = int(rows[i])
+                if position == excluded:
+                    continue
+                neighbours.append(Neighbour(self._hashes[position], self._names[position],
+                                            float(distances[i]), self._results[position]))
+            return neighbours[:k]
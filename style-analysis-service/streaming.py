@@ -0,0 +1,302 @@
+"""
+Block-streaming analysis for long tracks.
+
+`analyze_audio` decodes the whole file and keeps the signal, its CQT and the
+segmentation features in memory, all growing with the track length. For long
+inputs (hour-long DJ mixes) this module reads the file in fixed-size blocks
+instead, resamples each block with a streaming resampler and folds it into
+running statistics:
+
+- the onset strength envelope (one float per frame), for tempo and beats;
+- the sum of the per-frame CQT chroma vectors, for the key and the style vector;
+- the sums and squared sums of the per-frame timbre (spectral centroid and
+  MFCCs), for the style vector;
+- STFT chroma plus spectral centroid pooled over groups of frames, for
+  segmentation (reduced to one column per beat before clustering).
+
+The key and style-vector chroma come from the same constant-Q transform as in
+`analyzer.FeatureContext`, so long and short tracks are comparable in the
+similarity index. The CQT is computed over a run of frames at a time, padded
+with `CQT_MARGIN_SECONDS` of signal on each side (longer than the lowest
+filter), which matches the CQT of the whole signal to within float rounding.
+The tuning is estimated once, from the first run, rather than from the whole
+track. Segmentation keeps the cheaper STFT chroma, which is computed in step
+with the other frame features and found section boundaries at least as well
+on the benchmark suite.
+
+The pooled features are capped at `MAX_POOLED_FRAMES` columns: whenever the cap
+is hit, neighbouring columns are averaged pairwise and the pool size doubles.
+Apart from the onset envelope (about 170 KB per hour at 22.05 kHz), memory use
+therefore does not depend on the length of the track.
+"""
+import io
+import logging
+from typing import List, Optional
+
+import librosa
+import numpy as np
+import soundfile as sf
+import soxr
+
+from analyzer import (
+    AudioSource, COARSE_FRAME_SECONDS, CQT_BINS_PER_OCTAVE, CQT_N_BINS, ProgressCallback, adaptive_num_segments,
+    cluster_boundaries, segments_from_boundaries,
+)
+from keys import estimate_key
+from schemas import AnalysisResult
+from similarity import N_MFCC, style_vector
+
+logger = logging.getLogger(__name__)
+
+# Decoded block length; at most a few MB of samples and spectrogram in flight at once.
+BLOCK_SECONDS = 10.0
+# Signal on either side of a run of CQT frames; the lowest CQT filter spans about 1.6 s.
+CQT_MARGIN_SECONDS = 2.0
+# Length of a run of CQT frames. librosa rebuilds the CQT filters on every call, so runs span several blocks.
+CQT_RUN_SECONDS = 30.0
+# Cap on the number of pooled feature columns kept for segmentation.
+MAX_POOLED_FRAMES = 16384
+N_MELS = 128
+# Onset frames per tempogram chunk (~48 s at 22.05 kHz and a 512-sample hop).
+TEMPOGRAM_CHUNK_FRAMES = 2048
+
+
+def fft_size(sr: int) -> int:
+    """Window length covering ~93 ms at any rate (2048 samples at 22.05 kHz), as a power of two."""
+    return int(2 ** np.ceil(np.log2(sr * 2048 / 22050)))
+
+
+class StreamingFeatures:
+    """
+    Accumulates the analysis features of a signal fed to it block by block.
+
+    Frames are laid out exactly as librosa's centred STFT lays them out: frame
+    `i` is centred on sample `i * hop_length` of the signal, whose start is
+    padded with half a window of zeros. Samples that do not fill a whole frame
+    yet are carried over to the next block. CQT chroma needs
+    `CQT_MARGIN_SECONDS` of signal after a frame, so it lags behind the STFT
+    features and is only complete after `finish`.
+    """
+
+    def __init__(self, sr: int, hop_length: int, max_pooled_frames: int = MAX_POOLED_FRAMES):
+        self.sr = sr
+        self.hop_length = hop_length
+        self.n_fft = fft_size(sr)
+        self.max_pooled_frames = max_pooled_frames
+        self.n_samples = 0
+        self.n_frames = 0
+
+        self._window = librosa.filters.get_window("hann", self.n_fft, fftbins=True).astype(np.float32)
+        self._mel_basis = librosa.filters.mel(sr=sr, n_fft=self.n_fft, n_mels=N_MELS)
+        self._chroma_basis = librosa.filters.chroma(sr=sr, n_fft=self.n_fft)
+        self._freqs = librosa.fft_frequencies(sr=sr, n_fft=self.n_fft)
+        self._carry = np.zeros(self.n_fft // 2, dtype=np.float32)
+        self._previous_mel_db: Optional[np.ndarray] = None
+
+        # CQT input: the signal from sample `_cqt_start` on, a multiple of the hop so frames stay aligned.
+        self._cqt_margin = int(np.ceil(CQT_MARGIN_SECONDS * sr / hop_length)) * hop_length
+        self._cqt_run_frames = max(1, int(CQT_RUN_SECONDS * sr) // hop_length)
+        self._cqt_signal = np.zeros(0, dtype=np.float32)
+        self._cqt_start = 0
+        self._tuning: Optional[float] = None
+        self.n_chroma_frames = 0
+
+        self._onset_blocks: List[np.ndarray] = []
+        self.chroma_sum = np.zeros(12)
+        self.timbre_sum = np.zeros(1 + N_MFCC)
+        self.timbre_sq_sum = np.zeros(1 + N_MFCC)
+        # Segmentation features: completed pooled columns, plus the running sum of the open pool.
+        self.pool_size = 1
+        self._pooled: List[np.ndarray] = []
+        self._pool_sum = np.zeros(13)
+        self._pool_count = 0
+
+    def update(self, samples: np.ndarray) -> None:
+        """Adds the next block of mono samples."""
+        samples = samples.astype(np.float32, copy=False)
+        self.n_samples += len(samples)
+        self._process(np.concatenate([self._carry, samples]))
+        self._cqt_signal = np.concatenate([self._cqt_signal, samples])
+        # Frames whose right margin has been received; computed in runs of `CQT_RUN_SECONDS`.
+        ready = (self.n_samples - self._cqt_margin) // self.hop_length + 1 if self.n_samples >= self._cqt_margin else 0
+        if ready - self.n_chroma_frames >= self._cqt_run_frames:
+            self._process_chroma(ready)
+
+    def finish(self) -> None:
+        """Flushes the last frames, padding the end of the signal with half a window of zeros."""
+        self._process(np.concatenate([self._carry, np.zeros(self.n_fft // 2, dtype=np.float32)]))
+        if self.n_frames > self.n_chroma_frames:
+            self._process_chroma(self.n_frames)
+        if self._pool_count:
+            self._pooled.append(self._pool_sum / self._pool_count)
+            self._pool_sum = np.zeros(13)
+            self._pool_count = 0
+
+    def _process(self, buffer: np.ndarray) -> None:
+        n_frames = 1 + (len(buffer) - self.n_fft) // self.hop_length if len(buffer) >= self.n_fft else 0
+        # Stop at the last frame that starts within the real signal.
+        n_frames = min(n_frames, max(0, 1 + self.n_samples // self.hop_length - self.n_frames))
+        if n_frames == 0:
+            self._carry = buffer
+            return
+
+        frames = librosa.util.frame(buffer[:(n_frames - 1) * self.hop_length + self.n_fft],
+                                    frame_length=self.n_fft, hop_length=self.hop_length)
+        magnitude = np.abs(np.fft.rfft(frames * self._window[:, None], axis=0))
+        power = magnitude ** 2
+        self._carry = buffer[n_frames * self.hop_length:]
+        self.n_frames += n_frames
+
+        # Onset strength: mean positive change of the log-mel spectrum from the previous frame.
+        mel_db = librosa.power_to_db(self._mel_basis @ power, top_db=None)
+        previous = mel_db[:, :1] if self._previous_mel_db is None else self._previous_mel_db
+        onset = np.maximum(0.0, np.diff(np.hstack([previous, mel_db]), axis=1)).mean(axis=0)
+        self._onset_blocks.append(onset.astype(np.float32))
+        self._previous_mel_db = mel_db[:, -1:]
+
+        chroma = librosa.util.normalize(self._chroma_basis @ power, norm=np.inf, axis=0)
+        # Chroma is in [0, 1]; scale the centroid (Hz) to the same range so it cannot dominate.
+        centroid = (self._freqs @ magnitude) / np.maximum(magnitude.sum(axis=0), 1e-10) / (self.sr / 2.0)
+        self._pool(np.vstack([chroma, centroid]))
+
+        timbre = np.vstack([centroid, librosa.feature.mfcc(S=mel_db, n_mfcc=N_MFCC + 1)[1:]])
+        self.timbre_sum += timbre.sum(axis=1)
+        self.timbre_sq_sum += (timbre ** 2).sum(axis=1)
+
+    def _process_chroma(self, end_frame: int) -> None:
+        """CQT chroma of frames `n_chroma_frames` to `end_frame`, from the signal around them."""
+        first, hop = self.n_chroma_frames, self.hop_length
+        start = max(0, first * hop - self._cqt_margin)
+        stop = min(self.n_samples, (end_frame - 1) * hop + self._cqt_margin + 1)
+        signal = self._cqt_signal[start - self._cqt_start:stop - self._cqt_start]
+        if self._tuning is None:
+            self._tuning = float(librosa.estimate_tuning(y=signal, sr=self.sr, bins_per_octave=CQT_BINS_PER_OCTAVE))
+        cqt = np.abs(librosa.cqt(
+            y=signal, sr=self.sr, hop_length=hop,
+            n_bins=CQT_N_BINS, bins_per_octave=CQT_BINS_PER_OCTAVE, tuning=self._tuning,
+        ))
+        chroma = librosa.feature.chroma_cqt(C=cqt, sr=self.sr, hop_length=hop, bins_per_octave=CQT_BINS_PER_OCTAVE)
+        chroma = chroma[:, first - start // hop:end_frame - start // hop]
+        self.chroma_sum += chroma.sum(axis=1)
+        self.n_chroma_frames = end_frame
+        # Keep only the left margin of the next run.
+        keep_from = max(0, end_frame * hop - self._cqt_margin)
+        self._cqt_signal = self._cqt_signal[keep_from - self._cqt_start:]
+        self._cqt_start = keep_from
+
+    def _pool(self, features: np.ndarray) -> None:
+        for column in features.T:
+            self._pool_sum += column
+            self._pool_count += 1
+            if self._pool_count == self.pool_size:
+                self._pooled.append(self._pool_sum / self._pool_count)
+                self._pool_sum = np.zeros(13)
+                self._pool_count = 0
+                if len(self._pooled) >= self.max_pooled_frames:
+                    # Halve the resolution to stay within the cap.
+                    self._pooled = [(a + b) / 2.0 for a, b in zip(self._pooled[0::2], self._pooled[1::2])]
+                    self.pool_size *= 2
+
+    @property
+    def duration(self) -> float:
+        return self.n_samples / self.sr
+
+    @property
+    def timbre_mean(self) -> np.ndarray:
+        return self.timbre_sum / max(self.n_frames, 1)
+
+    @property
+    def timbre_std(self) -> np.ndarray:
+        return np.sqrt(np.maximum(self.timbre_sq_sum / max(self.n_frames, 1) - self.timbre_mean ** 2, 0.0))
+
+    @property
+    def onset_envelope(self) -> np.ndarray:
+        return np.concatenate(self._onset_blocks) if self._onset_blocks else np.zeros(0, dtype=np.float32)
+
+    @property
+    def pooled_features(self) -> np.ndarray:
+        """Segmentation features, one column per `pool_size` frames."""
+        return np.array(self._pooled).T if self._pooled else np.zeros((13, 0))
+
+
+def stream_features(source: AudioSource, sr: Optional[int], hop_length: int, res_type: Optional[str] = None,
+                    offset: float = 0.0, duration: Optional[float] = None) -> StreamingFeatures:
+    """
+    Decodes a file (or encoded bytes) block by block, downmixed to mono and,
+    when `sr` is given, resampled to it, and returns the accumulated features.
+    Only `duration` seconds from `offset` are decoded; the reader seeks to the offset.
+    """
+    with sf.SoundFile(io.BytesIO(source) if isinstance(source, bytes) else source) as f:
+        native_sr = f.samplerate
+        f.seek(min(int(round(offset * native_sr)), f.frames))
+        frames = -1 if duration is None else int(round(duration * native_sr))
+        target_sr = sr or native_sr
+        quality = "VHQ" if res_type == "soxr_vhq" else "HQ"
+        resampler = None
+        if target_sr != native_sr:
+            resampler = soxr.ResampleStream(native_sr, target_sr, 1, dtype="float32", quality=quality)
+        features = StreamingFeatures(target_sr, hop_length)
+
+        for block in f.blocks(blocksize=int(BLOCK_SECONDS * native_sr), frames=frames, dtype="float32", always_2d=True):
+            mono = block.mean(axis=1)
+            features.update(resampler.resample_chunk(mono) if resampler else mono)
+        if resampler:
+            features.update(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+
+    features.finish()
+    return features
+
+
+def estimate_tempo(onset_envelope: np.ndarray, sr: int, hop_length: int) -> float:
+    """
+    Global tempo from the mean tempogram, computed a chunk at a time.
+
+    `librosa.beat.beat_track` builds the full tempogram (hundreds of lags per
+    frame), which dominates peak memory on long tracks; averaging it chunk by
+    chunk gives the same estimate within bounded memory.
+    """
+    total = None
+    for start in range(0, len(onset_envelope), TEMPOGRAM_CHUNK_FRAMES):
+        chunk = librosa.feature.tempogram(
+            onset_envelope=onset_envelope[start:start + TEMPOGRAM_CHUNK_FRAMES], sr=sr, hop_length=hop_length
+        ).sum(axis=1, keepdims=True)
+        total = chunk if total is None else total + chunk
+    mean_tempogram = total / len(onset_envelope)
+    return float(librosa.feature.tempo(tg=mean_tempogram, sr=sr, hop_length=hop_length, aggregate=None)[0])
+
+
+def analyze_stream(source: AudioSource, sr: Optional[int], hop_length: int, res_type: Optional[str] = None,
+                   num_segments: Optional[int] = None, progress: Optional[ProgressCallback] = None,
+                   offset: float = 0.0, duration: Optional[float] = None) -> AnalysisResult:
+    """Streaming counterpart of `analyzer.analyze_audio`; see the module docstring."""
+    features = stream_features(source, sr, hop_length, res_type, offset, duration)
+    if features.n_samples == 0 or features.n_frames == 0:
+        raise IOError("Could not load audio file: no audio frames decoded.")
+
+    onset_envelope = features.onset_envelope
+    tempo = estimate_tempo(onset_envelope, features.sr, hop_length)
+    key = estimate_key(features.chroma_sum)
+    if progress is not None:
+        progress(AnalysisResult(tempo=tempo, key=key.key, key_confidence=key.confidence, segments=[]))
+    _, beats = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=features.sr, hop_length=hop_length, bpm=tempo)
+
+    num_segments = num_segments or adaptive_num_segments(features.duration)
+    try:
+        # Beats closer together than the pooled grid collapse onto the same column.
+        coarse_columns = int(round(COARSE_FRAME_SECONDS * features.sr / hop_length)) // features.pool_size
+        boundaries = cluster_boundaries(features.pooled_features, np.asarray(beats) // features.pool_size,
+                                        num_segments, coarse_columns)
+        boundary_times = librosa.frames_to_time(boundaries * features.pool_size, sr=features.sr, hop_length=hop_length)
+    except Exception as e:
+        logger.warning(f"Agglomerative segmentation failed: {e}. Falling back to fixed splitting.")
+        boundary_times = np.linspace(0, features.duration, num_segments + 1)
+
+    segments = segments_from_boundaries(boundary_times, features.duration, offset)
+    return AnalysisResult(
+        tempo=tempo,
+        key=key.key,
+        key_confidence=key.confidence,
+        segments=segments,
+        style_vector=style_vector(features.chroma_sum / features.n_frames, tempo, features.timbre_mean,
+                                  features.timbre_std, segments, features.duration),
+    )
@@ -4,6 +4,11 @@ import soundfile as sf
 import tempfile
 import os
 
+# Keep the tests away from the shared result cache and similarity index, and the worker pool small.
+os.environ.setdefault("ANALYSIS_CACHE_DIR", tempfile.mkdtemp(prefix="style-analysis-cache-"))
+os.environ.setdefault("ANALYSIS_INDEX_PATH", os.path.join(tempfile.mkdtemp(prefix="style-analysis-index-"), "index.jsonl"))
+os.environ.setdefault("ANALYSIS_WORKERS", "2")
+
 @pytest.fixture(scope="module")
 def dummy_audio_file():
     """Creates a temporary dummy WAV file for testing."""
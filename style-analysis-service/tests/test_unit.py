@@ -1,8 +1,27 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
 import pytest
+import numpy as np
+import librosa
+import soundfile as sf
 from fastapi.testclient import TestClient
 from main import app
-from analyzer import analyze_audio
-from schemas import AnalysisResult
+from analyzer import analyze_audio, analysis_params, adaptive_num_segments, cluster_boundaries, FeatureContext, segment_audio
+from schemas import AnalysisResult, Segment
+from cache import AnalysisCache, cache_key
+from worker_pool import AnalysisPool, PoolOverloaded
+import worker_pool
+from similarity import SimilarityIndex, VECTOR_SIZE
+import similarity
+import streaming
+from streaming import StreamingFeatures, analyze_stream
+import analyzer
+import keys
+import main
 
 client = TestClient(app)
 
@@ -36,3 +55,392 @@ def test_api_upload_invalid_file_type():
     response = client.post("/analyze/", files={"file": ("test.txt", b"some text", "text/plain")})
     assert response.status_code == 400
     assert "Invalid file type" in response.json()["detail"]
+
+def test_feature_context_memoizes_shared_features(dummy_audio_file):
+    """Test that shared intermediates are computed once and match librosa's own chroma."""
+    y, sr = librosa.load(dummy_audio_file, sr=None, mono=True)
+    features = FeatureContext(y, sr)
+
+    assert features.chroma is features.chroma
+    assert features.cqt is features.cqt
+    np.testing.assert_allclose(features.chroma, librosa.feature.chroma_cqt(y=y, sr=sr), atol=1e-5)
+
+    segments = segment_audio(y, sr, features=features)
+    assert len(segments) > 0
+    assert all(0.0 <= s.start_time < s.end_time <= features.duration + 1e-6 for s in segments)
+
+def test_api_upload_served_from_cache(dummy_audio_file):
+    """Test that re-uploading identical bytes returns the cached result."""
+    with open(dummy_audio_file, "rb") as f:
+        audio = f.read()
+    first = client.post("/analyze/", files={"file": ("a.wav", audio, "audio/wav")})
+    second = client.post("/analyze/", files={"file": ("renamed.wav", audio, "audio/wav")})
+
+    assert first.status_code == second.status_code == 200
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.json() == first.json()
+    assert client.get("/analyze/cache/stats").json()["hits"] >= 1
+
+def test_analysis_cache_evicts_least_recently_used(tmp_path):
+    """Test the key derivation and LRU eviction under the size cap."""
+    assert cache_key("abc", {"sr": None}, "1") != cache_key("abc", {"sr": 22050}, "1")
+    assert cache_key("abc", {"sr": None}, "1") != cache_key("abc", {"sr": None}, "2")
+
+    result = AnalysisResult(tempo=120.0, key="C Major", segments=[Segment(start_time=0.0, end_time=1.0, label="Part A")])
+    entry_size = len(result.model_dump_json())
+    cache = AnalysisCache(str(tmp_path), max_bytes=2 * entry_size)
+    cache.put("a", result)
+    cache.put("b", result)
+    assert cache.get("a") == result  # "a" becomes the most recently used entry
+    cache.put("c", result)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == result and cache.get("c") == result
+    assert not (tmp_path / "b.json").exists()
+
+    # A new instance picks up the surviving entries from disk.
+    assert AnalysisCache(str(tmp_path), max_bytes=2 * entry_size).stats().entries == 2
+
+def test_analysis_pool_rejects_when_queue_is_full():
+    """Test that work beyond the workers plus the queue is refused, and that busy time is accounted per worker."""
+    pool = AnalysisPool(workers=1, max_queue=1)
+
+    async def scenario():
+        await pool.start()
+        tasks = [asyncio.ensure_future(pool.run(time.sleep, 0.2)) for _ in range(3)]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        outcomes = asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+
+    assert sum(isinstance(o, PoolOverloaded) for o in outcomes) == 1
+    stats = pool.stats()
+    assert stats.rejected == 1
+    assert len(stats.per_worker) == 1
+    assert stats.per_worker[0].tasks == 2
+    assert stats.per_worker[0].busy_seconds >= 0.4
+    assert 0 < stats.per_worker[0].utilization <= 1
+
+def test_api_pool_stats():
+    """Test the /analyze/pool/stats endpoint."""
+    response = client.get("/analyze/pool/stats")
+    assert response.status_code == 200
+    assert response.json()["workers"] >= 1
+
+def test_analysis_profiles(dummy_audio_file):
+    """Test that both profiles analyze the file and that they are cached under different keys."""
+    fast = analyze_audio(dummy_audio_file, profile="fast")
+    accurate = analyze_audio(dummy_audio_file, profile="accurate")
+    assert fast.key == accurate.key
+    assert analysis_params("fast")["sr"] == 22050 and analysis_params("accurate")["sr"] is None
+    with pytest.raises(ValueError):
+        analysis_params("turbo")
+
+    response = client.post("/analyze/", files={"file": ("test.wav", b"RIFF", "audio/wav")}, data={"profile": "turbo"})
+    assert response.status_code == 400
+    assert "Invalid profile" in response.json()["detail"]
+
+def test_streaming_features_match_librosa_frame_grid():
+    """Test that block-wise accumulation yields librosa's frame count and keeps pooled features under the cap."""
+    sr, hop = 22050, 512
+    y = np.random.default_rng(0).standard_normal(sr * 3).astype(np.float32)
+    features = StreamingFeatures(sr, hop, max_pooled_frames=16)
+    for start in range(0, len(y), 10000):  # blocks not aligned to the hop
+        features.update(y[start:start + 10000])
+    features.finish()
+
+    expected_frames = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop).shape[0]
+    assert features.n_frames == expected_frames == len(features.onset_envelope)
+    assert features.pooled_features.shape[0] == 13
+    assert features.pooled_features.shape[1] < 16
+    assert features.pool_size > 1
+
+def test_streaming_chroma_matches_in_memory_cqt(monkeypatch):
+    """Test that block-wise chroma equals the in-memory CQT chroma, so keys and style vectors share one feature."""
+    monkeypatch.setattr(streaming, "CQT_RUN_SECONDS", 1.0)  # several CQT runs over a short signal
+    sr, hop = 22050, 512
+    t = np.arange(sr * 8) / sr
+    y = (np.sin(2 * np.pi * 220 * t) + 0.5 * np.sin(2 * np.pi * 277.18 * t)).astype(np.float32)
+    features = StreamingFeatures(sr, hop)
+    for start in range(0, len(y), 10000):
+        features.update(y[start:start + 10000])
+    features.finish()
+
+    expected = FeatureContext(y, sr).chroma
+    assert features.n_chroma_frames == features.n_frames == expected.shape[1]
+    np.testing.assert_allclose(features.chroma_sum / features.n_frames, expected.mean(axis=1), atol=1e-4)
+
+def test_long_tracks_are_streamed(dummy_audio_file, monkeypatch):
+    """Test that analyze_audio switches to the streaming path above the duration threshold."""
+    in_memory = analyze_audio(dummy_audio_file)
+    monkeypatch.setattr(analyzer, "STREAMING_MIN_DURATION", 1.0)
+    streamed = analyze_audio(dummy_audio_file)
+
+    assert streamed == analyze_stream(dummy_audio_file, 22050, analyzer.HOP_LENGTH, "soxr_hq")
+    assert streamed.key == in_memory.key
+    assert streamed.tempo > 0
+    assert streamed.segments[-1].end_time == pytest.approx(5.0, abs=0.05)
+
+def test_beat_synchronous_clustering():
+    """Test that boundaries fall on beats and that the segment count adapts to the duration."""
+    # Two clearly different halves, 40 beats of 10 frames each.
+    features = np.hstack([np.tile([[1.0], [0.0]], 200), np.tile([[0.0], [1.0]], 200)])
+    beats = np.arange(0, 400, 10)
+    boundaries = cluster_boundaries(features, beats, num_segments=2, coarse_columns=20)
+    assert list(boundaries) == [0, 200]
+
+    # Without beats, fixed groups of columns are clustered instead.
+    assert list(cluster_boundaries(features, np.array([], dtype=int), num_segments=2, coarse_columns=20)) == [0, 200]
+
+    assert adaptive_num_segments(5.0) == 2
+    assert adaptive_num_segments(180.0) == 9
+    assert adaptive_num_segments(3600.0) == 64
+
+def test_uploads_decoded_from_memory_or_spilled(dummy_audio_file, monkeypatch):
+    """Test that small uploads are analyzed from memory and large ones through a temporary file that is removed."""
+    with open(dummy_audio_file, "rb") as f:
+        audio = f.read()
+    assert analyze_audio(audio) == analyze_audio(dummy_audio_file)
+
+    sources = []
+
+    async def run_inline(fn, source, *args):
+        sources.append(source)
+        return fn(source, *args)
+
+    monkeypatch.setattr(main, "analysis_cache", None)
+    monkeypatch.setattr(main.analysis_pool, "run", run_inline)
+
+    for spill_bytes in (len(audio), len(audio) // 3):
+        monkeypatch.setattr(main, "ANALYSIS_SPILL_BYTES", spill_bytes)
+        response = client.post("/analyze/", files={"file": ("test.wav", audio, "audio/wav")})
+        assert response.status_code == 200
+
+    in_memory, spilled = sources
+    assert in_memory == audio
+    assert isinstance(spilled, str) and not os.path.exists(spilled)
+
+def test_api_batch_streams_uploads_and_stems_paths(dummy_audio_file, tmp_path, monkeypatch):
+    """Test /analyze/batch with multipart uploads and with stems paths, including per-item errors."""
+    with open(dummy_audio_file, "rb") as f:
+        audio = f.read()
+    response = client.post("/analyze/batch", files=[
+        ("files", ("one.wav", audio, "audio/wav")),
+        ("files", ("notes.txt", b"text", "text/plain")),
+        ("files", ("two.wav", audio, "audio/wav")),
+    ])
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    items = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda item: item["index"])
+    assert [item["name"] for item in items] == ["one.wav", "notes.txt", "two.wav"]
+    assert items[0]["result"] == items[2]["result"] and items[0]["result"]["tempo"] > 0
+    assert "Invalid file type" in items[1]["error"] and items[1]["result"] is None
+    uploaded_result = items[0]["result"]
+
+    (tmp_path / "refs").mkdir()
+    (tmp_path / "refs" / "track.wav").write_bytes(audio)
+    monkeypatch.setattr(main, "STEMS_DIR", str(tmp_path))
+    response = client.post("/analyze/batch", json={"paths": ["refs/track.wav", str(tmp_path / "refs" / "track.wav"), "../etc/passwd"]})
+    items = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda item: item["index"])
+    # The relative and the absolute path name the file uploaded above, so both are answered from the cache.
+    assert items[0]["result"] == items[1]["result"] == uploaded_result
+    assert items[0]["cached"] and items[1]["cached"]
+    assert "outside" in items[2]["error"]
+
+    assert client.post("/analyze/batch", json={"paths": []}).status_code == 400
+
+def test_key_estimation_matrix_matches_correlation_loop():
+    """Test that the profile matrix reproduces the per-key correlations and labels, and flags silence."""
+    rng = np.random.default_rng(0)
+    chroma = rng.random(12)
+    expected = [np.corrcoef(chroma, np.roll(keys.MAJOR_PROFILE, i))[0, 1] for i in range(12)]
+    expected += [np.corrcoef(chroma, np.roll(keys.MINOR_PROFILE, i))[0, 1] for i in range(12)]
+    np.testing.assert_allclose(keys.key_correlations(chroma), expected)
+
+    a_minor = np.roll(keys.MINOR_PROFILE, 9)
+    estimate = keys.estimate_key(a_minor)
+    assert estimate.key == "A Minor"
+    assert estimate.correlation == pytest.approx(1.0)
+    assert 0 < estimate.confidence <= 1
+    assert keys.estimate_key(np.zeros((12, 10))).key == keys.UNKNOWN_KEY
+
+def test_windowed_key_tracking():
+    """Test that key changes are tracked window by window."""
+    c_major = np.tile(np.roll(keys.MAJOR_PROFILE, 0)[:, None], 100)
+    e_minor = np.tile(np.roll(keys.MINOR_PROFILE, 4)[:, None], 100)
+    spans = keys.track_keys(np.hstack([c_major, e_minor]), window_frames=50, hop_frames=50)
+    assert [(s.start_frame, s.end_frame) for s in spans] == [(0, 50), (50, 100), (100, 150), (150, 200)]
+    assert [s.estimate.key for s in spans] == ["C Major", "C Major", "E Minor", "E Minor"]
+
+def test_key_module_copies_are_identical():
+    """Test that the QA service's copy of keys.py matches this one."""
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    qa_copy = os.path.join(here, "..", "n3ziZ84", "keys.py")
+    if not os.path.exists(qa_copy):
+        pytest.skip("QA service sources are not available (e.g. inside the service image).")
+    with open(os.path.join(here, "keys.py"), "rb") as a, open(qa_copy, "rb") as b:
+        assert a.read() == b.read()
+
+def _indexed_result(vector):
+    return AnalysisResult(tempo=120.0, key="C Major", segments=[], style_vector=list(vector))
+
+def test_similarity_index_search_and_persistence(tmp_path, monkeypatch):
+    """Test exact and approximate nearest-neighbour search, replacement and reloading from the log."""
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(1500, VECTOR_SIZE))
+    path = str(tmp_path / "index.jsonl")
+    index = SimilarityIndex(path, "1")
+    for i, vector in enumerate(vectors):
+        index.add(f"hash{i}", f"track{i}.wav", _indexed_result(vector))
+    assert len(index) == 1500
+
+    query = vectors[42] + 0.01
+    exact = index.search(query, k=3)
+    assert exact[0].content_hash == "hash42" and exact[0].name == "track42.wav"
+    assert [n.distance for n in exact] == sorted(n.distance for n in exact)
+    assert index.search(query, k=3, exclude="hash42")[0].content_hash == exact[1].content_hash
+    monkeypatch.setattr(similarity, "APPROXIMATE_PROBES", 1000)  # probing every list must give the exact answer
+    assert [n.content_hash for n in index.search(query, k=3, approximate=True)] == [n.content_hash for n in exact]
+
+    index.add("hash42", "renamed.wav", _indexed_result(vectors[7]))
+    reloaded = SimilarityIndex(path, "1")
+    assert len(reloaded) == 1500 and "hash42" in reloaded
+    assert reloaded.search(vectors[7], k=2)[1].name == "renamed.wav"
+    assert len(SimilarityIndex(path, "2")) == 0  # other analyzer versions are ignored
+    with pytest.raises(ValueError):
+        index.search([0.0] * 3)
+
+def test_api_similar(dummy_audio_file):
+    """Test that analyses are indexed and /similar finds them by content hash or style vector."""
+    with open(dummy_audio_file, "rb") as f:
+        audio = f.read()
+    t = np.arange(5 * 22050) / 22050
+    other = io.BytesIO()
+    sf.write(other, (0.3 * np.sin(2 * np.pi * 261.63 * t)).astype(np.float32), 22050, format="WAV")
+    first = client.post("/analyze/", files={"file": ("a440.wav", audio, "audio/wav")}).json()
+    assert len(first["style_vector"]) == VECTOR_SIZE
+    client.post("/analyze/", files={"file": ("c261.wav", other.getvalue(), "audio/wav")})
+
+    response = client.get(f"/similar/{hashlib.sha256(audio).hexdigest()}", params={"k": 1})
+    assert response.status_code == 200
+    assert response.json()["indexed"] >= 2
+    assert [m["name"] for m in response.json()["matches"]] == ["c261.wav"]
+
+    response = client.post("/similar", json={"style_vector": first["style_vector"], "k": 1})
+    assert response.json()["matches"][0]["result"] == first
+    assert client.get(f"/similar/{'0' * 64}").status_code == 404
+    assert client.post("/similar", json={"k": 1}).status_code == 400
+    assert client.post("/similar", json={"style_vector": [1.0, 2.0]}).status_code == 400
+
+def test_analysis_pool_relays_progress(dummy_audio_file):
+    """Test that the partial tempo and key reach the caller before the full result."""
+    pool = AnalysisPool(workers=1, max_queue=0)
+    partials = []
+    try:
+        result = asyncio.run(pool.run_with_progress(analyze_audio, partials.append, dummy_audio_file, "fast"))
+    finally:
+        pool.shutdown()
+    assert len(partials) == 1
+    assert partials[0].segments == [] and partials[0].style_vector is None
+    assert (partials[0].tempo, partials[0].key) == (result.tempo, result.key)
+    assert result.segments
+
+def test_api_analysis_jobs(dummy_audio_file):
+    """Test the asynchronous job API from submission to the final result."""
+    with open(dummy_audio_file, "rb") as f:
+        audio = f.read()
+    with TestClient(app) as job_client:  # keeps the event loop, and the job task, alive between requests
+        response = job_client.post("/analyze/jobs", files={"file": ("job.wav", audio, "audio/wav")})
+        assert response.status_code == 202
+        job = response.json()
+        assert job["status"] == "pending" and response.headers["Location"] == f"/analyze/jobs/{job['job_id']}"
+
+        deadline = time.time() + 60
+        while job["status"] in ("pending", "partial") and time.time() < deadline:
+            time.sleep(0.05)
+            job = job_client.get(f"/analyze/jobs/{job['job_id']}").json()
+        assert job["status"] == "done", job
+        assert job["result"]["segments"] and job["result"]["tempo"] > 0
+        assert 0 <= job["partial_seconds"] <= job["done_seconds"]
+
+        assert job_client.get("/analyze/jobs/unknown").status_code == 404
+        assert job_client.post("/analyze/jobs", files={"file": ("a.txt", b"x", "text/plain")}).status_code == 400
+
+def test_time_window_analysis(tmp_path, monkeypatch):
+    """Test that offset/duration analyze only the window, on both paths, with segment times on the track's timeline."""
+    sr = 22050
+    t = np.arange(6 * sr) / sr
+    first = 0.5 * np.sin(2 * np.pi * 440.0 * t)
+    second = 0.5 * np.sin(2 * np.pi * 261.63 * t) * (np.sin(2 * np.pi * 2.0 * t) > 0)
+    track, excerpt = str(tmp_path / "track.wav"), str(tmp_path / "excerpt.wav")
+    sf.write(track, np.concatenate([first, second, first]).astype(np.float32), sr)
+    sf.write(excerpt, second.astype(np.float32), sr)
+
+    windowed = analyze_audio(track, offset=6.0, duration=6.0)
+    alone = analyze_audio(excerpt)
+    assert (windowed.tempo, windowed.key) == (alone.tempo, alone.key)
+    assert windowed.segments[0].start_time == pytest.approx(6.0)
+    assert windowed.segments[-1].end_time == pytest.approx(12.0, abs=0.05)
+
+    monkeypatch.setattr(analyzer, "STREAMING_MIN_DURATION", 0.0)
+    streamed = analyze_audio(track, offset=6.0, duration=6.0)
+    assert streamed.key == analyze_audio(excerpt).key
+    assert 6.0 <= streamed.segments[0].start_time and streamed.segments[-1].end_time <= 12.05
+    with pytest.raises(IOError):
+        analyze_audio(track, offset=60.0)
+
+def test_api_time_window(dummy_audio_file):
+    """Test the offset and duration form fields of /analyze/."""
+    with open(dummy_audio_file, "rb") as f:
+        audio = f.read()
+    whole = client.post("/analyze/", files={"file": ("w.wav", audio, "audio/wav")})
+    window = client.post("/analyze/", files={"file": ("w.wav", audio, "audio/wav")}, data={"offset": "1.5", "duration": "2"})
+    assert window.status_code == 200 and window.headers["X-Cache"] == "MISS"
+    assert window.json()["segments"][0]["start_time"] == pytest.approx(1.5)
+    assert window.json()["segments"][-1]["end_time"] == pytest.approx(3.5, abs=0.05)
+    assert window.json() != whole.json()
+    for window in ({"offset": "-1"}, {"offset": "nan"}, {"offset": "inf"}, {"duration": "nan"}, {"duration": "-inf"}):
+        bad = client.post("/analyze/", files={"file": ("w.wav", audio, "audio/wav")}, data=window)
+        assert bad.status_code == 400, window
+
+def test_ready_after_warm_up():
+    """Test that /ready answers 503 until every worker has warmed up, then 200."""
+    assert client.get("/ready").status_code == 503  # no lifespan, so the pool was never started
+    with TestClient(app) as ready_client:
+        deadline = time.time() + 300
+        while (response := ready_client.get("/ready")).status_code == 503 and time.time() < deadline:
+            assert response.headers["Retry-After"]
+            time.sleep(0.2)
+        assert response.status_code == 200
+        assert response.json()["ready"] and response.json()["warm_up_seconds"] > 0
+    assert client.get("/ready").status_code == 503
+
+def test_benchmark_ground_truth(tmp_path):
+    """Test the benchmark suite's synthetic sections and boundary scoring."""
+    from benchmarks.signals import boundary_f_measure, write_track
+    path = str(tmp_path / "track.wav")
+    key, boundaries = write_track(path, 50.0, 8000, tempo=120.0, tonic="E", mode="Major", section_seconds=20.0)
+    assert key == "E Major" and boundaries == [20.0, 40.0]
+    assert sf.info(path).duration == pytest.approx(50.0)
+    assert boundary_f_measure([21.0, 39.0], boundaries) == 1.0
+    assert boundary_f_measure([21.0, 30.0], boundaries) == pytest.approx(0.5)
+    assert boundary_f_measure([], boundaries) == 0.0 and boundary_f_measure([], []) == 1.0
+
+def test_failed_warm_up_is_not_ready(monkeypatch):
+    """Test that a worker's failed warm-up is reported, and keeps /ready at 503."""
+    def broken(*args, **kwargs):
+        raise RuntimeError("numba cache is not writable")
+
+    monkeypatch.setattr(analyzer, "analyze_audio", broken)
+    monkeypatch.setattr(worker_pool, "_warm_up_error", None)
+    worker_pool._warm_up()  # in this process, as the worker initializer would run it
+    assert worker_pool._ping() == (os.getpid(), "RuntimeError: numba cache is not writable")
+
+    monkeypatch.setattr(main.analysis_pool, "ready", False)
+    monkeypatch.setattr(main.analysis_pool, "warm_up_error", "RuntimeError: numba cache is not writable")
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert "Retry-After" not in response.headers
+    assert response.json()["error"] == "RuntimeError: numba cache is not writable"
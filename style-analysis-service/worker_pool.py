@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from schemas import PoolStats, WorkerStats
+
+logger = logging.getLogger(__name__)
+
+
+class PoolOverloaded(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+# Set in a worker process whose warm-up failed; reported to the pool by `_ping`.
+_warm_up_error: Optional[str] = None
+
+
+def _warm_up() -> None:
+    """
+    Worker initializer: runs the full analysis once on a short synthetic track,
+    so librosa's lazy imports, numba compilation (beat tracking, CQT, MFCC,
+    resampling) and FFT planning happen at startup rather than on the first
+    real request. The track is a 44.1 kHz WAV in memory, so decoding,
+    resampling to the `fast` rate and the block-streaming path are covered too.
+    """
+    import io
+    import numpy as np
+    import soundfile as sf
+    from analyzer import HOP_LENGTH, analyze_audio
+    from streaming import analyze_stream
+
+    sr = 44100
+    t = np.arange(4 * sr) / sr
+    # An A minor triad with a click on every beat at 120 BPM, so beat tracking finds beats.
+    y = sum(0.2 * np.sin(2 * np.pi * f * t) for f in (220.0, 261.63, 329.63))
+    y[(t % 0.5) < 0.01] += 0.5
+    wav = io.BytesIO()
+    sf.write(wav, y.astype(np.float32), sr, format="WAV")
+    global _warm_up_error
+    try:
+        analyze_audio(wav.getvalue(), "fast")
+        analyze_audio(wav.getvalue(), "accurate")
+        analyze_stream(wav.getvalue(), 22050, HOP_LENGTH, "soxr_hq")
+    except Exception as e:
+        # The worker stays in the pool, but the failure is reported so the service is not marked ready.
+        _warm_up_error = f"{type(e).__name__}: {e}"
+        logger.error(f"Analysis worker warm-up failed: {_warm_up_error}")
+
+
+def _ping() -> Tuple[int, Optional[str]]:
+    """
+    Holds a worker briefly, so concurrent pings land on different workers, and
+    reports its pid and its warm-up error, if any.
+    """
+    time.sleep(0.1)
+    return os.getpid(), _warm_up_error
+
+
+def _timed_call(fn: Callable[..., Any], args: Tuple[Any, ...],
+                kwargs: Optional[Dict[str, Any]] = None) -> Tuple[int, float, Any]:
+    """Runs a task in a worker and reports which worker ran it and for how long."""
+    started = time.perf_counter()
+    result = fn(*args, **(kwargs or {}))
+    return os.getpid(), time.perf_counter() - started, result
+
+
+class AnalysisPool:
+    """
+    A process pool for CPU-bound analysis with bounded queueing.
+
+    At most `workers` tasks run at once and at most `max_queue` more wait for a
+    free worker; `run` raises `PoolOverloaded` beyond that instead of letting
+    the backlog grow without limit. The pool is created on first use, or
+    eagerly (with every worker warmed up) by `start`. Busy time is accounted
+    per worker process, so the utilization of each core can be reported.
+
+    `run_with_progress` also relays intermediate results the task reports
+    before it returns, through a queue served by a multiprocessing manager
+    (started by `start`, or on first use). Each relay blocks a thread of the
+    pool's own executor, sized for every task that can be in flight, so relays
+    never tie up the event loop's default executor.
+
+    `run` must be called from a single event loop; its counters are not locked.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        if workers < 1:
+            raise ValueError("workers must be at least 1.")
+        if max_queue < 0:
+            raise ValueError("max_queue must be zero or positive.")
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._manager_lock = threading.Lock()
+        # One thread per relayed task, waiting on its progress queue; started with the manager.
+        self._relay_executor: Optional[ThreadPoolExecutor] = None
+        # Set once `start` has seen every worker finish its warm-up, unless one of them failed.
+        self.ready = False
+        self.warm_up_seconds: Optional[float] = None
+        self.warm_up_error: Optional[str] = None
+        self._started_at = time.monotonic()
+        self._in_flight = 0
+        self._rejected = 0
+        # worker pid -> [tasks completed, busy seconds]
+        self._busy: Dict[int, List[float]] = {}
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # "spawn" keeps workers independent of the server's threads and event loop.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up,
+            )
+            self._started_at = time.monotonic()
+        return self._executor
+
+    def _ensure_manager(self) -> Tuple[Any, ThreadPoolExecutor]:
+        """
+        Starts the progress queue manager (a server process) and the relay
+        threads; blocking, so call it off the event loop.
+        """
+        with self._manager_lock:
+            if self._manager is None:
+                self._manager = multiprocessing.get_context("spawn").Manager()
+                self._relay_executor = ThreadPoolExecutor(max_workers=self.workers + self.max_queue,
+                                                          thread_name_prefix="analysis-progress")
+            return self._manager, self._relay_executor
+
+    async def start(self, timeout: float = 300.0) -> None:
+        """
+        Starts every worker and the progress manager, and waits until all
+        workers are warmed up. If a worker's warm-up fails, or not every worker
+        answers within `timeout`, the pool is left not ready with the reason in
+        `warm_up_error`.
+        """
+        started = time.perf_counter()
+        pids: Dict[int, Optional[str]] = {}
+        try:
+            executor = self._ensure_executor()
+            loop = asyncio.get_running_loop()
+            await asyncio.to_thread(self._ensure_manager)
+            # Each submission finds no idle worker and spawns a new one, until the pool is full. A
+            # worker that finished warming up early may answer several pings, so ping in rounds
+            # until every worker has answered.
+            while len(pids) < self.workers and time.perf_counter() - started < timeout:
+                pids.update(await asyncio.gather(*(loop.run_in_executor(executor, _ping) for _ in range(self.workers))))
+            errors = sorted({error for error in pids.values() if error})
+            if errors:
+                self.warm_up_error = "; ".join(errors)
+            elif len(pids) < self.workers:
+                self.warm_up_error = f"Only {len(pids)} of {self.workers} workers warmed up within {timeout:.0f}s."
+        except Exception as e:
+            self.warm_up_error = f"{type(e).__name__}: {e}"
+        self.warm_up_seconds = time.perf_counter() - started
+        self.ready = self.warm_up_error is None
+        if self.ready:
+            logger.info(f"Started {len(pids)} analysis workers in {self.warm_up_seconds:.1f}s")
+        else:
+            logger.error(f"Analysis workers failed to warm up: {self.warm_up_error}")
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Runs `fn(*args, **kwargs)` in a worker process and returns its result."""
+        if self.full:
+            self._rejected += 1
+            raise PoolOverloaded(f"{self._in_flight} analyses are already running or queued.")
+
+        executor = self._ensure_executor()
+        self._in_flight += 1
+        try:
+            pid, busy, result = await asyncio.get_running_loop().run_in_executor(executor, _timed_call, fn, args, kwargs)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for running out of memory); start a fresh pool next time.
+            logger.error("Analysis worker pool is broken; it will be restarted.")
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            self._in_flight -= 1
+
+        counters = self._busy.setdefault(pid, [0, 0.0])
+        counters[0] += 1
+        counters[1] += busy
+        return result
+
+    @property
+    def full(self) -> bool:
+        """Whether `run` would currently be rejected."""
+        return self._in_flight >= self.workers + self.max_queue
+
+    async def run_with_progress(self, fn: Callable[..., Any], on_progress: Callable[[Any], None], *args: Any) -> Any:
+        """
+        Runs `fn(*args, progress=report)` in a worker process and returns its result.
+
+        `fn` may call `report(value)` any number of times while it runs; each
+        value is passed to `on_progress` on the event loop, in order, before
+        the result is returned.
+        """
+        if self.full:
+            self._rejected += 1
+            raise PoolOverloaded(f"{self._in_flight} analyses are already running or queued.")
+        loop = asyncio.get_running_loop()
+        # Starting the manager and creating a queue are round trips to the manager process.
+        manager, relay_executor = await asyncio.to_thread(self._ensure_manager)
+        queue = await asyncio.to_thread(manager.Queue)
+
+        async def relay() -> None:
+            while (value := await loop.run_in_executor(relay_executor, queue.get)) is not None:
+                on_progress(value)
+
+        relaying = asyncio.ensure_future(relay())
+        try:
+            return await self.run(fn, *args, progress=queue.put)
+        finally:
+            # The task has finished, so everything it reported is already queued ahead of this.
+            await asyncio.to_thread(queue.put, None)
+            await relaying
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+            self._relay_executor.shutdown(wait=False, cancel_futures=True)
+            self._relay_executor = None
+        self.ready = False
+
+    def stats(self) -> PoolStats:
+        """Returns queue depth and the per-worker task counts and utilization."""
+        uptime = max(time.monotonic() - self._started_at, 1e-9)
+        return PoolStats(
+            workers=self.workers,
+            max_queue=self.max_queue,
+            running=min(self._in_flight, self.workers),
+            queued=max(self._in_flight - self.workers, 0),
+            rejected=self._rejected,
+            uptime_seconds=uptime,
+            per_worker=[
+                WorkerStats(pid=pid, tasks=int(tasks), busy_seconds=busy, utilization=min(busy / uptime, 1.0))
+                for pid, (tasks, busy) in sorted(self._busy.items())
+            ],
+        )